@@ -0,0 +1,85 @@
+"""
+Cache xác thực trong process: session user_id / X-API-Key → Principal bất biến
+(role, can_view_data, tập slot được gán) để mỗi request API không phải query
+users + user_slots. TTL ngắn giới hạn độ trễ giữa các process; các route ghi
+users / user_slots gọi invalidate_principal(s) để áp dụng ngay.
+"""
+
+import os
+import threading
+import time
+from typing import FrozenSet, NamedTuple, Optional
+
+from sqlalchemy.orm import Session
+
+from crawler.db import User, UserSlot
+
+AUTH_CACHE_TTL = float(os.getenv("AUTH_CACHE_TTL", "30"))  # 0 = luôn đọc DB
+
+
+class Principal(NamedTuple):
+    """Snapshot của một user đang active. slots = None nghĩa là mọi slot (admin)."""
+    id: int
+    username: str
+    email: Optional[str]
+    role: str
+    can_view_data: bool
+    api_key: Optional[str]
+    slots: Optional[FrozenSet[str]]
+
+    @property
+    def is_admin(self) -> bool:
+        return self.role == "admin"
+
+
+def _load_principal(db: Session, user: Optional[User]) -> Optional[Principal]:
+    if user is None:
+        return None
+    slots = None
+    if user.role != "admin":
+        slots = frozenset(s[0] for s in db.query(UserSlot.slot).filter(UserSlot.user_id == user.id).all())
+    return Principal(user.id, user.username, user.email, user.role, bool(user.can_view_data), user.api_key, slots)
+
+
+_lock = threading.Lock()
+_entries = {}  # ("id", user_id) | ("key", api_key) -> (expires_at, Principal)
+
+
+def _cached(key, load) -> Optional[Principal]:
+    now = time.monotonic()
+    with _lock:
+        item = _entries.get(key)
+        if item is not None and item[0] > now:
+            return item[1]
+    principal = load()
+    if principal is not None and AUTH_CACHE_TTL > 0:
+        with _lock:
+            _entries[key] = (now + AUTH_CACHE_TTL, principal)
+    return principal
+
+
+def principal_for_user_id(db: Session, user_id: int) -> Optional[Principal]:
+    """Principal của user active có id này (session web); None nếu không tồn tại / đã khóa."""
+    return _cached(("id", user_id), lambda: _load_principal(
+        db, db.query(User).filter(User.id == user_id, User.is_active == True).first()
+    ))
+
+
+def principal_for_api_key(db: Session, api_key: str) -> Optional[Principal]:
+    """Principal của user active có api_key này; key sai không được cache."""
+    return _cached(("key", api_key), lambda: _load_principal(
+        db, db.query(User).filter(User.api_key == api_key, User.is_active == True).first()
+    ))
+
+
+def invalidate_principal(user_id: int) -> None:
+    """Bỏ mọi entry của một user (sau khi sửa user, đổi key, khóa, đổi slot)."""
+    with _lock:
+        for key in [k for k, (_, p) in _entries.items() if p.id == user_id]:
+            del _entries[key]
+
+
+def invalidate_principals() -> None:
+    """Bỏ toàn bộ cache (thay đổi gán slot cho nhiều user cùng lúc)."""
+    with _lock:
+        _entries.clear()
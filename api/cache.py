@@ -0,0 +1,153 @@
+"""
+Response cache cho các endpoint chỉ đọc (/api/data, /api/aggregated-metrics, trang /data).
+
+Dữ liệu chỉ thay đổi khi crawler ghi hoặc khi tính lại share / công thức, nên khóa cache
+gồm (endpoint, query params đã chuẩn hóa, phạm vi user, data_version). Mỗi lần ghi,
+bump_data_version() tăng bộ đếm → mọi khóa cũ tự hết hiệu lực (và bị LRU/TTL dọn).
+Response trả kèm ETag; client gửi If-None-Match trùng thì nhận 304 không body.
+"""
+
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, NamedTuple, Optional
+
+from fastapi import Request, Response
+from sqlalchemy.exc import OperationalError, ProgrammingError
+from sqlalchemy.orm import Session
+
+from crawler.db import get_data_version
+
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", "300"))  # 0 = tắt cache (vẫn có ETag)
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "256"))
+# data_version được ghi bởi process khác (crawler, worker) → đọc lại tối đa mỗi N giây
+DATA_VERSION_CHECK_SECONDS = float(os.getenv("DATA_VERSION_CHECK_SECONDS", "5"))
+
+# Header của response gốc không lưu lại (được tính lại khi trả từ cache)
+_SKIP_HEADERS = {"content-length", "content-type", "etag", "cache-control"}
+
+
+class CachedResponse(NamedTuple):
+    body: bytes
+    media_type: str
+    headers: Dict[str, str]
+    etag: str
+
+
+class ResponseCache:
+    """Thread-safe LRU + TTL, dùng chung cho mọi request của một process API."""
+
+    def __init__(self, max_entries: int = RESPONSE_CACHE_MAX_ENTRIES, ttl: float = RESPONSE_CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()  # key -> (expires_at, CachedResponse)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.ttl > 0 and self.max_entries > 0
+
+    def get(self, key) -> Optional[CachedResponse]:
+        with self._lock:
+            item = self._entries.get(key)
+            if item is not None and item[0] > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return item[1]
+            if item is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, key, entry: CachedResponse) -> None:
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, entry)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+response_cache = ResponseCache()
+
+_version_lock = threading.Lock()
+_version_state = {"version": None, "checked_at": 0.0}
+
+
+def current_data_version(db: Session) -> Optional[int]:
+    """data_version hiện tại (đọc lại sau DATA_VERSION_CHECK_SECONDS); None nếu chưa có bảng."""
+    now = time.monotonic()
+    with _version_lock:
+        if _version_state["version"] is not None and now - _version_state["checked_at"] < DATA_VERSION_CHECK_SECONDS:
+            return _version_state["version"]
+    try:
+        version = get_data_version(db)
+    except (OperationalError, ProgrammingError):
+        # Chưa chạy migrations_add_data_version.sql → không cache, chỉ dùng ETag
+        db.rollback()
+        return None
+    with _version_lock:
+        _version_state["version"] = version
+        _version_state["checked_at"] = now
+    return version
+
+
+def forget_data_version() -> None:
+    """Đọc lại data_version ở request kế tiếp (gọi sau khi chính process API bump)."""
+    with _version_lock:
+        _version_state["checked_at"] = 0.0
+
+
+def cache_key(request: Request, scope, version: Optional[int]):
+    """(endpoint, params đã sắp xếp bỏ giá trị rỗng, phạm vi user, data_version); None = không cache."""
+    if version is None:
+        return None
+    params = tuple(sorted((k, v) for k, v in request.query_params.multi_items() if v != ""))
+    return (request.url.path, params, scope, version)
+
+
+def _etag(body: bytes) -> str:
+    return '"' + hashlib.sha1(body).hexdigest() + '"'
+
+
+def _etag_matches(request: Request, etag: str) -> bool:
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    candidates = [c.strip() for c in header.split(",")]
+    # So sánh weak (bỏ tiền tố W/) như RFC 9110 quy định cho If-None-Match
+    return "*" in candidates or etag in [c[2:] if c.startswith("W/") else c for c in candidates]
+
+
+def cached_response(request: Request, key, render: Callable[[], Response]) -> Response:
+    """
+    Trả response cho `key` từ cache, hoặc gọi render() rồi lưu lại (chỉ response 200).
+    Luôn gắn ETag; If-None-Match trùng → 304.
+    """
+    entry = response_cache.get(key) if key is not None and response_cache.enabled else None
+    if entry is None:
+        response = render()
+        if response.status_code != 200:
+            return response
+        headers = {k: v for k, v in response.headers.items() if k.lower() not in _SKIP_HEADERS}
+        media_type = response.headers.get("content-type") or response.media_type
+        entry = CachedResponse(bytes(response.body), media_type, headers, _etag(response.body))
+        if key is not None and response_cache.enabled:
+            response_cache.put(key, entry)
+
+    headers = dict(entry.headers)
+    headers["ETag"] = entry.etag
+    headers["Cache-Control"] = "private, no-cache"
+    if _etag_matches(request, entry.etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=entry.body, media_type=entry.media_type, headers=headers)
@@ -2,9 +2,11 @@
 API Service - FastAPI để query metrics
 """
 
-from fastapi import FastAPI, HTTPException, Depends, Query, Request, Form, Header
+from fastapi import FastAPI, HTTPException, Depends, Query, Request, Form, Header, Response
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import HTMLResponse, RedirectResponse
+from fastapi.responses import HTMLResponse, RedirectResponse, StreamingResponse, JSONResponse
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import FormData
 from sqlalchemy.orm import Session
 from typing import List, Optional
 from datetime import date
@@ -13,6 +15,7 @@ from starlette.middleware.sessions import SessionMiddleware
 
 from crawler.db import (
     get_db_session,
+    SessionLocal,
     RawRevenueData,
     ComputedMetric,
     AggregatedMetric,
@@ -20,9 +23,18 @@ from crawler.db import (
     Formula,
     User,
     SlotShareConfig,
+    ShareRecalcJob,
+    CrawlJob,
     UserSlot,
     get_share_for_slot,
+    invalidate_share_resolver,
+    bump_data_version,
 )
+from crawler.worker import enqueue_share_recalc, enqueue_crawl
+from api.cache import cache_key, cached_response, current_data_version, forget_data_version
+from api.auth import Principal, principal_for_user_id, principal_for_api_key, invalidate_principal, invalidate_principals
+from api.metrics import PrometheusMiddleware, QueryStatsMiddleware, metrics_payload
+from crawler.querystats import SQL_INSTRUMENTATION
 
 # Import processed data model
 try:
@@ -49,12 +61,17 @@ except ImportError:
         rpm_2 = Column(Numeric(10, 2))
         fetch_date = Column(Date, nullable=False)
         processed_at = Column(DateTime)
-from sqlalchemy import text
+from sqlalchemy import text, and_, or_, func, case
 from sqlalchemy.exc import OperationalError, ProgrammingError
 import os
 import html
-import threading
-from datetime import date as date_type, datetime
+import json
+import base64
+import csv
+import io
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date as date_type, datetime, timedelta
 from pydantic import BaseModel
 
 app = FastAPI(
@@ -63,22 +80,19 @@ app = FastAPI(
     version="1.0.0"
 )
 
-# Global variable to track crawl status
-crawl_status = {
-    "running": False,
-    "last_run": None,
-    "last_result": None
-}
-
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "ETag"],
 )
 SECRET_KEY = os.getenv("SECRET_KEY", "change-me-in-production-use-env")
 app.add_middleware(SessionMiddleware, secret_key=SECRET_KEY)
+app.add_middleware(PrometheusMiddleware)
+if SQL_INSTRUMENTATION:
+    app.add_middleware(QueryStatsMiddleware)
 
 # Base URL for API Docs / links (from env, no trailing slash)
 BASE_URL = os.getenv("BASE_URL", "https://beta.gliacloud.online").rstrip("/")
@@ -97,6 +111,45 @@ def _parse_optional_date(s) -> Optional[date]:
         return None
 
 
+def _encode_cursor(row) -> str:
+    """Opaque keyset cursor for the last row of a page: (fetch_date, slot, id)."""
+    payload = json.dumps([row.fetch_date.isoformat(), row.slot, row.id], separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+
+def _decode_cursor(cursor: str):
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        fetch_date, slot, row_id = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        return datetime.strptime(fetch_date, "%Y-%m-%d").date(), str(slot), int(row_id)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def _keyset_page(query, model, cursor: Optional[str], offset: int, limit: int, response: Response):
+    """
+    One page ordered by (fetch_date desc, slot, id). With `cursor`, seek past the previous page's
+    last row (index range scan) instead of OFFSET; `offset` still works for old clients.
+    Sets X-Next-Cursor when there may be more rows.
+    """
+    query = query.order_by(model.fetch_date.desc(), model.slot, model.id)
+    if cursor:
+        fetch_date, slot, row_id = _decode_cursor(cursor)
+        query = query.filter(or_(
+            model.fetch_date < fetch_date,
+            and_(model.fetch_date == fetch_date, or_(
+                model.slot > slot,
+                and_(model.slot == slot, model.id > row_id)
+            ))
+        ))
+    elif offset:
+        query = query.offset(offset)
+    results = query.limit(limit).all()
+    if len(results) == limit:
+        response.headers["X-Next-Cursor"] = _encode_cursor(results[-1])
+    return results
+
+
 # Dependency
 def get_db():
     db = next(get_db_session())
@@ -117,15 +170,28 @@ def _password_72(password: str) -> str:
         return password
     return raw[:72].decode("utf-8", errors="replace")
 
+# bcrypt tốn CPU (~0.1-0.3s/lần): chạy trong pool riêng có giới hạn để login dồn dập
+# không chiếm hết threadpool đang phục vụ các request đọc dữ liệu
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", "2"))
+_password_pool = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="password-hash")
+
 def hash_password(password: str) -> str:
-    return pwd_ctx.hash(_password_72(password))
+    return _password_pool.submit(pwd_ctx.hash, _password_72(password)).result()
 
 def verify_password(plain: str, hashed: str) -> bool:
-    return pwd_ctx.verify(_password_72(plain), hashed)
+    return _password_pool.submit(pwd_ctx.verify, _password_72(plain), hashed).result()
+
+async def verify_password_async(plain: str, hashed: str) -> bool:
+    """verify_password awaited on the event loop (no threadpool worker held while queued)."""
+    return await asyncio.wrap_future(_password_pool.submit(pwd_ctx.verify, _password_72(plain), hashed))
 
 def generate_api_key() -> str:
     return secrets.token_urlsafe(32)
 
+async def request_form(request: Request) -> FormData:
+    """Parsed form body, for sync handlers that need getlist() (body must be read on the event loop)."""
+    return await request.form()
+
 def get_current_user(request: Request, db: Session = Depends(get_db)):
     """Require login; return user or redirect to login."""
     user_id = request.session.get("user_id")
@@ -133,7 +199,7 @@ def get_current_user(request: Request, db: Session = Depends(get_db)):
         if request.url.path.startswith("/api/"):
             raise HTTPException(status_code=401, detail="Not authenticated")
         return RedirectResponse(url="/login", status_code=302)
-    user = db.query(User).filter(User.id == user_id, User.is_active == True).first()
+    user = principal_for_user_id(db, user_id)
     if not user:
         request.session.clear()
         if request.url.path.startswith("/api/"):
@@ -141,15 +207,15 @@ def get_current_user(request: Request, db: Session = Depends(get_db)):
         return RedirectResponse(url="/login", status_code=302)
     return user
 
-def require_admin(request: Request, user: User = Depends(get_current_user)):
-    if not isinstance(user, User):
+def require_admin(request: Request, user: Principal = Depends(get_current_user)):
+    if not isinstance(user, Principal):
         return user  # redirect response
     if user.role != "admin":
         raise HTTPException(status_code=403, detail="Admin only")
     return user
 
-def require_can_view_data(request: Request, user: User = Depends(get_current_user)):
-    if not isinstance(user, User):
+def require_can_view_data(request: Request, user: Principal = Depends(get_current_user)):
+    if not isinstance(user, Principal):
         return user
     if user.role != "admin" and not user.can_view_data:
         request.session.clear()
@@ -161,14 +227,14 @@ def get_user_for_api(
     x_api_key: Optional[str] = Header(None),
     db: Session = Depends(get_db),
 ):
-    """Resolve user from session (web) or X-API-Key header (API)."""
+    """Resolve user from session (web) or X-API-Key header (API), via the in-process auth cache."""
     user_id = request.session.get("user_id")
     if user_id:
-        user = db.query(User).filter(User.id == user_id, User.is_active == True).first()
+        user = principal_for_user_id(db, user_id)
         if user and (user.role == "admin" or user.can_view_data):
             return user
     if x_api_key:
-        user = db.query(User).filter(User.api_key == x_api_key, User.is_active == True).first()
+        user = principal_for_api_key(db, x_api_key)
         if user and (user.role == "admin" or user.can_view_data):
             return user
     return None
@@ -195,7 +261,7 @@ async def root(request: Request):
 
 
 @app.get("/setup", response_class=HTMLResponse)
-async def setup_page(request: Request, db: Session = Depends(get_db)):
+def setup_page(request: Request, db: Session = Depends(get_db)):
     """One-time setup: create first admin when no users exist."""
     try:
         if db.query(User).count() > 0:
@@ -227,7 +293,7 @@ async def _catch_setup_errors(request: Request, exc: Exception):
 
 
 @app.post("/setup")
-async def setup_submit(
+def setup_submit(
     request: Request,
     username: str = Form(...),
     email: str = Form(...),
@@ -265,7 +331,7 @@ async def setup_submit(
 
 
 @app.get("/health")
-async def health_check(db: Session = Depends(get_db)):
+def health_check(db: Session = Depends(get_db)):
     """Health check endpoint"""
     try:
         db.execute(text("SELECT 1"))
@@ -274,8 +340,18 @@ async def health_check(db: Session = Depends(get_db)):
         return {"status": "unhealthy", "database": "disconnected"}
 
 
+@app.get("/metrics", include_in_schema=False)
+def prometheus_metrics():
+    """Prometheus exposition (request latency, DB pool, response cache, crawler ingestion)"""
+    payload = metrics_payload()
+    if payload is None:
+        return Response("prometheus_client is not installed\n", status_code=503, media_type="text/plain")
+    body, content_type = payload
+    return Response(body, media_type=content_type)
+
+
 @app.get("/api/computed-metrics")
-async def get_computed_metrics(
+def get_computed_metrics(
     raw_data_id: Optional[int] = Query(None),
     formula_id: Optional[int] = Query(None),
     metric_name: Optional[str] = Query(None),
@@ -307,7 +383,8 @@ async def get_computed_metrics(
 
 
 @app.get("/api/aggregated-metrics")
-async def get_aggregated_metrics(
+def get_aggregated_metrics(
+    request: Request,
     channel: Optional[str] = Query(None),
     time_unit: Optional[str] = Query(None),
     fetch_date: Optional[date] = Query(None),
@@ -315,7 +392,14 @@ async def get_aggregated_metrics(
     limit: int = Query(100, le=1000),
     db: Session = Depends(get_db)
 ):
-    """Get aggregated metrics"""
+    """Get aggregated metrics (cached per data version, ETag/If-None-Match → 304)"""
+    key = cache_key(request, "all", current_data_version(db))
+    return cached_response(request, key, lambda: JSONResponse(_aggregated_metrics(
+        db, channel, time_unit, fetch_date, metric_name, limit
+    )))
+
+
+def _aggregated_metrics(db: Session, channel, time_unit, fetch_date, metric_name, limit: int) -> list:
     query = db.query(AggregatedMetric)
 
     if channel:
@@ -343,13 +427,13 @@ async def get_aggregated_metrics(
     ]
 
 
-def require_api_user(user: Optional[User] = Depends(get_user_for_api)):
+def require_api_user(user: Optional[Principal] = Depends(get_user_for_api)):
     if user is None:
         raise HTTPException(status_code=401, detail="Authentication required: log in or provide X-API-Key header")
     return user
 
 
-def require_api_admin(user: Optional[User] = Depends(get_user_for_api)):
+def require_api_admin(user: Optional[Principal] = Depends(get_user_for_api)):
     """Chỉ admin mới được gọi (session hoặc API key của user admin)."""
     if user is None:
         raise HTTPException(status_code=401, detail="Authentication required: log in or provide X-API-Key header")
@@ -359,17 +443,19 @@ def require_api_admin(user: Optional[User] = Depends(get_user_for_api)):
 
 
 @app.get("/api/raw-data")
-async def get_raw_data(
+def get_raw_data(
+    response: Response,
     fetch_date: Optional[str] = Query(None),
     from_date: Optional[str] = Query(None, description="Filter from date (inclusive)"),
     to_date: Optional[str] = Query(None, description="Filter to date (inclusive)"),
     channel: Optional[str] = Query(None),
     limit: int = Query(100, le=2000),
     offset: int = Query(0),
+    cursor: Optional[str] = Query(None, description="X-Next-Cursor from the previous page (replaces offset)"),
     db: Session = Depends(get_db),
-    user: User = Depends(require_api_admin),
+    user: Principal = Depends(require_api_admin),
 ):
-    """Raw revenue data. Admin only. Third parties use GET /api/data."""
+    """Raw revenue data. Admin only. Third parties use GET /api/data. Next page: pass the X-Next-Cursor header as cursor."""
     fd = _parse_optional_date(fetch_date)
     from_d = _parse_optional_date(from_date)
     to_d = _parse_optional_date(to_date)
@@ -385,18 +471,18 @@ async def get_raw_data(
     if channel:
         query = query.filter(RawRevenueData.channel == channel)
 
-    results = query.order_by(RawRevenueData.fetch_date.desc()).offset(offset).limit(limit).all()
+    results = _keyset_page(query, RawRevenueData, cursor, offset, limit, response)
     return [
         {
             "id": r.id,
             "channel": r.channel,
             "slot": r.slot,
             "time_unit": r.time_unit,
-            "total_player_impr": r.total_player_impr,
-            "total_ad_impr": r.total_ad_impr,
-            "rpm": r.rpm,
-            "gross_revenue_usd": r.gross_revenue_usd,
-            "net_revenue_usd": r.net_revenue_usd,
+            "total_player_impr": float(r.total_player_impr) if r.total_player_impr is not None else None,
+            "total_ad_impr": float(r.total_ad_impr) if r.total_ad_impr is not None else None,
+            "rpm": float(r.rpm) if r.rpm is not None else None,
+            "gross_revenue_usd": float(r.gross_revenue_usd) if r.gross_revenue_usd is not None else None,
+            "net_revenue_usd": float(r.net_revenue_usd) if r.net_revenue_usd is not None else None,
             "fetch_date": r.fetch_date.isoformat() if r.fetch_date else None,
             "fetched_at": r.fetched_at.isoformat() if r.fetched_at else None
         }
@@ -405,7 +491,7 @@ async def get_raw_data(
 
 
 @app.get("/api/fetch-logs")
-async def get_fetch_logs(
+def get_fetch_logs(
     fetch_date: Optional[date] = Query(None),
     status: Optional[str] = Query(None),
     limit: int = Query(100, le=1000),
@@ -432,14 +518,85 @@ async def get_fetch_logs(
             "error_message": r.error_message,
             "started_at": r.started_at.isoformat() if r.started_at else None,
             "completed_at": r.completed_at.isoformat() if r.completed_at else None,
-            "duration_seconds": r.duration_seconds
+            "duration_seconds": r.duration_seconds,
+            "metrics": _fetch_log_metrics(r)
         }
         for r in results
     ]
 
 
+def _fetch_log_metrics(log: FetchLog) -> Optional[dict]:
+    """fetch_logs.metrics (JSON: wall_ms, stages, stages_ms, counters); None cho log cũ / JSON hỏng"""
+    if not log.metrics:
+        return None
+    try:
+        return json.loads(log.metrics)
+    except ValueError:
+        return None
+
+
+def _trend_stats(values: List[float]) -> dict:
+    """median / p95 của cả cửa sổ; change_pct = lần cuối so với median các lần trước đó"""
+    ordered = sorted(values)
+    previous = sorted(values[:-1])
+    baseline = previous[len(previous) // 2] if previous else None
+    return {
+        "runs": len(values),
+        "last": values[-1],
+        "median": ordered[len(ordered) // 2],
+        "p95": ordered[min(len(ordered) - 1, int(0.95 * len(ordered)))],
+        "change_pct": round((values[-1] - baseline) / baseline * 100, 1) if baseline else None,
+    }
+
+
+@app.get("/api/fetch-logs/trends")
+def get_fetch_log_trends(
+    days: int = Query(30, ge=1, le=366),
+    status: Optional[str] = Query("success"),
+    db: Session = Depends(get_db)
+):
+    """
+    Xu hướng thời gian crawl trong `days` ngày gần nhất: mỗi lần chạy (cũ → mới) với ms theo
+    bước và bộ đếm pages / bytes / rows, cộng median / p95 / lần cuối / % thay đổi của từng chỉ số.
+    """
+    query = db.query(FetchLog).filter(
+        FetchLog.started_at >= datetime.utcnow() - timedelta(days=days),
+        FetchLog.metrics.isnot(None)
+    )
+    if status:
+        query = query.filter(FetchLog.status == status)
+
+    runs = []
+    series = {}
+    for r in query.order_by(FetchLog.started_at).all():
+        metrics = _fetch_log_metrics(r)
+        if metrics is None:
+            continue
+        values = {"wall_ms": metrics.get("wall_ms")}
+        values.update({f"{name}_ms": ms for name, ms in (metrics.get("stages_ms") or {}).items()})
+        values.update(metrics.get("counters") or {})
+        for name, value in values.items():
+            if value is not None:
+                series.setdefault(name, []).append(value)
+        runs.append({
+            "id": r.id,
+            "fetch_date": r.fetch_date.isoformat() if r.fetch_date else None,
+            "status": r.status,
+            "started_at": r.started_at.isoformat() if r.started_at else None,
+            "duration_seconds": r.duration_seconds,
+            "records_fetched": r.records_fetched,
+            "pages_fetched": r.pages_fetched,
+            **values,
+        })
+    return {
+        "days": days,
+        "runs": runs,
+        "summary": {name: _trend_stats(values) for name, values in sorted(series.items())},
+    }
+
+
 @app.get("/api/formulas")
-async def get_formulas(
+def get_formulas(
     is_active: Optional[bool] = Query(None),
     db: Session = Depends(get_db)
 ):
@@ -463,143 +620,323 @@ async def get_formulas(
     ]
 
 
+def _allowed_slots(user: Principal) -> Optional[List[str]]:
+    """Slots a user may see: None = all (admin), otherwise the assigned slot names (may be empty)."""
+    if user.role == "admin" or user.slots is None:
+        return None
+    return sorted(user.slots)
+
+
+def _filter_processed(query, allowed_slots: Optional[List[str]], fd=None, from_d=None, to_d=None, slot=None):
+    """Apply slot scoping and the date/slot filters shared by /api/data, its export and summary."""
+    if allowed_slots is not None:
+        query = query.filter(ProcessedRevenueData.slot.in_(allowed_slots))
+    if fd:
+        query = query.filter(ProcessedRevenueData.fetch_date == fd)
+    else:
+        if from_d:
+            query = query.filter(ProcessedRevenueData.fetch_date >= from_d)
+        if to_d:
+            query = query.filter(ProcessedRevenueData.fetch_date <= to_d)
+    if slot:
+        query = query.filter(ProcessedRevenueData.slot == slot)
+    return query
+
+
+# Keys of _processed_row_dict (CSV export header)
+PROCESSED_ADMIN_COLUMNS = ["id", "slot", "time_unit", "total_player_impr", "revenue", "rpm",
+                           "total_player_impr_2", "revenue_2", "rpm_2", "fetch_date"]
+PROCESSED_USER_COLUMNS = ["id", "slot", "time_unit", "total_player_impr", "revenue", "rpm"]
+
+
+def _processed_row_dict(r, is_admin: bool) -> dict:
+    if is_admin:
+        return {
+            "id": r.id,
+            "slot": r.slot,
+            "time_unit": r.time_unit,
+            "total_player_impr": float(r.total_player_impr) if r.total_player_impr else None,
+            "revenue": float(r.revenue) if r.revenue else None,
+            "rpm": float(r.rpm) if r.rpm else None,
+            "total_player_impr_2": float(r.total_player_impr_2) if r.total_player_impr_2 else None,
+            "revenue_2": float(r.revenue_2) if r.revenue_2 else None,
+            "rpm_2": float(r.rpm_2) if r.rpm_2 else None,
+            "fetch_date": r.fetch_date.isoformat() if r.fetch_date else None
+        }
+    # User role: same as table view — IMPR 2 → IMPR, Revenue 2 → Revenue, RPM 2 → RPM; time_unit = fetch_date; no _2 or fetch_date
+    return {
+        "id": r.id,
+        "slot": r.slot,
+        "time_unit": r.fetch_date.isoformat() if r.fetch_date else (r.time_unit or None),
+        "total_player_impr": float(r.total_player_impr_2) if r.total_player_impr_2 else None,
+        "revenue": float(r.revenue_2) if r.revenue_2 else None,
+        "rpm": float(r.rpm_2) if r.rpm_2 else None
+    }
+
+
 @app.get("/api/data")
-async def get_processed_data(
+def get_processed_data(
+    request: Request,
+    response: Response,
     fetch_date: Optional[str] = Query(None),
     from_date: Optional[str] = Query(None, description="Filter from date (inclusive)"),
     to_date: Optional[str] = Query(None, description="Filter to date (inclusive)"),
     slot: Optional[str] = Query(None),
     limit: int = Query(100, le=2000),
     offset: int = Query(0),
+    cursor: Optional[str] = Query(None, description="X-Next-Cursor from the previous page (replaces offset)"),
     db: Session = Depends(get_db),
-    user: User = Depends(require_api_user),
+    user: Principal = Depends(require_api_user),
 ):
-    """Get processed revenue data. Use from_date/to_date for date range, or fetch_date for single day. Auth: session or X-API-Key."""
+    """Get processed revenue data. Use from_date/to_date for date range, or fetch_date for single day. Auth: session or X-API-Key.
+    Paging: follow the X-Next-Cursor response header (cursor=...) instead of growing offset.
+    Responses are cached per data version and carry an ETag (If-None-Match → 304)."""
     fd = _parse_optional_date(fetch_date)
     from_d = _parse_optional_date(from_date)
     to_d = _parse_optional_date(to_date)
     if ProcessedRevenueData is None:
         raise HTTPException(status_code=503, detail="Processed data model not available")
 
-    query = db.query(ProcessedRevenueData)
-    is_admin = getattr(user, "role", None) == "admin"
-
     # Non-admin: filter by assigned slots only
-    if not is_admin:
-        allowed_slots = db.query(UserSlot.slot).filter(UserSlot.user_id == user.id).all()
-        allowed_slot_names = [s[0] for s in allowed_slots]
-        if not allowed_slot_names:
-            return []  # No assigned slots → no data
-        query = query.filter(ProcessedRevenueData.slot.in_(allowed_slot_names))
-
-    if fd:
-        query = query.filter(ProcessedRevenueData.fetch_date == fd)
+    allowed_slots = _allowed_slots(user)
+    if allowed_slots == []:
+        return []  # No assigned slots → no data
+    is_admin = allowed_slots is None
+
+    def render():
+        query = _filter_processed(db.query(ProcessedRevenueData), allowed_slots, fd, from_d, to_d, slot)
+        results = _keyset_page(query, ProcessedRevenueData, cursor, offset, limit, response)
+        return JSONResponse([_processed_row_dict(r, is_admin) for r in results], headers=dict(response.headers))
+
+    scope = "admin" if is_admin else tuple(allowed_slots)
+    return cached_response(request, cache_key(request, scope, current_data_version(db)), render)
+
+
+SUMMARY_GROUPS = ("slot", "fetch_date", "week", "month")
+
+
+def _summary_group_expr(db: Session, group_by: str):
+    """SQL expression for a summary group key (week = Monday of the ISO week, month = YYYY-MM)."""
+    column = ProcessedRevenueData.fetch_date
+    if group_by == "slot":
+        return ProcessedRevenueData.slot
+    if group_by == "fetch_date":
+        return column
+    dialect = db.get_bind().dialect.name
+    if group_by == "week":
+        if dialect == "mysql":
+            return func.date_sub(column, text("INTERVAL WEEKDAY(fetch_date) DAY"))
+        if dialect == "postgresql":
+            return func.date(func.date_trunc("week", column))
+        return func.date(column, "weekday 0", "-6 days")
+    if dialect == "mysql":
+        return func.date_format(column, "%Y-%m")
+    if dialect == "postgresql":
+        return func.to_char(column, "YYYY-MM")
+    return func.strftime("%Y-%m", column)
+
+
+def _processed_summary(db: Session, allowed_slots: Optional[List[str]], fd=None, from_d=None, to_d=None,
+                       slot=None, group_by: Optional[str] = None) -> List[dict]:
+    """
+    SUM(total_player_impr_2), SUM(revenue_2) and RPM = revenue / impr * 1000, computed in SQL,
+    one row per group (or a single total row when group_by is None).
+    """
+    total_impr = func.coalesce(func.sum(ProcessedRevenueData.total_player_impr_2), 0)
+    total_rev = func.coalesce(func.sum(ProcessedRevenueData.revenue_2), 0)
+    rpm = case((total_impr > 0, total_rev / total_impr * 1000), else_=0)
+    columns = [
+        func.count(ProcessedRevenueData.id).label("rows"),
+        total_impr.label("total_impr"),
+        total_rev.label("total_rev"),
+        rpm.label("rpm"),
+    ]
+    if allowed_slots == []:
+        return []
+    if group_by:
+        key = _summary_group_expr(db, group_by).label("group_key")
+        query = db.query(key, *columns).group_by(key).order_by(key)
     else:
-        if from_d:
-            query = query.filter(ProcessedRevenueData.fetch_date >= from_d)
-        if to_d:
-            query = query.filter(ProcessedRevenueData.fetch_date <= to_d)
-    if slot:
-        query = query.filter(ProcessedRevenueData.slot == slot)
-
-    results = query.order_by(ProcessedRevenueData.fetch_date.desc(), ProcessedRevenueData.slot).offset(offset).limit(limit).all()
+        query = db.query(*columns)
+    query = _filter_processed(query, allowed_slots, fd, from_d, to_d, slot)
 
     out = []
-    for r in results:
-        if is_admin:
-            out.append({
-                "id": r.id,
-                "slot": r.slot,
-                "time_unit": r.time_unit,
-                "total_player_impr": float(r.total_player_impr) if r.total_player_impr else None,
-                "revenue": float(r.revenue) if r.revenue else None,
-                "rpm": float(r.rpm) if r.rpm else None,
-                "total_player_impr_2": float(r.total_player_impr_2) if r.total_player_impr_2 else None,
-                "revenue_2": float(r.revenue_2) if r.revenue_2 else None,
-                "rpm_2": float(r.rpm_2) if r.rpm_2 else None,
-                "fetch_date": r.fetch_date.isoformat() if r.fetch_date else None
-            })
-        else:
-            # User role: same as table view — IMPR 2 → IMPR, Revenue 2 → Revenue, RPM 2 → RPM; time_unit = fetch_date; no _2 or fetch_date
-            out.append({
-                "id": r.id,
-                "slot": r.slot,
-                "time_unit": r.fetch_date.isoformat() if r.fetch_date else (r.time_unit or None),
-                "total_player_impr": float(r.total_player_impr_2) if r.total_player_impr_2 else None,
-                "revenue": float(r.revenue_2) if r.revenue_2 else None,
-                "rpm": float(r.rpm_2) if r.rpm_2 else None
-            })
+    for r in query.all():
+        row = {group_by: (r.group_key.isoformat() if hasattr(r.group_key, "isoformat") else str(r.group_key))} if group_by else {}
+        row.update({
+            "rows": r.rows,
+            "total_player_impr": float(r.total_impr or 0),
+            "revenue": float(r.total_rev or 0),
+            "rpm": round(float(r.rpm or 0), 2),
+        })
+        out.append(row)
     return out
 
 
+@app.get("/api/data/summary")
+def get_processed_summary(
+    group_by: Optional[str] = Query(None, pattern="^(slot|fetch_date|week|month)$",
+                                    description="slot | fetch_date | week | month; omit for one total row"),
+    fetch_date: Optional[str] = Query(None),
+    from_date: Optional[str] = Query(None, description="Filter from date (inclusive)"),
+    to_date: Optional[str] = Query(None, description="Filter to date (inclusive)"),
+    slot: Optional[str] = Query(None),
+    db: Session = Depends(get_db),
+    user: Principal = Depends(require_api_user),
+):
+    """
+    Totals of processed data per slot / day / week / month (after share: IMPR 2, Revenue 2, RPM 2),
+    computed in SQL over the caller's slots. Auth: session or X-API-Key.
+    """
+    if ProcessedRevenueData is None:
+        raise HTTPException(status_code=503, detail="Processed data model not available")
+    return _processed_summary(
+        db, _allowed_slots(user),
+        _parse_optional_date(fetch_date), _parse_optional_date(from_date), _parse_optional_date(to_date),
+        slot, group_by
+    )
+
+
+EXPORT_BATCH_ROWS = int(os.getenv("EXPORT_BATCH_ROWS", "1000"))
+
+
+@app.get("/api/data/export")
+def export_processed_data(
+    format: str = Query("ndjson", pattern="^(ndjson|csv)$"),
+    fetch_date: Optional[str] = Query(None),
+    from_date: Optional[str] = Query(None, description="Filter from date (inclusive)"),
+    to_date: Optional[str] = Query(None, description="Filter to date (inclusive)"),
+    slot: Optional[str] = Query(None),
+    db: Session = Depends(get_db),
+    user: Principal = Depends(require_api_user),
+):
+    """
+    Stream every matching /api/data row as NDJSON (one JSON object per line) or CSV, same columns and
+    slot scoping as /api/data. Rows are read with a server-side cursor, so memory stays flat for any range.
+    """
+    fd = _parse_optional_date(fetch_date)
+    from_d = _parse_optional_date(from_date)
+    to_d = _parse_optional_date(to_date)
+    if ProcessedRevenueData is None:
+        raise HTTPException(status_code=503, detail="Processed data model not available")
+
+    allowed_slots = _allowed_slots(user)
+    is_admin = allowed_slots is None
+
+    def rows():
+        if allowed_slots == []:
+            return
+        # Own session: the request's session is closed before the response body is streamed
+        stream_db = SessionLocal()
+        try:
+            query = _filter_processed(stream_db.query(ProcessedRevenueData), allowed_slots, fd, from_d, to_d, slot)
+            query = query.order_by(ProcessedRevenueData.fetch_date.desc(), ProcessedRevenueData.slot, ProcessedRevenueData.id)
+            for r in query.yield_per(EXPORT_BATCH_ROWS):
+                yield _processed_row_dict(r, is_admin)
+        finally:
+            stream_db.close()
+
+    def ndjson():
+        batch = []
+        for row in rows():
+            batch.append(json.dumps(row) + "\n")
+            if len(batch) >= EXPORT_BATCH_ROWS:
+                yield "".join(batch)
+                batch = []
+        if batch:
+            yield "".join(batch)
+
+    def csv_lines():
+        buffer = io.StringIO()
+        writer = csv.DictWriter(buffer, fieldnames=PROCESSED_ADMIN_COLUMNS if is_admin else PROCESSED_USER_COLUMNS)
+        writer.writeheader()
+        count = 0
+        for row in rows():
+            writer.writerow(row)
+            count += 1
+            if count % EXPORT_BATCH_ROWS == 0:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+        yield buffer.getvalue()
+
+    filename = f"revenue_data_{(fd or from_d or 'all')}_{(fd or to_d or 'latest')}.{format}"
+    media_type = "application/x-ndjson" if format == "ndjson" else "text/csv"
+    return StreamingResponse(
+        ndjson() if format == "ndjson" else csv_lines(),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
+
 class TriggerCrawlRequest(BaseModel):
     date: Optional[date_type] = None
     first_page_only: bool = False
 
 
 @app.post("/api/trigger-crawl")
-async def trigger_crawl(
+def trigger_crawl(
     request: Optional[TriggerCrawlRequest] = None,
     db: Session = Depends(get_db),
-    user: User = Depends(get_current_user),
+    user: Principal = Depends(get_current_user),
 ):
-    """Trigger crawler manually (admin only)"""
-    if not isinstance(user, User):
+    """Queue a manual crawl (admin only). crawler/worker.py runs it under the crawl_runs lock."""
+    if not isinstance(user, Principal):
         return user
     if user.role != "admin":
         raise HTTPException(status_code=403, detail="Admin only")
-    global crawl_status
 
-    if crawl_status["running"]:
+    target_date = request.date if request and request.date else date.today() - timedelta(days=1)
+    first_page_only = request.first_page_only if request else False
+    job, created = enqueue_crawl(db, target_date, first_page_only, created_by=user.username)
+    if not created:
         return {
             "status": "error",
-            "message": "Crawler is already running",
-            "last_run": crawl_status["last_run"]
+            "message": f"A crawl for {target_date.isoformat()} is already {job.status} (job #{job.id})",
+            "job_id": job.id,
         }
+    return {
+        "status": "queued",
+        "message": f"Crawl for {target_date.isoformat()} queued (job #{job.id})",
+        "job_id": job.id,
+        "target_date": target_date.isoformat(),
+        "first_page_only": first_page_only,
+    }
 
-    def run_crawler(req: Optional[TriggerCrawlRequest]):
-        global crawl_status
-        try:
-            crawl_status["running"] = True
-            crawl_status["last_run"] = datetime.now().isoformat()
-
-            # Import data fetcher
-            import sys
-            from pathlib import Path
-            sys.path.insert(0, str(Path(__file__).parent.parent))
-
-            from backend.data_fetcher import DataFetcher
-            from datetime import date, timedelta
-
-            target_date = req.date if req and req.date else date.today() - timedelta(days=1)
-            first_page_only = req.first_page_only if req else False
-
-            # Use DataFetcher instead of crawler.main
-            fetcher = DataFetcher()
-            result = fetcher.fetch_and_store(target_date=target_date, first_page_only=first_page_only)
-            crawl_status["last_result"] = result
-            crawl_status["running"] = False
 
-        except Exception as e:
-            crawl_status["running"] = False
-            crawl_status["last_result"] = {"status": "error", "error": str(e)}
+CRAWL_JOBS_SHOWN = 10
 
-    # Run in background thread
-    thread = threading.Thread(target=run_crawler, args=(request,), daemon=True)
-    thread.start()
 
+def _crawl_job_dict(job: CrawlJob) -> dict:
     return {
-        "status": "started",
-        "message": "Crawler started in background",
-        "target_date": (request.date.isoformat() if request and request.date else None),
-        "first_page_only": (request.first_page_only if request else False)
+        "id": job.id,
+        "fetch_date": job.fetch_date.isoformat() if job.fetch_date else None,
+        "first_page_only": bool(job.first_page_only),
+        "status": job.status,
+        "stage": job.stage,
+        "stages": json.loads(job.progress) if job.progress else None,
+        "result": json.loads(job.result) if job.result else None,
+        "error_message": job.error_message,
+        "created_by": job.created_by,
+        "created_at": job.created_at.isoformat() if job.created_at else None,
+        "started_at": job.started_at.isoformat() if job.started_at else None,
+        "completed_at": job.completed_at.isoformat() if job.completed_at else None,
     }
 
 
 @app.get("/api/crawl-status")
-async def get_crawl_status():
-    """Get current crawl status"""
-    return crawl_status
+def get_crawl_status(limit: int = Query(CRAWL_JOBS_SHOWN, le=100), db: Session = Depends(get_db)):
+    """Crawl job status from crawl_jobs (shared by every API process), newest first, with per-stage progress."""
+    jobs = db.query(CrawlJob).order_by(CrawlJob.id.desc()).limit(limit).all()
+    last_started = next((j for j in jobs if j.started_at), None)
+    last_finished = next((j for j in jobs if j.completed_at), None)
+    return {
+        "running": any(j.status == "running" for j in jobs),
+        "pending": sum(1 for j in jobs if j.status == "pending"),
+        "last_run": last_started.started_at.isoformat() if last_started else None,
+        "last_result": json.loads(last_finished.result) if last_finished and last_finished.result else None,
+        "jobs": [_crawl_job_dict(j) for j in jobs],
+    }
 
 
 # Templates
@@ -634,7 +971,7 @@ docker-compose -f docker-compose.vps.yml exec -T db mysql -u tooltinhreveneu_1 -
 
 # ----- Auth: login, register, logout -----
 @app.get("/login", response_class=HTMLResponse)
-async def login_page(request: Request, db: Session = Depends(get_db)):
+def login_page(request: Request, db: Session = Depends(get_db)):
     if request.session.get("user_id"):
         return RedirectResponse(url="/data", status_code=302)
     try:
@@ -644,6 +981,13 @@ async def login_page(request: Request, db: Session = Depends(get_db)):
         return _users_table_missing_error()
     return templates.TemplateResponse("login.html", {"request": request})
 
+def _active_user_by_username(db: Session, username: str) -> Optional[User]:
+    return db.query(User).filter(User.username == username, User.is_active == True).first()
+
+def _record_login(db: Session, user: User) -> None:
+    user.last_login = datetime.utcnow()
+    db.commit()
+
 @app.post("/login")
 async def login_submit(
     request: Request,
@@ -652,14 +996,13 @@ async def login_submit(
     db: Session = Depends(get_db),
 ):
     try:
-        user = db.query(User).filter(User.username == username, User.is_active == True).first()
+        user = await run_in_threadpool(_active_user_by_username, db, username)
     except (OperationalError, ProgrammingError):
         return _users_table_missing_error()
-    if not user or not verify_password(password, user.password_hash):
+    if not user or not await verify_password_async(password, user.password_hash):
         return templates.TemplateResponse("login.html", {"request": request, "error": "Invalid username or password"})
     request.session["user_id"] = user.id
-    user.last_login = datetime.utcnow()
-    db.commit()
+    await run_in_threadpool(_record_login, db, user)
     if user.role == "admin":
         return RedirectResponse(url="/data", status_code=303)
     return RedirectResponse(url="/data", status_code=303)
@@ -670,7 +1013,7 @@ async def logout(request: Request):
     return RedirectResponse(url="/", status_code=302)
 
 @app.get("/register", response_class=HTMLResponse)
-async def register_page(request: Request, db: Session = Depends(get_db)):
+def register_page(request: Request, db: Session = Depends(get_db)):
     if request.session.get("user_id"):
         return RedirectResponse(url="/data", status_code=302)
     try:
@@ -680,7 +1023,7 @@ async def register_page(request: Request, db: Session = Depends(get_db)):
     return templates.TemplateResponse("register.html", {"request": request})
 
 @app.post("/register")
-async def register_submit(
+def register_submit(
     request: Request,
     username: str = Form(...),
     email: str = Form(...),
@@ -719,8 +1062,8 @@ async def admin_redirect(request: Request):
 
 
 @app.get("/formulas", response_class=HTMLResponse)
-async def list_formulas(request: Request, db: Session = Depends(get_db), user: User = Depends(get_current_user)):
-    if not isinstance(user, User):
+def list_formulas(request: Request, db: Session = Depends(get_db), user: Principal = Depends(get_current_user)):
+    if not isinstance(user, Principal):
         return user
     """List all formulas"""
     formulas = db.query(Formula).order_by(Formula.created_at.desc()).all()
@@ -731,8 +1074,8 @@ async def list_formulas(request: Request, db: Session = Depends(get_db), user: U
     })
 
 @app.get("/formulas/new", response_class=HTMLResponse)
-async def new_formula_form(request: Request, user: User = Depends(get_current_user)):
-    if not isinstance(user, User):
+async def new_formula_form(request: Request, user: Principal = Depends(get_current_user)):
+    if not isinstance(user, Principal):
         return user
     """New formula form"""
     return templates.TemplateResponse("formula_form.html", {
@@ -743,8 +1086,8 @@ async def new_formula_form(request: Request, user: User = Depends(get_current_us
     })
 
 @app.get("/formulas/{formula_id}/edit", response_class=HTMLResponse)
-async def edit_formula_form(request: Request, formula_id: int, db: Session = Depends(get_db), user: User = Depends(get_current_user)):
-    if not isinstance(user, User):
+def edit_formula_form(request: Request, formula_id: int, db: Session = Depends(get_db), user: Principal = Depends(get_current_user)):
+    if not isinstance(user, Principal):
         return user
     """Edit formula form"""
     formula = db.query(Formula).filter(Formula.id == formula_id).first()
@@ -759,7 +1102,7 @@ async def edit_formula_form(request: Request, formula_id: int, db: Session = Dep
     })
 
 @app.post("/formulas")
-async def create_formula(
+def create_formula(
     request: Request,
     name: str = Form(...),
     description: Optional[str] = Form(None),
@@ -767,9 +1110,9 @@ async def create_formula(
     formula_type: str = Form(...),
     is_active: bool = Form(True),
     db: Session = Depends(get_db),
-    user: User = Depends(get_current_user),
+    user: Principal = Depends(get_current_user),
 ):
-    if not isinstance(user, User):
+    if not isinstance(user, Principal):
         return user
     """Create new formula"""
     formula = Formula(
@@ -786,7 +1129,7 @@ async def create_formula(
     return RedirectResponse(url="/formulas", status_code=303)
 
 @app.post("/formulas/{formula_id}")
-async def update_formula(
+def update_formula(
     request: Request,
     formula_id: int,
     name: str = Form(...),
@@ -795,9 +1138,9 @@ async def update_formula(
     formula_type: str = Form(...),
     is_active: bool = Form(True),
     db: Session = Depends(get_db),
-    user: User = Depends(get_current_user),
+    user: Principal = Depends(get_current_user),
 ):
-    if not isinstance(user, User):
+    if not isinstance(user, Principal):
         return user
     """Update existing formula"""
     formula = db.query(Formula).filter(Formula.id == formula_id).first()
@@ -816,18 +1159,20 @@ async def update_formula(
     return RedirectResponse(url="/formulas", status_code=303)
 
 @app.post("/formulas/{formula_id}/compute")
-async def compute_formula_endpoint(
+def compute_formula_endpoint(
     request: Request,
     formula_id: int,
     db: Session = Depends(get_db),
-    user: User = Depends(get_current_user),
+    user: Principal = Depends(get_current_user),
 ):
-    if not isinstance(user, User):
+    if not isinstance(user, Principal):
         return user
     """Trigger computation for a formula"""
     from backend.formula_engine import FormulaEngine
     engine = FormulaEngine(db)
     result = engine.compute_formula(formula_id)
+    bump_data_version(db)
+    forget_data_version()
 
     return RedirectResponse(
         url=f"/formulas?computed={formula_id}",
@@ -835,13 +1180,13 @@ async def compute_formula_endpoint(
     )
 
 @app.post("/formulas/{formula_id}/delete")
-async def delete_formula_endpoint(
+def delete_formula_endpoint(
     request: Request,
     formula_id: int,
     db: Session = Depends(get_db),
-    user: User = Depends(get_current_user),
+    user: Principal = Depends(get_current_user),
 ):
-    if not isinstance(user, User):
+    if not isinstance(user, Principal):
         return user
     """Delete (deactivate) formula"""
     formula = db.query(Formula).filter(Formula.id == formula_id).first()
@@ -856,8 +1201,8 @@ async def delete_formula_endpoint(
 
 # ----- Users CRUD (admin only) -----
 @app.get("/users", response_class=HTMLResponse)
-async def list_users(request: Request, db: Session = Depends(get_db), user: User = Depends(require_admin)):
-    if not isinstance(user, User):
+def list_users(request: Request, db: Session = Depends(get_db), user: Principal = Depends(require_admin)):
+    if not isinstance(user, Principal):
         return user
     users = db.query(User).order_by(User.created_at.desc()).all()
     # Get slot assignments for all users
@@ -868,13 +1213,13 @@ async def list_users(request: Request, db: Session = Depends(get_db), user: User
     return templates.TemplateResponse("users_list.html", {"request": request, "users": users, "user": user, "user_slots_map": user_slots_map})
 
 @app.get("/users/new", response_class=HTMLResponse)
-async def new_user_form(request: Request, user: User = Depends(require_admin)):
-    if not isinstance(user, User):
+async def new_user_form(request: Request, user: Principal = Depends(require_admin)):
+    if not isinstance(user, Principal):
         return user
     return templates.TemplateResponse("user_form.html", {"request": request, "edit_user": None, "user": user})
 
 @app.post("/users")
-async def create_user(
+def create_user(
     request: Request,
     username: str = Form(...),
     email: str = Form(...),
@@ -882,9 +1227,9 @@ async def create_user(
     role: str = Form("user"),
     can_view_data: bool = Form(False),
     db: Session = Depends(get_db),
-    user: User = Depends(require_admin),
+    user: Principal = Depends(require_admin),
 ):
-    if not isinstance(user, User):
+    if not isinstance(user, Principal):
         return user
     if db.query(User).filter(User.username == username).first():
         return templates.TemplateResponse("user_form.html", {"request": request, "edit_user": None, "error": "Username already exists", "user": user})
@@ -903,8 +1248,8 @@ async def create_user(
     return RedirectResponse(url="/users", status_code=303)
 
 @app.get("/users/{user_id}/edit", response_class=HTMLResponse)
-async def edit_user_form(request: Request, user_id: int, db: Session = Depends(get_db), user: User = Depends(require_admin)):
-    if not isinstance(user, User):
+def edit_user_form(request: Request, user_id: int, db: Session = Depends(get_db), user: Principal = Depends(require_admin)):
+    if not isinstance(user, Principal):
         return user
     edit_user = db.query(User).filter(User.id == user_id).first()
     if not edit_user:
@@ -927,7 +1272,7 @@ async def edit_user_form(request: Request, user_id: int, db: Session = Depends(g
     })
 
 @app.post("/users/{user_id}")
-async def update_user(
+def update_user(
     request: Request,
     user_id: int,
     username: str = Form(...),
@@ -936,9 +1281,9 @@ async def update_user(
     can_view_data: bool = Form(False),
     password: Optional[str] = Form(None),
     db: Session = Depends(get_db),
-    user: User = Depends(require_admin),
+    user: Principal = Depends(require_admin),
 ):
-    if not isinstance(user, User):
+    if not isinstance(user, Principal):
         return user
     edit_user = db.query(User).filter(User.id == user_id).first()
     if not edit_user:
@@ -960,47 +1305,51 @@ async def update_user(
     elif not can_view_data:
         edit_user.api_key = None
     db.commit()
+    invalidate_principal(user_id)
     return RedirectResponse(url="/users", status_code=303)
 
 @app.post("/users/{user_id}/delete")
-async def delete_user(request: Request, user_id: int, db: Session = Depends(get_db), user: User = Depends(require_admin)):
-    if not isinstance(user, User):
+def delete_user(request: Request, user_id: int, db: Session = Depends(get_db), user: Principal = Depends(require_admin)):
+    if not isinstance(user, Principal):
         return user
     edit_user = db.query(User).filter(User.id == user_id).first()
     if not edit_user:
         raise HTTPException(status_code=404, detail="User not found")
     edit_user.is_active = False
     db.commit()
+    invalidate_principal(user_id)
     return RedirectResponse(url="/users", status_code=303)
 
 
 # ----- Share Config CRUD (admin only) -----
 @app.get("/shares", response_class=HTMLResponse)
-async def list_shares(request: Request, db: Session = Depends(get_db), user: User = Depends(require_admin)):
-    if not isinstance(user, User):
+def list_shares(request: Request, db: Session = Depends(get_db), user: Principal = Depends(require_admin)):
+    if not isinstance(user, Principal):
         return user
     configs = db.query(SlotShareConfig).order_by(SlotShareConfig.slot, SlotShareConfig.effective_date.desc()).all()
     # Get all available processed slots for the dropdown
     available_slots = db.query(ProcessedRevenueData.slot).distinct().order_by(ProcessedRevenueData.slot).all()
     available_slots = [s[0] for s in available_slots]
+    jobs = db.query(ShareRecalcJob).order_by(ShareRecalcJob.id.desc()).limit(SHARE_JOBS_SHOWN).all()
     return templates.TemplateResponse("shares.html", {
         "request": request,
         "configs": configs,
         "available_slots": available_slots,
+        "jobs": [_share_job_dict(j) for j in jobs],
         "user": user,
         "today": date.today().isoformat(),
     })
 
 @app.post("/shares")
-async def create_share(
+def create_share(
     request: Request,
     slot: str = Form(...),
     share_percent: str = Form(...),
     effective_date: str = Form(...),
     db: Session = Depends(get_db),
-    user: User = Depends(require_admin),
+    user: Principal = Depends(require_admin),
 ):
-    if not isinstance(user, User):
+    if not isinstance(user, Principal):
         return user
     from decimal import Decimal
     try:
@@ -1025,26 +1374,16 @@ async def create_share(
         )
         db.add(config)
     db.commit()
+    invalidate_share_resolver()
 
-    # Recalculate processed_revenue_data from effective_date onwards
-    try:
-        if slot == "*":
-            # Global config: recalculate ALL slots
-            from crawler.process_revenue import recalculate_all_slots
-            recalculate_all_slots(db, from_date=ed)
-        else:
-            # Specific slot: recalculate only that slot
-            from crawler.process_revenue import recalculate_processed_data_for_slot
-            recalculate_processed_data_for_slot(db, slot, from_date=ed)
-    except Exception as e:
-        # Log error but don't fail the request
-        print(f"Warning: recalculate failed for slot {slot}: {e}")
+    # Recalculate processed_revenue_data from effective_date onwards (background worker)
+    job = enqueue_share_recalc(db, slot, ed, created_by=user.username)
 
-    return RedirectResponse(url="/shares", status_code=303)
+    return RedirectResponse(url=f"/shares?job={job.id}", status_code=303)
 
 @app.post("/shares/{config_id}/delete")
-async def delete_share(request: Request, config_id: int, db: Session = Depends(get_db), user: User = Depends(require_admin)):
-    if not isinstance(user, User):
+def delete_share(request: Request, config_id: int, db: Session = Depends(get_db), user: Principal = Depends(require_admin)):
+    if not isinstance(user, Principal):
         return user
     config = db.query(SlotShareConfig).filter(SlotShareConfig.id == config_id).first()
     if config:
@@ -1052,41 +1391,62 @@ async def delete_share(request: Request, config_id: int, db: Session = Depends(g
         effective_date = config.effective_date
         db.delete(config)
         db.commit()
+        invalidate_share_resolver()
 
-        # Recalculate processed_revenue_data from effective_date onwards
+        # Recalculate processed_revenue_data from effective_date onwards (background worker)
         # This will use the previous share config or default 50%
-        try:
-            if slot == "*":
-                # Global config deleted: recalculate ALL slots
-                from crawler.process_revenue import recalculate_all_slots
-                recalculate_all_slots(db, from_date=effective_date)
-            else:
-                # Specific slot: recalculate only that slot
-                from crawler.process_revenue import recalculate_processed_data_for_slot
-                recalculate_processed_data_for_slot(db, slot, from_date=effective_date)
-        except Exception as e:
-            # Log error but don't fail the request
-            print(f"Warning: recalculate failed for slot {slot}: {e}")
+        job = enqueue_share_recalc(db, slot, effective_date, created_by=user.username)
+        return RedirectResponse(url=f"/shares?job={job.id}", status_code=303)
 
     return RedirectResponse(url="/shares", status_code=303)
 
 
+SHARE_JOBS_SHOWN = 10
+
+
+def _share_job_dict(job: ShareRecalcJob) -> dict:
+    return {
+        "id": job.id,
+        "slot": job.slot,
+        "from_date": job.from_date.isoformat() if job.from_date else None,
+        "status": job.status,
+        "chunks_done": job.chunks_done or 0,
+        "chunks_total": job.chunks_total or 0,
+        "records_updated": job.records_updated or 0,
+        "error_message": job.error_message,
+        "created_by": job.created_by,
+        "created_at": job.created_at.isoformat() if job.created_at else None,
+        "completed_at": job.completed_at.isoformat() if job.completed_at else None,
+    }
+
+
+@app.get("/api/share-jobs")
+def get_share_jobs(
+    limit: int = Query(SHARE_JOBS_SHOWN, le=100),
+    db: Session = Depends(get_db),
+    user: Principal = Depends(require_api_admin),
+):
+    """Recent share recalculation jobs (polled by the /shares page). Admin only."""
+    jobs = db.query(ShareRecalcJob).order_by(ShareRecalcJob.id.desc()).limit(limit).all()
+    return {"jobs": [_share_job_dict(j) for j in jobs]}
+
+
 # ----- User Slot Assignment (admin only, integrated into user edit) -----
 @app.post("/users/{user_id}/slots")
-async def update_user_slots(
+def update_user_slots(
     request: Request,
     user_id: int,
+    form_data: FormData = Depends(request_form),
     db: Session = Depends(get_db),
-    user: User = Depends(require_admin),
+    user: Principal = Depends(require_admin),
 ):
     """Update slot assignments for a user. Receives form with slot checkboxes."""
-    if not isinstance(user, User):
+    if not isinstance(user, Principal):
         return user
     edit_user = db.query(User).filter(User.id == user_id).first()
     if not edit_user:
         raise HTTPException(status_code=404, detail="User not found")
 
-    form_data = await request.form()
     selected_slots = form_data.getlist("slots")
 
     # Get current assignments for this user
@@ -1110,6 +1470,7 @@ async def update_user_slots(
             db.delete(assignment)
 
     db.commit()
+    invalidate_principal(user_id)
     return RedirectResponse(url=f"/users/{user_id}/edit", status_code=303)
 
 
@@ -1117,8 +1478,8 @@ async def update_user_slots(
 SLOT_PAGE_SIZE = 25
 
 @app.get("/slot-assignments", response_class=HTMLResponse)
-async def slot_assignments_page(request: Request, db: Session = Depends(get_db), user: User = Depends(require_admin)):
-    if not isinstance(user, User):
+def slot_assignments_page(request: Request, db: Session = Depends(get_db), user: Principal = Depends(require_admin)):
+    if not isinstance(user, Principal):
         return user
     # Pagination
     page = int(request.query_params.get("page", 1))
@@ -1151,15 +1512,15 @@ async def slot_assignments_page(request: Request, db: Session = Depends(get_db),
     })
 
 @app.post("/slot-assignments")
-async def save_slot_assignments(
+def save_slot_assignments(
     request: Request,
+    form_data: FormData = Depends(request_form),
     db: Session = Depends(get_db),
-    user: User = Depends(require_admin),
+    user: Principal = Depends(require_admin),
 ):
     """Save slot assignments for the current page only."""
-    if not isinstance(user, User):
+    if not isinstance(user, Principal):
         return user
-    form_data = await request.form()
     current_page = int(form_data.get("current_page", 1))
 
     # Get the slot names submitted in the form (hidden inputs)
@@ -1186,12 +1547,13 @@ async def save_slot_assignments(
                 db.add(UserSlot(user_id=user_id, slot=slot_name))
 
     db.commit()
+    invalidate_principals()
     return RedirectResponse(url=f"/slot-assignments?page={current_page}&success=1", status_code=303)
 
 
 @app.get("/api-docs", response_class=HTMLResponse)
-async def api_docs_page(request: Request, user: User = Depends(require_can_view_data)):
-    if not isinstance(user, User):
+async def api_docs_page(request: Request, user: Principal = Depends(require_can_view_data)):
+    if not isinstance(user, Principal):
         return user
     return templates.TemplateResponse("api_docs.html", {"request": request, "user": user, "base_url": BASE_URL, "api_docs_url": API_DOCS_URL})
 
@@ -1235,10 +1597,10 @@ async def admin_data_redirect(
 PAGE_SIZE = 25
 
 @app.get("/data", response_class=HTMLResponse)
-async def view_data(
+def view_data(
     request: Request,
     db: Session = Depends(get_db),
-    user: User = Depends(require_can_view_data),
+    user: Principal = Depends(require_can_view_data),
     fetch_date: Optional[str] = Query(None),
     from_date: Optional[str] = Query(None),
     to_date: Optional[str] = Query(None),
@@ -1247,7 +1609,10 @@ async def view_data(
     view_type: str = Query("datafull", regex="^(raw|datafull)$"),
     page: int = Query(1, ge=1),
 ):
-    """View data in table format - datafull (default) or raw. Raw chỉ admin; user xem datafull."""
+    """View data in table format - datafull (default) or raw. Raw chỉ admin; user xem datafull.
+    Trang render xong được cache theo (params, user, slot được gán, data_version) + ETag."""
+    if not isinstance(user, Principal):
+        return user
     if view_type == "raw" and (not user or getattr(user, "role", None) != "admin"):
         q = "view_type=datafull"
         if from_date:
@@ -1262,6 +1627,15 @@ async def view_data(
             q += f"&slot={slot}"
         return RedirectResponse(url=f"/data?{q}", status_code=302)
 
+    allowed_slots = _allowed_slots(user)
+    scope = (user.id, None if allowed_slots is None else tuple(allowed_slots))
+    return cached_response(request, cache_key(request, scope, current_data_version(db)), lambda: _render_data_page(
+        request, db, user, fetch_date, from_date, to_date, channel, slot, view_type, page
+    ))
+
+
+def _render_data_page(request: Request, db: Session, user: Principal, fetch_date, from_date, to_date,
+                      channel, slot, view_type: str, page: int):
     fd = _parse_optional_date(fetch_date)
     from_d = _parse_optional_date(from_date)
     to_d = _parse_optional_date(to_date)
@@ -1273,8 +1647,7 @@ async def view_data(
 
         # Non-admin: filter by assigned slots only
         if not is_admin:
-            allowed_slots = db.query(UserSlot.slot).filter(UserSlot.user_id == user.id).all()
-            allowed_slot_names = [s[0] for s in allowed_slots]
+            allowed_slot_names = _allowed_slots(user)
             if not allowed_slot_names:
                 # No assigned slots → show empty page
                 return templates.TemplateResponse("processed_data_table.html", {
@@ -1328,16 +1701,14 @@ async def view_data(
         else:
             available_slots = allowed_slot_names
 
-        # Tính summary cho user (non-admin)
+        # Tính summary cho user (non-admin): SUM trong SQL, cùng logic với /api/data/summary
         summary = None
         if not is_admin:
-            total_impr = sum(float(row.total_player_impr_2 or 0) for row in data)
-            total_rev = sum(float(row.revenue_2 or 0) for row in data)
-            avg_rpm = (total_rev / total_impr * 1000) if total_impr > 0 else 0
+            totals = _processed_summary(db, allowed_slot_names, fd, from_d, to_d, slot)[0]
             summary = {
-                "total_impr": total_impr,
-                "total_rev": total_rev,
-                "avg_rpm": round(avg_rpm, 2)
+                "total_impr": totals["total_player_impr"],
+                "total_rev": totals["revenue"],
+                "avg_rpm": totals["rpm"]
             }
 
         return templates.TemplateResponse("processed_data_table.html", {
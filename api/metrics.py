@@ -0,0 +1,211 @@
+"""
+Prometheus exposition cho API (/metrics):
+- request count + latency histogram theo route (path template, không phải URL thật)
+- connection pool của engine trong crawler/db.py (checked out / overflow / size)
+- hit / miss của response cache (api/cache.py)
+- crawler: trạng thái crawl_jobs, thời gian job gần nhất, fetch_date thành công gần nhất,
+  số dòng và thời gian của lần crawl gần nhất (đọc từ DB lúc scrape, vì crawler/worker
+  là process khác)
+
+prometheus_client là tùy chọn: thiếu thư viện thì middleware không đo gì và /metrics trả 503.
+Mỗi process uvicorn có registry riêng → chạy nhiều worker thì scrape từng process.
+
+QueryStatsMiddleware (chỉ khi SQL_INSTRUMENTATION=1, dùng cho dev): số query / thời gian DB
+của từng request trong header X-DB-*, câu lệnh lặp lại (N+1) được log warning.
+"""
+
+import logging
+import time
+from datetime import datetime, time as dtime, timezone
+
+from sqlalchemy import func
+from sqlalchemy.exc import SQLAlchemyError
+
+from crawler.db import SessionLocal, engine, CrawlJob, FetchLog
+from crawler.querystats import track_queries, log_repeated
+from api.cache import response_cache
+
+try:
+    from prometheus_client import CollectorRegistry, Counter, Histogram, CONTENT_TYPE_LATEST, generate_latest
+    from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+except ImportError:
+    CollectorRegistry = None
+
+logger = logging.getLogger(__name__)
+
+CRAWL_JOB_STATUSES = ("pending", "running", "completed", "failed", "skipped")
+# Bucket (giây) cho latency API: từ cache hit (ms) tới export lớn
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+def _timestamp(value) -> float:
+    """Unix time của datetime (naive = UTC, như datetime.utcnow() khi ghi) hoặc 00:00 UTC của date"""
+    if value is None:
+        return 0.0
+    if not isinstance(value, datetime):
+        value = datetime.combine(value, dtime.min)
+    return value.replace(tzinfo=timezone.utc).timestamp()
+
+
+class _AppCollector:
+    """Giá trị đọc lúc scrape: pool DB, response cache, crawler (từ DB)"""
+
+    def collect(self):
+        yield from self._pool()
+        yield from self._cache()
+        try:
+            yield from self._crawler()
+        except SQLAlchemyError as e:
+            # Chưa migrate bảng crawl_jobs / fetch_logs.metrics, hoặc DB down: bỏ qua nhóm crawler
+            logger.warning("Skipping crawler metrics: %s", e)
+
+    def _pool(self):
+        pool = engine.pool
+        for name, attr, doc in (
+            ("revenue_db_pool_checked_out", "checkedout", "DB connections currently checked out"),
+            ("revenue_db_pool_overflow", "overflow", "DB connections opened beyond pool_size"),
+            ("revenue_db_pool_size", "size", "Configured DB pool size"),
+        ):
+            # StaticPool / NullPool (sqlite, test) không có các số này
+            if hasattr(pool, attr):
+                # QueuePool.overflow() âm khi pool chưa mở đủ pool_size kết nối
+                yield GaugeMetricFamily(name, doc, value=max(0, getattr(pool, attr)()))
+
+    def _cache(self):
+        requests = CounterMetricFamily("revenue_response_cache_requests", "Response cache lookups", labels=["result"])
+        requests.add_metric(["hit"], response_cache.hits)
+        requests.add_metric(["miss"], response_cache.misses)
+        yield requests
+        yield GaugeMetricFamily("revenue_response_cache_entries", "Entries in the response cache",
+                                value=len(response_cache))
+
+    def _crawler(self):
+        db = SessionLocal()
+        try:
+            jobs = GaugeMetricFamily("revenue_crawl_jobs", "Crawl jobs by status", labels=["status"])
+            counts = dict(db.query(CrawlJob.status, func.count(CrawlJob.id)).group_by(CrawlJob.status).all())
+            for status in CRAWL_JOB_STATUSES:
+                jobs.add_metric([status], counts.get(status, 0))
+            yield jobs
+
+            last_job = db.query(CrawlJob).filter(
+                CrawlJob.completed_at.isnot(None), CrawlJob.started_at.isnot(None)
+            ).order_by(CrawlJob.completed_at.desc()).first()
+            if last_job:
+                duration = GaugeMetricFamily("revenue_crawl_job_last_duration_seconds",
+                                             "Duration of the most recently finished crawl job", labels=["status"])
+                duration.add_metric([last_job.status], (last_job.completed_at - last_job.started_at).total_seconds())
+                yield duration
+
+            last_success = db.query(FetchLog).filter(
+                FetchLog.status == "success"
+            ).order_by(FetchLog.completed_at.desc()).first()
+            yield GaugeMetricFamily(
+                "revenue_crawl_last_success_fetch_date_timestamp",
+                "Latest fetch_date with a successful crawl (unix time of that date, 00:00 UTC)",
+                value=_timestamp(db.query(func.max(FetchLog.fetch_date)).filter(FetchLog.status == "success").scalar()))
+            if last_success:
+                yield GaugeMetricFamily("revenue_crawl_last_success_completed_timestamp",
+                                        "When the most recent successful crawl finished (unix time)",
+                                        value=_timestamp(last_success.completed_at))
+                yield GaugeMetricFamily("revenue_crawl_last_success_rows",
+                                        "Rows ingested by the most recent successful crawl",
+                                        value=last_success.records_fetched or 0)
+                yield GaugeMetricFamily("revenue_crawl_last_success_duration_seconds",
+                                        "Duration of the most recent successful crawl",
+                                        value=last_success.duration_seconds or 0)
+        finally:
+            db.close()
+
+
+if CollectorRegistry is not None:
+    registry = CollectorRegistry()
+    REQUESTS = Counter("revenue_api_requests", "API requests", ["method", "route", "status"], registry=registry)
+    LATENCY = Histogram("revenue_api_request_duration_seconds", "API request latency", ["method", "route"],
+                        buckets=LATENCY_BUCKETS, registry=registry)
+    registry.register(_AppCollector())
+else:
+    registry = None
+
+
+def _route_label(app, scope) -> str:
+    """Path template của route đã khớp (vd. /users/{user_id}/edit) để label không bùng nổ theo id"""
+    route = scope.get("route")
+    if route is not None:
+        return route.path
+    endpoint = scope.get("endpoint")
+    if endpoint is not None:
+        for candidate in app.routes:
+            if getattr(candidate, "endpoint", None) is endpoint:
+                return candidate.path
+    return "unmatched"
+
+
+class PrometheusMiddleware:
+    """ASGI middleware: đếm request và đo latency theo (method, route, status)"""
+
+    def __init__(self, app):
+        self.app = app
+        self._routes = {}
+
+    async def __call__(self, scope, receive, send):
+        if registry is None or scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        status = {"code": 500}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            endpoint = scope.get("endpoint")
+            if endpoint not in self._routes:
+                self._routes[endpoint] = _route_label(scope["app"], scope)
+            route = self._routes[endpoint]
+            REQUESTS.labels(scope["method"], route, str(status["code"])).inc()
+            LATENCY.labels(scope["method"], route).observe(time.perf_counter() - started)
+
+
+def metrics_payload():
+    """(body, content_type) cho /metrics; None nếu chưa cài prometheus_client"""
+    if registry is None:
+        return None
+    return generate_latest(registry), CONTENT_TYPE_LATEST
+
+
+class QueryStatsMiddleware:
+    """ASGI middleware: header X-DB-Queries / X-DB-Time-Ms / X-DB-Repeated cho từng request"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        with track_queries() as queries:
+            if queries is None:
+                await self.app(scope, receive, send)
+                return
+
+            async def send_wrapper(message):
+                if message["type"] == "http.response.start":
+                    headers = list(message.get("headers", []))
+                    headers.append((b"x-db-queries", str(queries.count).encode()))
+                    headers.append((b"x-db-time-ms", str(queries.milliseconds).encode()))
+                    repeated = queries.repeated()
+                    if repeated:
+                        statement, times = repeated[0]
+                        headers.append((b"x-db-repeated", f"{times}x {statement[:120]}".encode("latin-1", "replace")))
+                    message = {**message, "headers": headers}
+                await send(message)
+
+            await self.app(scope, receive, send_wrapper)
+            log_repeated(queries, f"{scope['method']} {scope['path']}")
@@ -5,7 +5,7 @@ FastAPI Backend for Revenue Share Data System
 from fastapi import FastAPI, HTTPException, Depends, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from fastapi.middleware.cors import CORSMiddleware
-from sqlalchemy import create_engine, Column, Integer, String, Numeric, Boolean, DateTime, Date, Text, ForeignKey, JSON
+from sqlalchemy import create_engine, Column, Integer, String, Numeric, Boolean, DateTime, Date, Text, ForeignKey, JSON, UniqueConstraint
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, Session, relationship
 from sqlalchemy.dialects.postgresql import JSONB
@@ -14,11 +14,18 @@ import json
 from pydantic import BaseModel, Field
 from typing import List, Optional, Dict, Any
 from datetime import datetime, date
+from decimal import Decimal
 import os
+import sys
 from dotenv import load_dotenv
 import json
 import decimal
 
+# crawler/ nằm ở thư mục gốc của repo (storage dùng chung với crawler và data_fetcher)
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from crawler.storage import upsert_raw_rows
+
 load_dotenv()
 
 # Database Configuration
@@ -66,17 +73,27 @@ class RawRevenueData(Base):
     channel = Column(String(255), nullable=False)
     slot = Column(String(255), nullable=False)
     time_unit = Column(String(50), nullable=False)
-    total_player_impr = Column(String(50))
-    total_ad_impr = Column(String(50))
-    rpm = Column(String(50))
-    gross_revenue_usd = Column(String(50))
-    net_revenue_usd = Column(String(50))
+    # Giá trị đã parse một lần lúc ghi (NULL cho "-"); chuỗi gốc giữ ở cột *_raw để đối chiếu
+    total_player_impr = Column(Numeric(20, 2))
+    total_ad_impr = Column(Numeric(20, 2))
+    rpm = Column(Numeric(20, 6))
+    gross_revenue_usd = Column(Numeric(20, 6))
+    net_revenue_usd = Column(Numeric(20, 6))
+    total_player_impr_raw = Column(String(50))
+    total_ad_impr_raw = Column(String(50))
+    rpm_raw = Column(String(50))
+    gross_revenue_usd_raw = Column(String(50))
+    net_revenue_usd_raw = Column(String(50))
     fetched_at = Column(DateTime, default=datetime.utcnow)
     fetch_date = Column(Date, nullable=False)
     created_at = Column(DateTime, default=datetime.utcnow)
     
     computed_metrics = relationship("ComputedMetric", back_populates="raw_data")
 
+    __table_args__ = (
+        UniqueConstraint('channel', 'slot', 'time_unit', 'fetch_date', name='unique_record'),
+    )
+
 
 class Formula(Base):
     __tablename__ = "formulas"
@@ -107,6 +124,10 @@ class ComputedMetric(Base):
     
     raw_data = relationship("RawRevenueData", back_populates="computed_metrics")
     formula = relationship("Formula")
+    
+    __table_args__ = (
+        UniqueConstraint('raw_data_id', 'formula_id', 'metric_name', name='unique_computed'),
+    )
 
 
 class AggregatedMetric(Base):
@@ -120,6 +141,10 @@ class AggregatedMetric(Base):
     metric_value = Column(Numeric(20, 6))
     formula_id = Column(Integer, ForeignKey("formulas.id"))
     computed_at = Column(DateTime, default=datetime.utcnow)
+    
+    __table_args__ = (
+        UniqueConstraint('channel', 'time_unit', 'fetch_date', 'metric_name', 'formula_id', name='unique_aggregated'),
+    )
 
 
 class FetchLog(Base):
@@ -134,6 +159,7 @@ class FetchLog(Base):
     started_at = Column(DateTime, default=datetime.utcnow)
     completed_at = Column(DateTime)
     duration_seconds = Column(Integer)
+    metrics = Column(Text)  # JSON: {"wall_ms": ..., "stages": {stage: {busy_ms, idle_ms, blocked_ms, items}}}
 
 
 # ============================================
@@ -141,6 +167,7 @@ class FetchLog(Base):
 # ============================================
 
 class RawRevenueDataCreate(BaseModel):
+    """Một dòng như scrape được: số là chuỗi gốc ("1,234.5", "-"), parse lúc ghi"""
     channel: str
     slot: str
     time_unit: str
@@ -157,11 +184,16 @@ class RawRevenueDataResponse(BaseModel):
     channel: str
     slot: str
     time_unit: str
-    total_player_impr: Optional[str]
-    total_ad_impr: Optional[str]
-    rpm: Optional[str]
-    gross_revenue_usd: Optional[str]
-    net_revenue_usd: Optional[str]
+    total_player_impr: Optional[Decimal]
+    total_ad_impr: Optional[Decimal]
+    rpm: Optional[Decimal]
+    gross_revenue_usd: Optional[Decimal]
+    net_revenue_usd: Optional[Decimal]
+    total_player_impr_raw: Optional[str] = None
+    total_ad_impr_raw: Optional[str] = None
+    rpm_raw: Optional[str] = None
+    gross_revenue_usd_raw: Optional[str] = None
+    net_revenue_usd_raw: Optional[str] = None
     fetched_at: datetime
     fetch_date: date
     
@@ -263,21 +295,30 @@ async def health_check():
 # Raw Data Endpoints
 @app.post("/api/raw-data", response_model=RawRevenueDataResponse, status_code=status.HTTP_201_CREATED)
 async def create_raw_data(data: RawRevenueDataCreate, db: Session = Depends(get_db)):
-    """Create new raw revenue data entry"""
-    db_data = RawRevenueData(**data.dict())
-    db.add(db_data)
+    """Create (or overwrite) a raw revenue data entry; numbers are parsed like crawled rows"""
+    upsert_raw_rows(db, [data.dict()], data.fetch_date, model=RawRevenueData)
     db.commit()
-    db.refresh(db_data)
-    return db_data
+    return db.query(RawRevenueData).filter(
+        RawRevenueData.channel == data.channel,
+        RawRevenueData.slot == data.slot,
+        RawRevenueData.time_unit == data.time_unit,
+        RawRevenueData.fetch_date == data.fetch_date
+    ).first()
 
 
 @app.post("/api/raw-data/bulk", status_code=status.HTTP_201_CREATED)
 async def create_bulk_raw_data(data_list: List[RawRevenueDataCreate], db: Session = Depends(get_db)):
-    """Bulk create raw revenue data"""
-    db_data_list = [RawRevenueData(**data.dict()) for data in data_list]
-    db.add_all(db_data_list)
+    """Bulk create raw revenue data (upsert per fetch_date, same path as the crawler)"""
+    by_date = {}
+    for data in data_list:
+        by_date.setdefault(data.fetch_date, []).append(data.dict())
+    created = updated = 0
+    for fetch_date, rows in by_date.items():
+        date_created, date_updated = upsert_raw_rows(db, rows, fetch_date, model=RawRevenueData)
+        created += date_created
+        updated += date_updated
     db.commit()
-    return {"created": len(db_data_list), "message": "Bulk data created successfully"}
+    return {"created": created, "updated": updated, "message": "Bulk data created successfully"}
 
 
 @app.get("/api/raw-data", response_model=List[RawRevenueDataResponse])
@@ -461,7 +502,8 @@ async def get_fetch_logs(
             "error_message": r.error_message,
             "started_at": r.started_at,
             "completed_at": r.completed_at,
-            "duration_seconds": r.duration_seconds
+            "duration_seconds": r.duration_seconds,
+            "metrics": json.loads(r.metrics) if r.metrics else None
         }
         for r in results
     ]
@@ -5,6 +5,7 @@ Handles scheduled fetching of revenue data
 
 import sys
 import os
+import json
 from datetime import datetime, date, timedelta
 from sqlalchemy.orm import Session
 from sqlalchemy import create_engine
@@ -23,6 +24,9 @@ except ImportError:
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from scraper import RevenueShareScraper
+from crawler.storage import upsert_raw_rows
+from crawler.db import bump_data_version
+from crawler.timing import RunTimings
 try:
     from backend.app import RawRevenueData, FetchLog, Base, engine
     from backend.formula_engine import FormulaEngine
@@ -46,11 +50,9 @@ class DataFetcher:
             password=os.getenv("SCRAPER_PASSWORD", "gliacloud")
         )
     
-    def _parse_numeric_value(self, value: str) -> str:
-        """Parse numeric value, keeping original format for storage"""
-        if not value or value == '-':
-            return None
-        return value.replace(',', '') if ',' in value else value
+    def _store_rows(self, rows: List[Dict], target_date: date):
+        """Store scraped rows for target_date with one bulk upsert per chunk. Returns (created, updated)."""
+        return upsert_raw_rows(self.db, rows, target_date, model=RawRevenueData)
     
     def fetch_and_store(self, target_date: date = None, first_page_only: bool = False) -> Dict:
         """Fetch data and store in database"""
@@ -64,13 +66,19 @@ class DataFetcher:
         )
         self.db.add(fetch_log)
         self.db.commit()
+        # Thời gian từng bước + pages / bytes / rows → fetch_logs.metrics
+        timings = RunTimings()
+        self.scraper.timings = timings
         
         try:
-            # Login
-            if not self.scraper.login():
+            # Login (dùng lại cookie trong SCRAPER_SESSION_FILE nếu có)
+            with timings.stage("login"):
+                logged_in = self.scraper.ensure_logged_in()
+            if not logged_in:
                 fetch_log.status = 'failed'
                 fetch_log.error_message = "Login failed"
                 fetch_log.completed_at = datetime.utcnow()
+                fetch_log.metrics = json.dumps(timings.as_dict())
                 self.db.commit()
                 return {"status": "failed", "error": "Login failed"}
             
@@ -78,81 +86,48 @@ class DataFetcher:
             date_str = target_date.strftime("%Y-%m-%d")
             url = f"https://gstudio.gliacloud.com/ad-sharing/publisher/revenueshare/?channel=No+Filter&time_unit_date__range__gte={date_str}&time_unit_date__range__lte={date_str}"
             
-            # Fetch data
-            if first_page_only:
-                data = self.scraper.scrape_table_first_page_only(url)
-            else:
-                data = self.scraper.scrape_table(url)
+            # Fetch + store từng trang ngay khi parse xong
+            pages = self.scraper.iter_pages(url, first_page_only=first_page_only)
             
-            if not data:
+            records_created = 0
+            records_updated = 0
+            pages_fetched = 0
+            
+            for page, rows in pages:
+                with timings.stage("store"):
+                    created, updated = self._store_rows(rows, target_date)
+                    self.db.commit()
+                timings.count("rows_stored", created + updated)
+                records_created += created
+                records_updated += updated
+                pages_fetched += 1
+            
+            if records_created + records_updated == 0:
                 fetch_log.status = 'failed'
                 fetch_log.error_message = "No data fetched"
                 fetch_log.completed_at = datetime.utcnow()
+                fetch_log.metrics = json.dumps(timings.as_dict())
                 self.db.commit()
                 return {"status": "failed", "error": "No data fetched"}
             
-            # Store data (update existing or create new)
-            records_created = 0
-            records_updated = 0
-            
-            # Normalize keys - try both lowercase and original case
-            def get_value(row_data, key_variants):
-                for key in key_variants:
-                    if key in row_data:
-                        return row_data[key]
-                return ''
-            
-            for row_data in data:
-                # Check if record already exists
-                existing = self.db.query(RawRevenueData).filter(
-                    RawRevenueData.channel == get_value(row_data, ['channel', 'Channel', 'CHANNEL']),
-                    RawRevenueData.slot == get_value(row_data, ['slot', 'Slot', 'SLOT']),
-                    RawRevenueData.time_unit == get_value(row_data, ['time unit', 'time_unit', 'Time Unit', 'TIME UNIT']),
-                    RawRevenueData.fetch_date == target_date
-                ).first()
-                
-                if existing:
-                    # Update existing record (ghi đè)
-                    existing.total_player_impr = get_value(row_data, ['total player impr', 'total_player_impr', 'Total Player Impr', 'TOTAL PLAYER IMPR'])
-                    existing.total_ad_impr = get_value(row_data, ['total ad impr', 'total_ad_impr', 'Total Ad Impr', 'TOTAL AD IMPR'])
-                    existing.rpm = get_value(row_data, ['rpm', 'RPM'])
-                    existing.gross_revenue_usd = get_value(row_data, ['gross revenue (usd)', 'gross_revenue_usd', 'Gross Revenue (USD)', 'GROSS REVENUE (USD)'])
-                    existing.net_revenue_usd = get_value(row_data, ['net revenue (usd)', 'net_revenue_usd', 'Net Revenue (USD)', 'NET REVENUE (USD)'])
-                    existing.fetched_at = datetime.utcnow()
-                    records_updated += 1
-                else:
-                    # Create new record
-                    db_row = RawRevenueData(
-                        channel=get_value(row_data, ['channel', 'Channel', 'CHANNEL']),
-                        slot=get_value(row_data, ['slot', 'Slot', 'SLOT']),
-                        time_unit=get_value(row_data, ['time unit', 'time_unit', 'Time Unit', 'TIME UNIT']),
-                        total_player_impr=get_value(row_data, ['total player impr', 'total_player_impr', 'Total Player Impr', 'TOTAL PLAYER IMPR']),
-                        total_ad_impr=get_value(row_data, ['total ad impr', 'total_ad_impr', 'Total Ad Impr', 'TOTAL AD IMPR']),
-                        rpm=get_value(row_data, ['rpm', 'RPM']),
-                        gross_revenue_usd=get_value(row_data, ['gross revenue (usd)', 'gross_revenue_usd', 'Gross Revenue (USD)', 'GROSS REVENUE (USD)']),
-                        net_revenue_usd=get_value(row_data, ['net revenue (usd)', 'net_revenue_usd', 'Net Revenue (USD)', 'NET REVENUE (USD)']),
-                        fetch_date=target_date
-                    )
-                    self.db.add(db_row)
-                    records_created += 1
-            
-            self.db.commit()
-            
             # Compute formulas
-            engine = FormulaEngine(self.db)
+            engine = FormulaEngine(self.db, timings=timings)
             engine.compute_all_formulas(compute_for_date=target_date)
             
             # Process data (tổng hợp desktop + mobile)
             from backend.data_processor import process_revenue_data
-            process_result = process_revenue_data(self.db, target_date)
+            with timings.stage("process"):
+                process_result = process_revenue_data(self.db, target_date)
             
             # Update fetch log
             fetch_log.status = 'success'
             fetch_log.records_fetched = records_created + records_updated
-            fetch_log.pages_fetched = 1 if first_page_only else len(data) // 100  # Approximate
+            fetch_log.pages_fetched = pages_fetched
             fetch_log.completed_at = datetime.utcnow()
             fetch_log.duration_seconds = int((fetch_log.completed_at - fetch_log.started_at).total_seconds())
+            fetch_log.metrics = json.dumps(timings.as_dict())
             self.db.commit()
+            bump_data_version(self.db)
             
             return {
                 "status": "success",
@@ -166,6 +141,7 @@ class DataFetcher:
             fetch_log.status = 'failed'
             fetch_log.error_message = str(e)
             fetch_log.completed_at = datetime.utcnow()
+            fetch_log.metrics = json.dumps(timings.as_dict())
             self.db.commit()
             return {"status": "failed", "error": str(e)}
     
@@ -37,18 +37,9 @@ class ProcessedRevenueData(Base):
     processed_at = Column(DateTime, default=lambda: __import__('datetime').datetime.utcnow())
 
 
-def parse_numeric(value: str) -> Optional[Decimal]:
-    """Parse numeric value from string, handling commas and dashes"""
-    if not value or value == '-' or value.strip() == '':
-        return Decimal('0')
-    
-    # Remove commas
-    value = value.replace(',', '').strip()
-    
-    try:
-        return Decimal(value)
-    except:
-        return Decimal('0')
+def numeric_value(value) -> Decimal:
+    """Typed raw column value (DECIMAL, parsed at ingestion) → Decimal, 0 for NULL ('-')"""
+    return Decimal(value) if value is not None else Decimal('0')
 
 
 def extract_base_slot(slot: str) -> str:
@@ -138,12 +129,12 @@ def process_revenue_data(db: Session, target_date: date) -> Dict:
             total_revenue = Decimal('0')
             
             if desktop_row:
-                total_player_impr += parse_numeric(desktop_row.total_player_impr or '0')
-                total_revenue += parse_numeric(desktop_row.net_revenue_usd or '0')
+                total_player_impr += numeric_value(desktop_row.total_player_impr)
+                total_revenue += numeric_value(desktop_row.net_revenue_usd)
             
             if mobile_row:
-                total_player_impr += parse_numeric(mobile_row.total_player_impr or '0')
-                total_revenue += parse_numeric(mobile_row.net_revenue_usd or '0')
+                total_player_impr += numeric_value(mobile_row.total_player_impr)
+                total_revenue += numeric_value(mobile_row.net_revenue_usd)
             
             # Tính RPM
             rpm = Decimal('0')
@@ -5,10 +5,19 @@ Handles computation of custom formulas on revenue data
 
 from sqlalchemy.orm import Session
 from sqlalchemy import func
+from datetime import datetime
 from typing import Dict, List, Any, Optional
 from decimal import Decimal
+from types import SimpleNamespace
+import ast
 import re
 import math
+from functools import reduce
+from crawler.timing import RunTimings, timed, count
+try:
+    import numpy as np
+except ImportError:
+    np = None
 try:
     from backend.app import RawRevenueData, Formula, ComputedMetric, AggregatedMetric
 except ImportError:
@@ -19,74 +28,306 @@ except ImportError:
         from crawler.db import RawRevenueData, Formula, ComputedMetric, AggregatedMetric
 
 
-class FormulaEngine:
-    def __init__(self, db: Session):
-        self.db = db
+# Aggregated formulas with a fixed meaning (computed by name, not by expression)
+AGGREGATED_BUILTINS = {
+    'rpm_total_net_revenue': ('net_revenue_usd',),
+    'rpm_combined': ('net_revenue_usd', 'total_player_impr'),
+    'total_net_revenue': ('net_revenue_usd',),
+}
+
+AGGREGATED_KEY_COLUMNS = ('channel', 'time_unit', 'fetch_date', 'metric_name', 'formula_id')
+COMPUTED_KEY_COLUMNS = ('raw_data_id', 'formula_id', 'metric_name')
+
+# Row fields a formula expression may reference
+ROW_FIELDS = ('total_player_impr', 'total_ad_impr', 'rpm', 'gross_revenue_usd', 'net_revenue_usd')
+
+
+def _decimal_result(fn):
+    """Wrap a math function so it returns Decimal and mixes with Decimal row values"""
+    def wrapper(*args):
+        return Decimal(str(fn(*(float(a) for a in args))))
+    return wrapper
+
+
+SAFE_MATH_FUNCTIONS = ('sqrt', 'log', 'log10', 'exp', 'floor', 'ceil', 'fabs', 'pow')
+SAFE_MATH_CONSTANTS = ('pi', 'e')
+# The only math.<attr> names a formula may use (never dunders like __setattr__ / __class__)
+SAFE_MATH_ATTRS = frozenset(SAFE_MATH_FUNCTIONS + SAFE_MATH_CONSTANTS)
+
+SAFE_MATH = SimpleNamespace(
+    **{name: _decimal_result(getattr(math, name)) for name in SAFE_MATH_FUNCTIONS},
+    pi=Decimal(str(math.pi)), e=Decimal(str(math.e)),
+)
+
+# Only allow safe operations
+SAFE_FUNCTIONS = {
+    "abs": abs, "round": round, "min": min, "max": max,
+    "sum": sum, "math": SAFE_MATH, "Decimal": Decimal
+}
+
+_ALLOWED_NODES = (
+    ast.Expression, ast.Constant, ast.Name, ast.Load, ast.Call, ast.Attribute,
+    ast.BinOp, ast.UnaryOp, ast.BoolOp, ast.Compare, ast.IfExp,
+    ast.Add, ast.Sub, ast.Mult, ast.Div, ast.FloorDiv, ast.Mod, ast.Pow, ast.USub, ast.UAdd,
+    ast.And, ast.Or, ast.Not, ast.Eq, ast.NotEq, ast.Lt, ast.LtE, ast.Gt, ast.GtE,
+)
+
+
+class FormulaError(ValueError):
+    """Formula expression is not valid Python or uses something outside the whitelist"""
+
+
+class _FloatToDecimal(ast.NodeTransformer):
+    """Float literals become Decimal so they mix with Decimal row values"""
+    def visit_Constant(self, node):
+        if isinstance(node.value, float):
+            return ast.copy_location(ast.Call(
+                func=ast.Name(id='Decimal', ctx=ast.Load()),
+                args=[ast.Constant(value=repr(node.value))], keywords=[]
+            ), node)
+        return node
+
+
+class CompiledFormula:
+    """A validated formula expression compiled into a plain function of the row fields it uses"""
     
-    def _parse_value(self, value: str) -> Optional[Decimal]:
-        """Parse string value to Decimal, handling commas and dashes"""
-        if not value or value == '-' or value.strip() == '':
-            return None
+    def __init__(self, expression: str):
         try:
-            # Remove commas and convert to decimal
-            cleaned = value.replace(',', '').strip()
-            return Decimal(cleaned)
-        except:
-            return None
+            tree = ast.parse(expression.strip(), mode='eval')
+        except SyntaxError as e:
+            raise FormulaError(f"Invalid formula expression: {expression!r} ({e.msg})")
+        
+        fields = []
+        for node in ast.walk(tree):
+            if not isinstance(node, _ALLOWED_NODES):
+                raise FormulaError(f"Not allowed in formula: {type(node).__name__}")
+            if isinstance(node, ast.Attribute):
+                if not (isinstance(node.value, ast.Name) and node.value.id == 'math' and node.attr in SAFE_MATH_ATTRS):
+                    raise FormulaError(f"Not allowed in formula: attribute {node.attr!r}")
+            elif isinstance(node, ast.Name):
+                if node.id in ROW_FIELDS:
+                    if node.id not in fields:
+                        fields.append(node.id)
+                elif node.id not in SAFE_FUNCTIONS:
+                    raise FormulaError(f"Unknown name in formula: {node.id!r}")
+            elif isinstance(node, ast.Call) and not isinstance(node.func, (ast.Name, ast.Attribute)):
+                raise FormulaError("Only whitelisted functions can be called in formulas")
+            elif isinstance(node, ast.Constant) and not isinstance(node.value, (int, float, str)):
+                raise FormulaError(f"Not allowed in formula: constant {node.value!r}")
+        
+        body = ast.fix_missing_locations(_FloatToDecimal().visit(tree)).body
+        # lambda <fields>: <expression>, evaluated once with only the safe names visible
+        fn_tree = ast.Expression(body=ast.Lambda(
+            args=ast.arguments(
+                posonlyargs=[], args=[ast.arg(arg=f) for f in fields], vararg=None,
+                kwonlyargs=[], kw_defaults=[], kwarg=None, defaults=[]
+            ),
+            body=body
+        ))
+        ast.fix_missing_locations(fn_tree)
+        code = compile(fn_tree, f"<formula {expression!r}>", 'eval')
+        
+        self.expression = expression
+        self.fields = tuple(fields)
+        self.fn = eval(code, {"__builtins__": {}, **SAFE_FUNCTIONS})
     
-    def _get_field_value(self, row: RawRevenueData, field_name: str) -> Optional[Decimal]:
-        """Get field value from row"""
-        field_map = {
-            'total_player_impr': row.total_player_impr,
-            'total_ad_impr': row.total_ad_impr,
-            'rpm': row.rpm,
-            'gross_revenue_usd': row.gross_revenue_usd,
-            'net_revenue_usd': row.net_revenue_usd,
+    def evaluate(self, context: Dict[str, Any]) -> Optional[Decimal]:
+        """Evaluate against a row context; None if any referenced field is missing"""
+        args = []
+        for field in self.fields:
+            value = context.get(field)
+            if value is None:
+                return None
+            args.append(value)
+        result = self.fn(*args)
+        if isinstance(result, (int, float)) and not isinstance(result, bool):
+            return Decimal(str(result))
+        return result
+
+
+# (formula.id, formula.updated_at, expression) -> CompiledFormula, or FormulaError if it did not compile
+_compiled_formulas: Dict[Any, Any] = {}
+
+
+def compile_formula(formula: Formula) -> Optional[CompiledFormula]:
+    """Compile a formula once per (id, updated_at); editing the formula invalidates the cache entry"""
+    key = (formula.id, formula.updated_at, formula.formula_expression)
+    cached = _compiled_formulas.get(key)
+    if cached is None:
+        try:
+            cached = CompiledFormula(formula.formula_expression)
+        except FormulaError as e:
+            print(f"Error compiling formula {formula.name}: {e}")
+            cached = e
+        _compiled_formulas[key] = cached
+    return None if isinstance(cached, FormulaError) else cached
+
+
+class _SumToField(ast.NodeTransformer):
+    """sum(field) → field; counts how many field references were wrapped in sum()"""
+    def __init__(self):
+        self.replaced = 0
+    
+    def visit_Call(self, node):
+        if (isinstance(node.func, ast.Name) and node.func.id == 'sum' and len(node.args) == 1
+                and not node.keywords and isinstance(node.args[0], ast.Name) and node.args[0].id in ROW_FIELDS):
+            self.replaced += 1
+            return ast.copy_location(node.args[0], node)
+        return self.generic_visit(node)
+
+
+def compile_sum_formula(expression: str) -> Optional[CompiledFormula]:
+    """
+    For a "simple sum" formula such as sum(net_revenue_usd) / sum(total_player_impr) * 1000,
+    where every field appears only as sum(field), return the formula compiled over the per-group
+    sums (sum(x) → x). Anything else returns None and is aggregated in Python.
+    """
+    try:
+        CompiledFormula(expression)
+        tree = ast.parse(expression.strip(), mode='eval')
+    except (FormulaError, SyntaxError):
+        return None
+    field_refs = sum(1 for node in ast.walk(tree) if isinstance(node, ast.Name) and node.id in ROW_FIELDS)
+    transformer = _SumToField()
+    tree = transformer.visit(tree)
+    if transformer.replaced == 0 or transformer.replaced != field_refs:
+        return None
+    if any(isinstance(node, ast.Name) and node.id == 'sum' for node in ast.walk(tree)):
+        return None
+    return CompiledFormula(ast.unparse(tree))
+
+
+def _as_float(value) -> float:
+    """Typed column value → float, NaN for NULL ('-' when scraped)"""
+    return math.nan if value is None else float(value)
+
+
+class ColumnarRows:
+    """A batch of raw rows loaded once into float64 columns plus a validity mask per field"""
+    
+    def __init__(self, rows: List[Any]):
+        self.rows = rows
+        self.size = len(rows)
+        self.values = {
+            field: np.fromiter((_as_float(getattr(row, field)) for row in rows), dtype=np.float64, count=self.size)
+            for field in ROW_FIELDS
         }
+        self.valid = {field: ~np.isnan(column) for field, column in self.values.items()}
+
+
+def _elementwise(ufunc):
+    def call(*args):
+        if len(args) < 2:
+            raise _NotVectorizable()
+        return reduce(ufunc, args)
+    return call
+
+
+class _NotVectorizable(Exception):
+    pass
+
+
+# Vectorized stand-ins for SAFE_FUNCTIONS / SAFE_MATH; round() and Decimal() need exact
+# decimal rounding, so formulas using them stay on the Decimal path
+if np is not None:
+    VECTOR_FUNCTIONS = {
+        "abs": np.abs, "min": _elementwise(np.minimum), "max": _elementwise(np.maximum),
+        "math": SimpleNamespace(
+            sqrt=np.sqrt, log=np.log, log10=np.log10, exp=np.exp, floor=np.floor, ceil=np.ceil,
+            fabs=np.abs, pow=np.power, pi=math.pi, e=math.e,
+        ),
+    }
+
+_VECTOR_NODES = (
+    ast.Expression, ast.Constant, ast.Name, ast.Load, ast.Call, ast.Attribute, ast.BinOp, ast.UnaryOp,
+    ast.Add, ast.Sub, ast.Mult, ast.Div, ast.FloorDiv, ast.Mod, ast.Pow, ast.USub, ast.UAdd,
+)
+
+
+class VectorizedFormula:
+    """A validated formula compiled into a NumPy expression over whole columns"""
+    
+    def __init__(self, compiled: CompiledFormula):
+        tree = ast.parse(compiled.expression.strip(), mode='eval')
+        for node in ast.walk(tree):
+            # Comparisons / and / or / if-else have no elementwise meaning without rewriting
+            if not isinstance(node, _VECTOR_NODES):
+                raise _NotVectorizable()
+            if isinstance(node, ast.Name) and node.id not in ROW_FIELDS and node.id not in VECTOR_FUNCTIONS:
+                raise _NotVectorizable()
+            if isinstance(node, ast.Constant) and not isinstance(node.value, (int, float)):
+                raise _NotVectorizable()
         
-        value = field_map.get(field_name)
-        if value:
-            return self._parse_value(value)
-        return None
+        fields = compiled.fields
+        fn_tree = ast.Expression(body=ast.Lambda(
+            args=ast.arguments(
+                posonlyargs=[], args=[ast.arg(arg=f) for f in fields], vararg=None,
+                kwonlyargs=[], kw_defaults=[], kwarg=None, defaults=[]
+            ),
+            body=tree.body
+        ))
+        ast.fix_missing_locations(fn_tree)
+        code = compile(fn_tree, f"<vectorized formula {compiled.expression!r}>", 'eval')
+        
+        self.fields = fields
+        self.fn = eval(code, {"__builtins__": {}, **VECTOR_FUNCTIONS})
     
-    def _evaluate_expression(self, expression: str, context: Dict[str, Any]) -> Optional[Decimal]:
-        """Safely evaluate a Python expression with context"""
+    def evaluate(self, columns: ColumnarRows) -> List[Optional[Decimal]]:
+        """One result per row; None where a referenced field is missing or the result is not finite"""
+        mask = np.ones(columns.size, dtype=bool)
+        for field in self.fields:
+            mask &= columns.valid[field]
+        with np.errstate(all='ignore'):
+            result = np.broadcast_to(
+                np.asarray(self.fn(*(columns.values[f] for f in self.fields)), dtype=np.float64),
+                (columns.size,)
+            )
+        return _to_decimals(result, mask & np.isfinite(result))
+
+
+def _to_decimals(result, mask) -> List[Optional[Decimal]]:
+    return [Decimal(str(value)) if ok else None for value, ok in zip(result.tolist(), mask.tolist())]
+
+
+# Same cache keys as _compiled_formulas; None means "use the Decimal path"
+_vectorized_formulas: Dict[Any, Optional[VectorizedFormula]] = {}
+
+
+def vectorize_formula(formula: Formula) -> Optional[VectorizedFormula]:
+    """Vectorized form of a formula, or None if NumPy is missing or the formula needs the Decimal path"""
+    if np is None:
+        return None
+    key = (formula.id, formula.updated_at, formula.formula_expression)
+    if key not in _vectorized_formulas:
+        compiled = compile_formula(formula)
         try:
-            # Replace field names with values from context
-            for key, value in context.items():
-                if value is not None:
-                    expression = expression.replace(key, str(value))
-                else:
-                    # If value is None, return None for the whole expression
-                    if key in expression:
-                        return None
-            
-            # Only allow safe operations
-            allowed_names = {
-                "abs": abs, "round": round, "min": min, "max": max,
-                "sum": sum, "math": math, "Decimal": Decimal
-            }
-            
-            # Evaluate expression
-            result = eval(expression, {"__builtins__": {}}, allowed_names)
-            
-            if isinstance(result, (int, float)):
-                return Decimal(str(result))
-            return result
-        except Exception as e:
-            print(f"Error evaluating expression: {expression}, Error: {e}")
+            _vectorized_formulas[key] = VectorizedFormula(compiled) if compiled is not None else None
+        except (_NotVectorizable, SyntaxError, TypeError):
+            _vectorized_formulas[key] = None
+    return _vectorized_formulas[key]
+
+
+
+class FormulaEngine:
+    def __init__(self, db: Session, timings: RunTimings = None):
+        self.db = db
+        # formulas_load / formulas_eval / formulas_write (ms) + số metric đã ghi; None = không đo
+        self.timings = timings
+    
+    def _get_field_value(self, row: RawRevenueData, field_name: str) -> Optional[Decimal]:
+        """Get field value from row (DECIMAL column parsed at ingestion, None for '-')"""
+        if field_name not in ROW_FIELDS:
             return None
+        return getattr(row, field_name)
+    
+    def _row_context(self, row: RawRevenueData) -> Dict[str, Optional[Decimal]]:
+        """Typed row values for formula evaluation"""
+        return {field: self._get_field_value(row, field) for field in ROW_FIELDS}
     
     def compute_row_metric(self, row: RawRevenueData, formula: Formula) -> Optional[Decimal]:
         """Compute metric for a single row"""
         # Build context with row data
-        context = {
-            'total_player_impr': self._get_field_value(row, 'total_player_impr'),
-            'total_ad_impr': self._get_field_value(row, 'total_ad_impr'),
-            'rpm': self._get_field_value(row, 'rpm'),
-            'gross_revenue_usd': self._get_field_value(row, 'gross_revenue_usd'),
-            'net_revenue_usd': self._get_field_value(row, 'net_revenue_usd'),
-        }
+        context = self._row_context(row)
         
         # Handle special formulas
         if formula.name == 'rpm_per_1000_players':
@@ -96,200 +337,274 @@ class FormulaEngine:
                 return (net_rev / player_impr) * Decimal('1000')
             return None
         
-        # Generic formula evaluation
-        expression = formula.formula_expression
-        
-        # Replace common patterns
-        expression = expression.replace('net_revenue_usd', 'net_revenue_usd')
-        expression = expression.replace('total_player_impr', 'total_player_impr')
-        expression = expression.replace('total_ad_impr', 'total_ad_impr')
-        expression = expression.replace('gross_revenue_usd', 'gross_revenue_usd')
-        
-        return self._evaluate_expression(expression, context)
+        # Generic formula evaluation: compiled once, then a plain function call per row
+        compiled = compile_formula(formula)
+        if compiled is None:
+            return None
+        try:
+            return compiled.evaluate(context)
+        except Exception as e:
+            print(f"Error evaluating formula {formula.name}: {formula.formula_expression}, Error: {e}")
+            return None
     
-    def compute_aggregated_metric(self, formula: Formula, 
-                                 channel: Optional[str] = None,
-                                 time_unit: Optional[str] = None,
-                                 fetch_date: Optional[Any] = None) -> Optional[Decimal]:
-        """Compute aggregated metric across multiple rows"""
-        # Build query
-        query = self.db.query(RawRevenueData)
-        
-        if channel:
-            query = query.filter(RawRevenueData.channel == channel)
-        if time_unit:
-            query = query.filter(RawRevenueData.time_unit == time_unit)
-        if fetch_date:
-            query = query.filter(RawRevenueData.fetch_date == fetch_date)
-        
-        rows = query.all()
-        
+    def compute_row_metrics(self, rows: List[RawRevenueData], formula: Formula,
+                            columns: Optional["ColumnarRows"] = None) -> List[Optional[Decimal]]:
+        """
+        Compute a row-level formula for a batch of rows, one result per row.
+        Uses NumPy columns when available (pass `columns` to reuse one load across formulas);
+        formulas needing exact decimal rounding fall back to compute_row_metric per row.
+        """
         if not rows:
+            return []
+        if np is not None:
+            if formula.name == 'rpm_per_1000_players':
+                columns = columns if columns is not None else ColumnarRows(rows)
+                net_rev = columns.values['net_revenue_usd']
+                player_impr = columns.values['total_player_impr']
+                mask = columns.valid['net_revenue_usd'] & columns.valid['total_player_impr']
+                with np.errstate(all='ignore'):
+                    mask &= (net_rev != 0) & (player_impr > 0)
+                    result = net_rev / player_impr * 1000
+                return _to_decimals(result, mask)
+            vectorized = vectorize_formula(formula)
+            if vectorized is not None:
+                columns = columns if columns is not None else ColumnarRows(rows)
+                try:
+                    return vectorized.evaluate(columns)
+                except Exception as e:
+                    print(f"Vectorized evaluation failed for formula {formula.name}, falling back: {e}")
+        return [self.compute_row_metric(row, formula) for row in rows]
+    
+    def _is_aggregated(self, formula: Formula) -> bool:
+        """Aggregated formulas: the built-ins, or rpm/revenue formulas using sum(...)"""
+        return formula.name in AGGREGATED_BUILTINS or (
+            formula.formula_type in ['rpm', 'revenue'] and 'sum' in formula.formula_expression.lower()
+        )
+    
+    def _pushdown_fields(self, formula: Formula):
+        """(fields to SUM, compiled formula over the sums or None for a built-in), or None if not pushable"""
+        if formula.name in AGGREGATED_BUILTINS:
+            return AGGREGATED_BUILTINS[formula.name], None
+        compiled = compile_sum_formula(formula.formula_expression)
+        if compiled is None:
             return None
-        
-        # Handle RPM = Tổng Net Revenue (Mobile + Desktop)
-        # Đây là tổng net revenue, KHÔNG chia cho impressions
-        if formula.name == 'rpm_total_net_revenue':
-            total_net_revenue = Decimal('0')
-            for row in rows:
-                net_rev = self._get_field_value(row, 'net_revenue_usd')
-                if net_rev:
-                    total_net_revenue += net_rev
-            return total_net_revenue
-        
-        # Handle RPM Combined = (Tổng Net Revenue / Tổng Player Impressions) * 1000
+        return compiled.fields, compiled
+    
+    def _aggregated_value(self, formula: Formula, compiled: Optional[CompiledFormula],
+                          sums: Dict[str, Any]) -> Optional[Decimal]:
+        if compiled is not None:
+            try:
+                return compiled.evaluate(sums)
+            except Exception as e:
+                print(f"Error evaluating formula {formula.name}: {formula.formula_expression}, Error: {e}")
+                return None
         if formula.name == 'rpm_combined':
-            total_net_revenue = Decimal('0')
-            total_player_impr = Decimal('0')
-            
-            for row in rows:
-                net_rev = self._get_field_value(row, 'net_revenue_usd')
-                player_impr = self._get_field_value(row, 'total_player_impr')
-                
-                if net_rev:
-                    total_net_revenue += net_rev
-                if player_impr:
-                    total_player_impr += player_impr
-            
+            # (Tổng Net Revenue / Tổng Player Impressions) * 1000
+            total_player_impr = Decimal(sums['total_player_impr'] or 0)
             if total_player_impr > 0:
-                return (total_net_revenue / total_player_impr) * Decimal('1000')
+                return (Decimal(sums['net_revenue_usd'] or 0) / total_player_impr) * Decimal('1000')
             return None
+        # Tổng net revenue (Mobile + Desktop), KHÔNG chia cho impressions
+        return Decimal(sums['net_revenue_usd'] or 0)
+    
+    def _aggregate_sql(self, formulas: List[Formula], compute_for_date=None, from_date=None,
+                       to_date=None) -> Dict[int, List[tuple]]:
+        """
+        Pushable aggregated formulas (built-ins and simple sum(...) formulas) evaluated from one
+        GROUP BY (channel, time_unit, fetch_date) query that SUMs every field any of them needs.
+        Returns {formula.id: [(channel, time_unit, fetch_date, value)]} for the formulas it handled.
+        """
+        plans = {}
+        fields = []
+        for formula in formulas:
+            plan = self._pushdown_fields(formula)
+            if plan is not None:
+                plans[formula.id] = (formula, plan[1])
+                fields.extend(f for f in plan[0] if f not in fields)
+        if not plans:
+            return {}
         
-        # Handle Total Net Revenue (tổng hợp)
-        if formula.name == 'total_net_revenue':
-            total = Decimal('0')
-            for row in rows:
-                net_rev = self._get_field_value(row, 'net_revenue_usd')
-                if net_rev:
-                    total += net_rev
-            return total
+        query = self.db.query(
+            RawRevenueData.channel,
+            RawRevenueData.time_unit,
+            RawRevenueData.fetch_date,
+            *[func.sum(getattr(RawRevenueData, field)).label(field) for field in fields]
+        ).group_by(RawRevenueData.channel, RawRevenueData.time_unit, RawRevenueData.fetch_date)
+        query = self._filter_dates(query, compute_for_date, from_date, to_date)
         
-        # Generic aggregated formula
-        # For now, return sum of individual row computations
-        total = Decimal('0')
-        count = 0
-        for row in rows:
-            value = self.compute_row_metric(row, formula)
+        results = {formula_id: [] for formula_id in plans}
+        for row in query.all():
+            sums = {field: getattr(row, field) for field in fields}
+            for formula_id, (formula, compiled) in plans.items():
+                value = self._aggregated_value(formula, compiled, sums)
+                results[formula_id].append((row.channel, row.time_unit, row.fetch_date, value))
+        return results
+    
+    def _aggregate_in_memory(self, formula: Formula, rows: List[Any], columns=None) -> List[tuple]:
+        """
+        Aggregated formulas that _aggregate_sql can't push down: sum of the non-zero row-level
+        results per (channel, time_unit, fetch_date), over rows already loaded
+        """
+        values = self.compute_row_metrics(rows, formula, columns=columns)
+        groups: Dict[tuple, List[Decimal]] = {}
+        for row, value in zip(rows, values):
+            group = groups.setdefault((row.channel, row.time_unit, row.fetch_date), [])
             if value:
-                total += value
-                count += 1
-        
-        return total if count > 0 else None
+                group.append(value)
+        return [
+            (channel, time_unit, fetch_date, sum(group, Decimal('0')) if group else None)
+            for (channel, time_unit, fetch_date), group in groups.items()
+        ]
     
-    def compute_formula(self, formula_id: int, 
-                       compute_for_date: Optional[Any] = None) -> Dict[str, Any]:
-        """Compute formula for all relevant data"""
-        formula = self.db.query(Formula).filter(Formula.id == formula_id).first()
-        if not formula:
-            return {"error": "Formula not found"}
-        
-        if not formula.is_active:
-            return {"error": "Formula is not active"}
-        
+    def _filter_dates(self, query, compute_for_date=None, from_date=None, to_date=None):
+        """Apply a single fetch_date or an inclusive [from_date, to_date] range to a raw-data query"""
+        if compute_for_date:
+            return query.filter(RawRevenueData.fetch_date == compute_for_date)
+        if from_date:
+            query = query.filter(RawRevenueData.fetch_date >= from_date)
+        if to_date:
+            query = query.filter(RawRevenueData.fetch_date <= to_date)
+        return query
+    
+    def _load_rows(self, compute_for_date=None, from_date=None, to_date=None) -> List[Any]:
+        """The raw rows to evaluate, read once (only the columns formulas use)"""
+        query = self.db.query(
+            RawRevenueData.id,
+            RawRevenueData.channel,
+            RawRevenueData.time_unit,
+            RawRevenueData.fetch_date,
+            *[getattr(RawRevenueData, field) for field in ROW_FIELDS]
+        )
+        return self._filter_dates(query, compute_for_date, from_date, to_date).all()
+    
+    def _existing_computed_keys(self, formula_ids: List[int], compute_for_date=None,
+                                from_date=None, to_date=None) -> set:
+        """(raw_data_id, formula_id, metric_name) already stored for these formulas and dates, in one query"""
+        query = self.db.query(
+            ComputedMetric.raw_data_id, ComputedMetric.formula_id, ComputedMetric.metric_name
+        ).join(RawRevenueData, RawRevenueData.id == ComputedMetric.raw_data_id).filter(
+            ComputedMetric.formula_id.in_(formula_ids)
+        )
+        return {tuple(r) for r in self._filter_dates(query, compute_for_date, from_date, to_date)}
+    
+    def _existing_aggregated_keys(self, formula_ids: List[int], compute_for_date=None,
+                                  from_date=None, to_date=None) -> set:
+        """AGGREGATED_KEY_COLUMNS tuples already stored for these formulas and dates, in one query"""
+        query = self.db.query(
+            *[getattr(AggregatedMetric, c) for c in AGGREGATED_KEY_COLUMNS]
+        ).filter(AggregatedMetric.formula_id.in_(formula_ids))
+        if compute_for_date:
+            query = query.filter(AggregatedMetric.fetch_date == compute_for_date)
+        if from_date:
+            query = query.filter(AggregatedMetric.fetch_date >= from_date)
+        if to_date:
+            query = query.filter(AggregatedMetric.fetch_date <= to_date)
+        return {tuple(r) for r in query}
+    
+    def compute_formulas(self, formulas: List[Formula],
+                         compute_for_date: Optional[Any] = None,
+                         from_date: Optional[Any] = None,
+                         to_date: Optional[Any] = None) -> List[Dict[str, Any]]:
+        """
+        Evaluate several formulas in a single pass:
+        - raw rows for the dates are read once (and loaded into NumPy columns once) for all
+          row-level formulas and the aggregated formulas that can't be pushed down to SQL
+        - pushable aggregated formulas share one GROUP BY query
+        - existing metric keys are prefetched with one query per target table
+        - results are written with one bulk upsert per target table
+        """
+        dates = (compute_for_date, from_date, to_date)
         results = {
-            "formula_id": formula_id,
-            "formula_name": formula.name,
-            "computed_metrics": 0,
-            "aggregated_metrics": 0
+            formula.id: {
+                "formula_id": formula.id,
+                "formula_name": formula.name,
+                "computed_metrics": 0,
+                "aggregated_metrics": 0
+            }
+            for formula in formulas
         }
         
-        # Determine if this is a row-level or aggregated formula
-        # Aggregated formulas: rpm_total_net_revenue, rpm_combined, total_net_revenue
-        aggregated_formulas = ['rpm_total_net_revenue', 'rpm_combined', 'total_net_revenue']
-        is_aggregated = formula.name in aggregated_formulas or (
-            formula.formula_type in ['rpm', 'revenue'] and 'sum' in formula.formula_expression.lower()
-        )
-        
-        if is_aggregated:
-            # Compute aggregated metrics
-            # Get unique combinations of channel, time_unit, fetch_date
-            query = self.db.query(
-                RawRevenueData.channel,
-                RawRevenueData.time_unit,
-                RawRevenueData.fetch_date
-            ).distinct()
-            
-            if compute_for_date:
-                query = query.filter(RawRevenueData.fetch_date == compute_for_date)
+        aggregated = [f for f in formulas if self._is_aggregated(f)]
+        row_level = [f for f in formulas if not self._is_aggregated(f)]
+        with timed(self.timings, "formulas_load"):
+            aggregated_values = self._aggregate_sql(aggregated, *dates)
+            in_memory = [f for f in aggregated if f.id not in aggregated_values]
             
-            combinations = query.all()
-            
-            for channel, time_unit, fetch_date in combinations:
-                value = self.compute_aggregated_metric(
-                    formula, 
-                    channel=channel,
-                    time_unit=time_unit,
-                    fetch_date=fetch_date
-                )
-                
-                if value is not None:
-                    # Check if aggregated metric already exists
-                    existing = self.db.query(AggregatedMetric).filter(
-                        AggregatedMetric.channel == channel,
-                        AggregatedMetric.time_unit == time_unit,
-                        AggregatedMetric.fetch_date == fetch_date,
-                        AggregatedMetric.metric_name == formula.name,
-                        AggregatedMetric.formula_id == formula_id
-                    ).first()
-                    
-                    if existing:
-                        existing.metric_value = value
-                        existing.computed_at = func.now()
-                    else:
-                        agg_metric = AggregatedMetric(
-                            channel=channel,
-                            time_unit=time_unit,
-                            fetch_date=fetch_date,
-                            metric_name=formula.name,
-                            metric_value=value,
-                            formula_id=formula_id
-                        )
-                        self.db.add(agg_metric)
-                    
-                    results["aggregated_metrics"] += 1
-        else:
-            # Compute row-level metrics
-            query = self.db.query(RawRevenueData)
-            if compute_for_date:
-                query = query.filter(RawRevenueData.fetch_date == compute_for_date)
+            rows = self._load_rows(*dates) if (row_level or in_memory) else []
+            columns = ColumnarRows(rows) if (rows and np is not None) else None
+        
+        computed_at = datetime.utcnow()
+        computed_rows = []
+        aggregated_rows = []
+        with timed(self.timings, "formulas_eval"):
+            for formula in row_level:
+                values = self.compute_row_metrics(rows, formula, columns=columns)
+                for row, value in zip(rows, values):
+                    if value is not None:
+                        computed_rows.append({
+                            'raw_data_id': row.id, 'formula_id': formula.id, 'metric_name': formula.name,
+                            'metric_value': value, 'computed_at': computed_at,
+                        })
+                        results[formula.id]["computed_metrics"] += 1
             
-            rows = query.all()
+            for formula in in_memory:
+                aggregated_values[formula.id] = self._aggregate_in_memory(formula, rows, columns=columns)
             
-            for row in rows:
-                value = self.compute_row_metric(row, formula)
-                
-                if value is not None:
-                    # Check if computed metric already exists
-                    existing = self.db.query(ComputedMetric).filter(
-                        ComputedMetric.raw_data_id == row.id,
-                        ComputedMetric.formula_id == formula_id,
-                        ComputedMetric.metric_name == formula.name
-                    ).first()
-                    
-                    if existing:
-                        existing.metric_value = value
-                        existing.computed_at = func.now()
-                    else:
-                        computed = ComputedMetric(
-                            raw_data_id=row.id,
-                            formula_id=formula_id,
-                            metric_name=formula.name,
-                            metric_value=value
-                        )
-                        self.db.add(computed)
-                    
-                    results["computed_metrics"] += 1
+            for formula in aggregated:
+                for channel, time_unit, fetch_date, value in aggregated_values[formula.id]:
+                    if value is not None:
+                        aggregated_rows.append({
+                            'channel': channel, 'time_unit': time_unit, 'fetch_date': fetch_date,
+                            'metric_name': formula.name, 'formula_id': formula.id,
+                            'metric_value': value, 'computed_at': computed_at,
+                        })
+                        results[formula.id]["aggregated_metrics"] += 1
+        count(self.timings, "formula_rows", len(rows))
+        count(self.timings, "computed_metrics", len(computed_rows))
+        count(self.timings, "aggregated_metrics", len(aggregated_rows))
+        
+        with timed(self.timings, "formulas_write"):
+            self._write_metrics(row_level, aggregated, computed_rows, aggregated_rows, dates)
+        return [results[formula.id] for formula in formulas]
+    
+    def _write_metrics(self, row_level: List[Formula], aggregated: List[Formula],
+                       computed_rows: List[Dict], aggregated_rows: List[Dict], dates: tuple):
+        """Bulk upsert computed / aggregated metrics and commit"""
+        from crawler.storage import bulk_upsert
+        if computed_rows:
+            bulk_upsert(
+                self.db, ComputedMetric.__table__, computed_rows,
+                key_columns=COMPUTED_KEY_COLUMNS,
+                update_columns=('metric_value', 'computed_at'),
+                existing_keys=self._existing_computed_keys([f.id for f in row_level], *dates)
+            )
+        if aggregated_rows:
+            bulk_upsert(
+                self.db, AggregatedMetric.__table__, aggregated_rows,
+                key_columns=AGGREGATED_KEY_COLUMNS,
+                update_columns=('metric_value', 'computed_at'),
+                existing_keys=self._existing_aggregated_keys([f.id for f in aggregated], *dates)
+            )
         
         self.db.commit()
-        return results
     
-    def compute_all_formulas(self, compute_for_date: Optional[Any] = None):
-        """Compute all active formulas"""
-        formulas = self.db.query(Formula).filter(Formula.is_active == True).all()
-        results = []
+    def compute_formula(self, formula_id: int, 
+                       compute_for_date: Optional[Any] = None,
+                       from_date: Optional[Any] = None,
+                       to_date: Optional[Any] = None) -> Dict[str, Any]:
+        """Compute formula for all relevant data (one date, a date range, or everything)"""
+        formula = self.db.query(Formula).filter(Formula.id == formula_id).first()
+        if not formula:
+            return {"error": "Formula not found"}
         
-        for formula in formulas:
-            result = self.compute_formula(formula.id, compute_for_date)
-            results.append(result)
+        if not formula.is_active:
+            return {"error": "Formula is not active"}
         
-        return results
+        return self.compute_formulas([formula], compute_for_date, from_date, to_date)[0]
+    
+    def compute_all_formulas(self, compute_for_date: Optional[Any] = None,
+                             from_date: Optional[Any] = None,
+                             to_date: Optional[Any] = None):
+        """Compute all active formulas for one date or an inclusive date range, in a single pass"""
+        formulas = self.db.query(Formula).filter(Formula.is_active == True).all()
+        return self.compute_formulas(formulas, compute_for_date, from_date, to_date)
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""
+Microbenchmark đánh giá công thức row-level của FormulaEngine: cách cũ
+(str.replace tên field + eval chuỗi mỗi dòng) so với biểu thức đã compile sẵn
+và đường columnar NumPy (nạp cột một lần cho mọi công thức).
+
+Dữ liệu là các dòng raw_revenue_data giả lập (cột DECIMAL, None cho "-" như khi scrape).
+
+    python benchmarks/bench_formulas.py
+    python benchmarks/bench_formulas.py --rows 50000 --repeat 5
+"""
+
+import argparse
+import math
+import random
+import sys
+import time
+from decimal import Decimal
+from pathlib import Path
+from types import SimpleNamespace
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from backend.formula_engine import FormulaEngine, ColumnarRows, ROW_FIELDS, np
+
+FORMULAS = [
+    "(net_revenue_usd / total_player_impr) * 1000",
+    "gross_revenue_usd - net_revenue_usd",
+    "net_revenue_usd / gross_revenue_usd * 100",
+    "total_ad_impr / total_player_impr",
+    "round(rpm * net_revenue_usd / 1000, 4)",
+]
+
+
+def legacy_evaluate(expression: str, context: dict):
+    """Bản sao cách đánh giá cũ: thay tên field bằng giá trị rồi eval chuỗi"""
+    try:
+        for key, value in context.items():
+            if value is not None:
+                expression = expression.replace(key, str(value))
+            elif key in expression:
+                return None
+        allowed_names = {
+            "abs": abs, "round": round, "min": min, "max": max,
+            "sum": sum, "math": math, "Decimal": Decimal
+        }
+        result = eval(expression, {"__builtins__": {}}, allowed_names)
+        if isinstance(result, (int, float)):
+            return Decimal(str(result))
+        return result
+    except Exception:
+        return None
+
+
+def make_rows(count: int) -> list:
+    rnd = random.Random(42)
+    rows = []
+    for _ in range(count):
+        gross = rnd.uniform(0, 500)
+        player = rnd.randint(0, 200000)
+        rows.append(SimpleNamespace(
+            total_player_impr=Decimal(player),
+            total_ad_impr=Decimal(rnd.randint(0, player)) if rnd.random() > 0.05 else None,
+            rpm=Decimal(f"{rnd.uniform(0, 20):.2f}"),
+            gross_revenue_usd=Decimal(f"{gross:.2f}"),
+            net_revenue_usd=Decimal(f"{gross * 0.7:.2f}"),
+        ))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark row-level formula evaluation")
+    parser.add_argument("--rows", type=int, default=20000, help="Number of synthetic rows")
+    parser.add_argument("--repeat", type=int, default=3, help="Number of passes over all rows")
+    args = parser.parse_args()
+
+    engine = FormulaEngine(None)
+    rows = make_rows(args.rows)
+    formulas = [
+        SimpleNamespace(id=i, name=f"bench_{i}", updated_at=None, formula_expression=expr)
+        for i, expr in enumerate(FORMULAS)
+    ]
+    # Context một lần cho cả hai cách, để chỉ đo phần đánh giá biểu thức
+    contexts = [{field: engine._get_field_value(row, field) for field in ROW_FIELDS} for row in rows]
+
+    def run_legacy():
+        return [legacy_evaluate(f.formula_expression, ctx) for ctx in contexts for f in formulas]
+
+    def run_compiled():
+        return [engine.compute_row_metric(row, f) for row in rows for f in formulas]
+
+    def run_compiled_eval_only():
+        from backend.formula_engine import compile_formula
+        compiled = [compile_formula(f) for f in formulas]
+        return [c.evaluate(ctx) for ctx in contexts for c in compiled]
+
+    def run_vectorized():
+        columns = ColumnarRows(rows)
+        return [engine.compute_row_metrics(rows, f, columns=columns) for f in formulas]
+
+    runs = [("legacy", run_legacy), ("compiled", run_compiled), ("compiled (eval only)", run_compiled_eval_only)]
+    if np is not None:
+        runs.append(("vectorized", run_vectorized))
+    else:
+        print("numpy is not installed, skipping the vectorized path")
+
+    evaluations = args.rows * len(formulas)
+    print(f"{args.rows} rows x {len(formulas)} formulas, {args.repeat} passes")
+    results = {}
+    for name, fn in runs:
+        started = time.perf_counter()
+        for _ in range(args.repeat):
+            fn()
+        elapsed = time.perf_counter() - started
+        results[name] = evaluations * args.repeat / elapsed if elapsed else 0.0
+
+    baseline = results["legacy"]
+    print(f"\n{'evaluator':<22} {'evals/s':>12} {'speedup':>8}")
+    for name, rate in results.items():
+        print(f"{name:<22} {rate:>12,.0f} {rate / baseline if baseline else 0.0:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
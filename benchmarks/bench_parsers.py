@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+"""
+Microbenchmark các backend parse bảng của RevenueShareScraper (lxml | selector | bs4).
+
+Chạy trên các file HTML đã lưu trong benchmarks/fixtures/*.html (trang changelist
+revenueshare). Có thể thêm trang thật: mở trang trên trình duyệt, "Save Page As"
+(HTML only) vào thư mục fixtures.
+
+    python benchmarks/bench_parsers.py
+    python benchmarks/bench_parsers.py --repeat 50 --fixtures /path/to/pages
+"""
+
+import argparse
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from scraper import TABLE_PARSERS, get_table_parser
+
+
+def bench_backend(name: str, pages: list, repeat: int) -> dict:
+    parser = get_table_parser(name)
+    rows = 0
+    started = time.perf_counter()
+    for _ in range(repeat):
+        for html in pages:
+            rows += len(parser.parse(html).rows)
+    elapsed = time.perf_counter() - started
+    return {"rows": rows, "seconds": elapsed, "rows_per_second": rows / elapsed if elapsed else 0.0}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark scraper table parsers")
+    parser.add_argument("--fixtures", type=str, default=str(Path(__file__).parent / "fixtures"),
+                        help="Directory with saved revenueshare HTML pages")
+    parser.add_argument("--repeat", type=int, default=20, help="Number of passes over all fixtures")
+    args = parser.parse_args()
+
+    files = sorted(Path(args.fixtures).glob("*.html"))
+    if not files:
+        print(f"No HTML fixtures found in {args.fixtures}")
+        sys.exit(1)
+    pages = [f.read_text(encoding="utf-8") for f in files]
+    print(f"{len(files)} fixture(s), {sum(len(p) for p in pages) / 1024:.0f} KB, {args.repeat} passes")
+
+    # Các backend phải cho ra cùng kết quả với parser gốc (bs4)
+    reference = [get_table_parser("bs4").parse(html) for html in pages]
+    for name in TABLE_PARSERS:
+        parsed = [get_table_parser(name).parse(html) for html in pages]
+        if parsed != reference:
+            print(f"⚠️  {name}: output differs from bs4 backend")
+
+    results = {name: bench_backend(name, pages, args.repeat) for name in TABLE_PARSERS}
+    baseline = results["bs4"]["rows_per_second"]
+    print(f"\n{'backend':<10} {'rows':>8} {'seconds':>9} {'rows/s':>12} {'speedup':>8}")
+    for name, r in sorted(results.items(), key=lambda kv: -kv[1]["rows_per_second"]):
+        speedup = r["rows_per_second"] / baseline if baseline else 0.0
+        print(f"{name:<10} {r['rows']:>8} {r['seconds']:>9.3f} {r['rows_per_second']:>12,.0f} {speedup:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
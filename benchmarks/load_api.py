@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""
+Load test cho API đang chạy: nhiều client poll GET /api/data trong khi các client
+khác đăng nhập liên tục (bcrypt). Báo cáo p50/p95/p99 latency của /api/data —
+nếu handler chặn event loop, p99 tăng vọt theo số login đồng thời.
+
+Chỉ dùng thư viện chuẩn (http.client + threads).
+
+    python benchmarks/load_api.py --api-key <KEY> --username admin --password secret
+    python benchmarks/load_api.py --base-url http://localhost:8000 --api-key <KEY> \\
+        --username admin --password secret --data-clients 20 --login-clients 10 --duration 30
+"""
+
+import argparse
+import http.client
+import threading
+import time
+from urllib.parse import urlencode, urlsplit
+
+
+def percentile(values, pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100.0 * len(ordered))) - 1))
+    return ordered[index]
+
+
+def _connection(base_url: str):
+    parts = urlsplit(base_url)
+    cls = http.client.HTTPSConnection if parts.scheme == "https" else http.client.HTTPConnection
+    return cls(parts.hostname, parts.port, timeout=60)
+
+
+def data_client(base_url: str, path: str, api_key: str, stop: threading.Event, latencies: list, errors: list):
+    conn = _connection(base_url)
+    while not stop.is_set():
+        started = time.perf_counter()
+        try:
+            conn.request("GET", path, headers={"X-API-Key": api_key})
+            response = conn.getresponse()
+            response.read()
+            if response.status != 200:
+                errors.append(response.status)
+                continue
+        except (OSError, http.client.HTTPException) as e:
+            errors.append(str(e))
+            conn.close()
+            conn = _connection(base_url)
+            continue
+        latencies.append(time.perf_counter() - started)
+    conn.close()
+
+
+def login_client(base_url: str, username: str, password: str, stop: threading.Event, latencies: list, errors: list):
+    conn = _connection(base_url)
+    body = urlencode({"username": username, "password": password})
+    headers = {"Content-Type": "application/x-www-form-urlencoded"}
+    while not stop.is_set():
+        started = time.perf_counter()
+        try:
+            conn.request("POST", "/login", body=body, headers=headers)
+            response = conn.getresponse()
+            response.read()
+            # 303 → /data khi đúng mật khẩu; 200 = trang login báo lỗi
+            if response.status not in (200, 303):
+                errors.append(response.status)
+                continue
+        except (OSError, http.client.HTTPException) as e:
+            errors.append(str(e))
+            conn.close()
+            conn = _connection(base_url)
+            continue
+        latencies.append(time.perf_counter() - started)
+    conn.close()
+
+
+def report(name: str, latencies: list, errors: list, duration: float):
+    ms = [x * 1000 for x in latencies]
+    print(f"{name:<10} {len(ms):>7} {len(ms) / duration:>8.1f} "
+          f"{percentile(ms, 50):>8.1f} {percentile(ms, 95):>8.1f} {percentile(ms, 99):>8.1f} "
+          f"{max(ms) if ms else 0.0:>8.1f} {len(errors):>6}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test /api/data under concurrent logins")
+    parser.add_argument("--base-url", default="http://localhost:8000")
+    parser.add_argument("--api-key", required=True, help="X-API-Key used by the /api/data clients")
+    parser.add_argument("--path", default="/api/data?limit=100", help="Data request path (with query)")
+    parser.add_argument("--username", help="Login user (omit to run without login load)")
+    parser.add_argument("--password", default="")
+    parser.add_argument("--data-clients", type=int, default=10)
+    parser.add_argument("--login-clients", type=int, default=5)
+    parser.add_argument("--duration", type=float, default=20.0, help="Seconds to run")
+    args = parser.parse_args()
+
+    stop = threading.Event()
+    data_latencies, data_errors = [], []
+    login_latencies, login_errors = [], []
+    threads = [
+        threading.Thread(target=data_client, args=(args.base_url, args.path, args.api_key, stop,
+                                                   data_latencies, data_errors), daemon=True)
+        for _ in range(args.data_clients)
+    ]
+    if args.username:
+        threads += [
+            threading.Thread(target=login_client, args=(args.base_url, args.username, args.password, stop,
+                                                        login_latencies, login_errors), daemon=True)
+            for _ in range(args.login_clients)
+        ]
+
+    login_clients = args.login_clients if args.username else 0
+    print(f"{args.data_clients} data clients, {login_clients} login clients, {args.duration:.0f}s against {args.base_url}")
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    time.sleep(args.duration)
+    stop.set()
+    for thread in threads:
+        thread.join(timeout=60)
+    elapsed = time.perf_counter() - started
+
+    print(f"\n{'endpoint':<10} {'requests':>7} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'max ms':>8} {'errors':>6}")
+    report("/api/data", data_latencies, data_errors, elapsed)
+    if args.username:
+        report("/login", login_latencies, login_errors, elapsed)
+
+
+if __name__ == "__main__":
+    main()
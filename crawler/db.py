@@ -3,6 +3,10 @@ Database connection and models for crawler
 """
 
 import os
+import threading
+import time
+from bisect import bisect_right
+from decimal import Decimal
 from sqlalchemy import create_engine, Column, Integer, String, Numeric, Boolean, DateTime, Date, Text, ForeignKey, UniqueConstraint
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, Session, relationship
@@ -12,6 +16,8 @@ from datetime import datetime
 from urllib.parse import quote_plus
 from dotenv import load_dotenv
 
+from crawler.querystats import SQL_INSTRUMENTATION, instrument_engine
+
 load_dotenv()
 
 # Database Configuration
@@ -36,6 +42,8 @@ engine = create_engine(
     pool_recycle=3600,
     echo=False
 )
+if SQL_INSTRUMENTATION:
+    instrument_engine(engine)
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
@@ -49,17 +57,27 @@ class RawRevenueData(Base):
     channel = Column(String(255), nullable=False)
     slot = Column(String(255), nullable=False)
     time_unit = Column(String(50), nullable=False)
-    total_player_impr = Column(String(50))
-    total_ad_impr = Column(String(50))
-    rpm = Column(String(50))
-    gross_revenue_usd = Column(String(50))
-    net_revenue_usd = Column(String(50))
+    # Giá trị đã parse một lần lúc ghi (NULL cho "-"); chuỗi gốc giữ ở cột *_raw để đối chiếu
+    total_player_impr = Column(Numeric(20, 2))
+    total_ad_impr = Column(Numeric(20, 2))
+    rpm = Column(Numeric(20, 6))
+    gross_revenue_usd = Column(Numeric(20, 6))
+    net_revenue_usd = Column(Numeric(20, 6))
+    total_player_impr_raw = Column(String(50))
+    total_ad_impr_raw = Column(String(50))
+    rpm_raw = Column(String(50))
+    gross_revenue_usd_raw = Column(String(50))
+    net_revenue_usd_raw = Column(String(50))
     fetched_at = Column(DateTime, default=datetime.utcnow)
     fetch_date = Column(Date, nullable=False)
     created_at = Column(DateTime, default=datetime.utcnow)
     
     computed_metrics = relationship("ComputedMetric", back_populates="raw_data")
 
+    __table_args__ = (
+        UniqueConstraint('channel', 'slot', 'time_unit', 'fetch_date', name='unique_record'),
+    )
+
 
 class Formula(Base):
     __tablename__ = "formulas"
@@ -88,6 +106,10 @@ class ComputedMetric(Base):
     
     raw_data = relationship("RawRevenueData", back_populates="computed_metrics")
     formula = relationship("Formula")
+    
+    __table_args__ = (
+        UniqueConstraint('raw_data_id', 'formula_id', 'metric_name', name='unique_computed'),
+    )
 
 
 class AggregatedMetric(Base):
@@ -101,6 +123,10 @@ class AggregatedMetric(Base):
     metric_value = Column(Numeric(20, 6))
     formula_id = Column(Integer, ForeignKey("formulas.id"))
     computed_at = Column(DateTime, default=datetime.utcnow)
+    
+    __table_args__ = (
+        UniqueConstraint('channel', 'time_unit', 'fetch_date', 'metric_name', 'formula_id', name='unique_aggregated'),
+    )
 
 
 class ProcessedRevenueData(Base):
@@ -134,6 +160,7 @@ class FetchLog(Base):
     started_at = Column(DateTime, default=datetime.utcnow)
     completed_at = Column(DateTime)
     duration_seconds = Column(Integer)
+    metrics = Column(Text)  # JSON: {"wall_ms": ..., "stages": {stage: {busy_ms, idle_ms, blocked_ms, items}}}
 
 
 class CrawlRun(Base):
@@ -146,6 +173,8 @@ class CrawlRun(Base):
     started_at = Column(DateTime, default=datetime.utcnow)
     completed_at = Column(DateTime)
     pid = Column(Integer)  # Process ID
+    owner = Column(String(255))  # process giữ lock (host:pid)
+    heartbeat_at = Column(DateTime)  # quá CRAWL_LOCK_STALE_SECONDS thì lock bị lấy lại
 
 
 class User(Base):
@@ -181,6 +210,59 @@ class SlotShareConfig(Base):
     )
 
 
+class ShareRecalcJob(Base):
+    """Queued recalculation of processed_revenue_data after a slot_share_config change (run by crawler/worker.py)."""
+    __tablename__ = "share_recalc_jobs"
+
+    id = Column(Integer, primary_key=True, index=True)
+    slot = Column(String(255), nullable=False)  # "*" = all slots
+    from_date = Column(Date)  # NULL = all dates
+    status = Column(String(50), nullable=False, default="pending")  # pending | running | completed | failed
+    chunks_done = Column(Integer, default=0)
+    chunks_total = Column(Integer, default=0)
+    records_updated = Column(Integer, default=0)
+    error_message = Column(Text)
+    created_by = Column(String(255))
+    claimed_by = Column(String(255))  # worker đang chạy job (host:pid)
+    heartbeat_at = Column(DateTime)  # worker còn sống; quá WORKER_STALE_SECONDS thì job bị lấy lại
+    created_at = Column(DateTime, default=datetime.utcnow)
+    started_at = Column(DateTime)
+    completed_at = Column(DateTime)
+
+
+# Các bước của một lần crawl, theo thứ tự (crawl_jobs.progress lưu trạng thái từng bước)
+CRAWL_STAGES = ("login", "pages", "store", "formulas", "process")
+
+
+class CrawlJob(Base):
+    """Crawl requested from the API (/api/trigger-crawl), run by crawler/worker.py under the crawl_runs lock."""
+    __tablename__ = "crawl_jobs"
+
+    id = Column(Integer, primary_key=True, index=True)
+    fetch_date = Column(Date, nullable=False)
+    first_page_only = Column(Boolean, default=False)
+    status = Column(String(50), nullable=False, default="pending")  # pending | running | completed | failed | skipped
+    stage = Column(String(50))  # bước đang chạy (CRAWL_STAGES)
+    progress = Column(Text)  # JSON: {stage: {"status": ..., "count": ...}}
+    result = Column(Text)  # JSON kết quả fetch_and_store
+    error_message = Column(Text)
+    created_by = Column(String(255))
+    claimed_by = Column(String(255))  # worker đang chạy job (host:pid)
+    heartbeat_at = Column(DateTime)  # worker còn sống; quá WORKER_STALE_SECONDS thì job bị lấy lại
+    created_at = Column(DateTime, default=datetime.utcnow)
+    started_at = Column(DateTime)
+    completed_at = Column(DateTime)
+
+
+class DataVersion(Base):
+    """Single-row counter bumped after every write that changes served data (API response cache key)."""
+    __tablename__ = "data_version"
+
+    id = Column(Integer, primary_key=True)
+    version = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+
 class UserSlot(Base):
     """Assign processed slots to users. 1 slot = 1 user only."""
     __tablename__ = "user_slots"
@@ -202,6 +284,113 @@ def get_db_session():
         db.close()
 
 
+def bump_data_version(db: Session) -> None:
+    """
+    Mark raw/processed/metric data as changed (invalidates cached API responses). Commits.
+    One atomic upsert of row id=1 (version + 1), so concurrent writers (API, worker, crawler)
+    never race on creating the row when migrations_add_data_version.sql has not seeded it.
+    """
+    table = DataVersion.__table__
+    now = datetime.utcnow()
+    dialect = db.get_bind().dialect.name
+    if dialect == 'mysql':
+        from sqlalchemy.dialects.mysql import insert
+        stmt = insert(table).values(id=1, version=1, updated_at=now).on_duplicate_key_update(
+            version=table.c.version + 1, updated_at=now
+        )
+    else:
+        if dialect == 'postgresql':
+            from sqlalchemy.dialects.postgresql import insert
+        else:
+            from sqlalchemy.dialects.sqlite import insert
+        stmt = insert(table).values(id=1, version=1, updated_at=now).on_conflict_do_update(
+            index_elements=[table.c.id], set_={'version': table.c.version + 1, 'updated_at': now}
+        )
+    db.execute(stmt)
+    db.commit()
+
+
+def get_data_version(db: Session) -> int:
+    row = db.query(DataVersion.version).filter(DataVersion.id == 1).first()
+    return row[0] if row else 0
+
+
+DEFAULT_SHARE_PERCENT = Decimal('50.00')
+GLOBAL_SHARE_SLOT = "*"
+
+# Safety net for processes that don't see /shares writes (crawler, backend); the API invalidates explicitly
+SHARE_RESOLVER_TTL = float(os.getenv("SHARE_RESOLVER_TTL", "300"))
+
+
+class ShareResolver:
+    """
+    slot_share_config loaded once into per-slot effective-date arrays (sorted ascending),
+    plus the global "*" chain. Lookups are a binary search in memory.
+    """
+
+    def __init__(self, configs):
+        timelines = {}
+        for slot, effective_date, share_percent in configs:
+            timelines.setdefault(slot, []).append((effective_date, Decimal(share_percent)))
+        self._dates = {}
+        self._shares = {}
+        for slot, entries in timelines.items():
+            entries.sort(key=lambda e: e[0])
+            self._dates[slot] = [e[0] for e in entries]
+            self._shares[slot] = [e[1] for e in entries]
+        self.loaded_at = time.monotonic()
+
+    @classmethod
+    def load(cls, db: Session) -> 'ShareResolver':
+        """Read the whole slot_share_config table with one query."""
+        return cls(db.query(
+            SlotShareConfig.slot, SlotShareConfig.effective_date, SlotShareConfig.share_percent
+        ).all())
+
+    def _lookup(self, slot: str, target_date):
+        dates = self._dates.get(slot)
+        if not dates:
+            return None
+        i = bisect_right(dates, target_date)
+        return self._shares[slot][i - 1] if i else None
+
+    def share_for(self, slot: str, target_date) -> Decimal:
+        """Same priority as get_share_for_slot: slot config, then global "*", then 50%."""
+        share = self._lookup(slot, target_date)
+        if share is None:
+            share = self._lookup(GLOBAL_SHARE_SLOT, target_date)
+        return share if share is not None else DEFAULT_SHARE_PERCENT
+
+    def slots(self):
+        """Slots that have their own config (excluding "*")."""
+        return [slot for slot in self._dates if slot != GLOBAL_SHARE_SLOT]
+
+    def timeline(self, slot: str):
+        """[(effective_date, share_percent)] for a slot's own configs, oldest first."""
+        return list(zip(self._dates.get(slot, []), self._shares.get(slot, [])))
+
+
+_share_resolver = None
+_share_resolver_lock = threading.Lock()
+
+
+def get_share_resolver(db: Session) -> ShareResolver:
+    """Process-wide ShareResolver, reloaded after invalidate_share_resolver() or SHARE_RESOLVER_TTL seconds."""
+    global _share_resolver
+    with _share_resolver_lock:
+        resolver = _share_resolver
+        if resolver is None or time.monotonic() - resolver.loaded_at > SHARE_RESOLVER_TTL:
+            resolver = _share_resolver = ShareResolver.load(db)
+        return resolver
+
+
+def invalidate_share_resolver():
+    """Drop the cached ShareResolver; call after any slot_share_config write."""
+    global _share_resolver
+    with _share_resolver_lock:
+        _share_resolver = None
+
+
 def get_share_for_slot(db: Session, slot: str, target_date) -> 'Decimal':
     """
     Lookup share % for a slot on a given date.
@@ -211,29 +400,10 @@ def get_share_for_slot(db: Session, slot: str, target_date) -> 'Decimal':
     1. Specific slot config (if exists)
     2. Global config (slot = "*") - applies to ALL sites
     3. Fallback to 50% if no config found
-    """
-    from decimal import Decimal
 
-    # 1. Try to find config for specific slot
-    config = db.query(SlotShareConfig).filter(
-        SlotShareConfig.slot == slot,
-        SlotShareConfig.effective_date <= target_date
-    ).order_by(SlotShareConfig.effective_date.desc()).first()
-
-    if config:
-        return config.share_percent
-
-    # 2. Try to find global config (slot = "*")
-    global_config = db.query(SlotShareConfig).filter(
-        SlotShareConfig.slot == "*",
-        SlotShareConfig.effective_date <= target_date
-    ).order_by(SlotShareConfig.effective_date.desc()).first()
-
-    if global_config:
-        return global_config.share_percent
-
-    # 3. Fallback to default 50%
-    return Decimal('50.00')
+    Answered from the cached ShareResolver (no query per lookup).
+    """
+    return get_share_resolver(db).share_for(slot, target_date)
 
 
 # FormulaEngine sẽ được import trong main.py
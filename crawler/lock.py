@@ -1,47 +1,111 @@
 """
 Lock mechanism để tránh chạy trùng crawler
+
+Cron crawler (container crawler) và crawl job (container worker) dùng chung bảng crawl_runs,
+nên pid không nói được lock còn sống hay không. Process giữ lock ghi owner (host:pid) và một
+thread nền làm mới heartbeat_at mỗi CRAWL_LOCK_HEARTBEAT_SECONDS; lock 'running' có heartbeat
+cũ hơn CRAWL_LOCK_STALE_SECONDS (process chết) mới được process khác lấy lại.
 """
 
-from datetime import datetime
-from crawler.db import CrawlRun, get_db_session
+from datetime import datetime, timedelta
+from sqlalchemy import func, or_
+from crawler.db import CrawlRun, SessionLocal
 import os
+import socket
+import threading
+import time
 import logging
 
 logger = logging.getLogger(__name__)
 
+CRAWL_LOCK_HEARTBEAT_SECONDS = float(os.getenv("CRAWL_LOCK_HEARTBEAT_SECONDS", "30"))
+# Phải lớn hơn nhiều so với CRAWL_LOCK_HEARTBEAT_SECONDS
+CRAWL_LOCK_STALE_SECONDS = float(os.getenv("CRAWL_LOCK_STALE_SECONDS", "300"))
+
+_heartbeat_guard = threading.Lock()
+_heartbeat_thread = None
+
+
+def lock_owner():
+    """host:pid của process hiện tại (hostname = container)"""
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def _heartbeat_loop():
+    """Làm mới heartbeat_at của mọi lock 'running' process này đang giữ (session riêng)"""
+    while True:
+        time.sleep(CRAWL_LOCK_HEARTBEAT_SECONDS)
+        db = SessionLocal()
+        try:
+            db.query(CrawlRun).filter(
+                CrawlRun.owner == lock_owner(), CrawlRun.status == 'running'
+            ).update({CrawlRun.heartbeat_at: datetime.utcnow()}, synchronize_session=False)
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            logger.warning(f"Crawl lock heartbeat failed: {str(e)}")
+        finally:
+            db.close()
+
+
+def _ensure_heartbeat():
+    global _heartbeat_thread
+    with _heartbeat_guard:
+        if _heartbeat_thread is None or not _heartbeat_thread.is_alive():
+            _heartbeat_thread = threading.Thread(target=_heartbeat_loop, name="crawl-lock-heartbeat", daemon=True)
+            _heartbeat_thread.start()
+
 
 def acquire_lock(db, fetch_date):
-    """Acquire lock for a specific fetch_date. Reuse row if date already exists (completed/failed)."""
+    """Acquire lock for a specific fetch_date. Reuse row if date already exists (completed/failed/stale)."""
     try:
+        now = datetime.utcnow()
+        owner = lock_owner()
         # Bất kỳ bản ghi nào cho fetch_date này (running / completed / failed)
         existing = db.query(CrawlRun).filter(CrawlRun.fetch_date == fetch_date).first()
 
         if existing:
-            if existing.status == 'running':
-                # Kiểm tra process còn sống không
-                try:
-                    os.kill(existing.pid, 0)
-                    logger.warning(f"Lock already held by process {existing.pid}")
-                    return False
-                except (OSError, ProcessLookupError):
-                    pass  # process chết → dưới đây sẽ cập nhật lại
-            # Cập nhật lại thành running (cho phép chạy lại sau khi completed/failed hoặc stale)
-            existing.status = 'running'
-            existing.pid = os.getpid()
-            existing.started_at = datetime.utcnow()
-            existing.completed_at = None
+            holder = existing.owner or existing.pid
+            last_seen = existing.heartbeat_at or existing.started_at
+            was_running = existing.status == 'running'
+            # UPDATE có điều kiện: hai process cùng thấy lock cũ thì chỉ một process lấy được
+            taken = db.query(CrawlRun).filter(
+                CrawlRun.id == existing.id,
+                or_(
+                    CrawlRun.status != 'running',
+                    func.coalesce(CrawlRun.heartbeat_at, CrawlRun.started_at)
+                    < now - timedelta(seconds=CRAWL_LOCK_STALE_SECONDS)
+                )
+            ).update({
+                CrawlRun.status: 'running',
+                CrawlRun.owner: owner,
+                CrawlRun.pid: os.getpid(),
+                CrawlRun.started_at: now,
+                CrawlRun.heartbeat_at: now,
+                CrawlRun.completed_at: None,
+            }, synchronize_session=False)
             db.commit()
+            if not taken:
+                logger.warning(f"Lock already held by {holder} (last heartbeat {last_seen})")
+                return False
+            if was_running:
+                logger.warning(f"Took over stale lock for {fetch_date} from {holder} (last heartbeat {last_seen})")
+            _ensure_heartbeat()
             logger.info(f"Lock acquired for {fetch_date} (reused row)")
             return True
 
-        # Chưa có bản ghi → tạo mới
+        # Chưa có bản ghi → tạo mới (fetch_date UNIQUE: process tạo sau bị lỗi và không lấy được lock)
         lock = CrawlRun(
             fetch_date=fetch_date,
             status='running',
-            pid=os.getpid()
+            pid=os.getpid(),
+            owner=owner,
+            started_at=now,
+            heartbeat_at=now
         )
         db.add(lock)
         db.commit()
+        _ensure_heartbeat()
         logger.info(f"Lock acquired for {fetch_date}")
         return True
 
@@ -52,13 +116,14 @@ def acquire_lock(db, fetch_date):
 
 
 def release_lock(db, fetch_date):
-    """Release lock for a specific fetch_date"""
+    """Release lock for a specific fetch_date (only if this process still holds it)"""
     try:
         lock = db.query(CrawlRun).filter(
             CrawlRun.fetch_date == fetch_date,
-            CrawlRun.status == 'running'
+            CrawlRun.status == 'running',
+            CrawlRun.owner == lock_owner()
         ).first()
-        
+
         if lock:
             lock.status = 'completed'
             lock.completed_at = datetime.utcnow()
@@ -66,7 +131,7 @@ def release_lock(db, fetch_date):
             logger.info(f"Lock released for {fetch_date}")
         else:
             logger.warning(f"No lock found to release for {fetch_date}")
-            
+
     except Exception as e:
         logger.error(f"Error releasing lock: {str(e)}")
         db.rollback()
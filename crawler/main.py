@@ -5,6 +5,10 @@ Crawler Service - Chạy độc lập, crawl data và lưu vào DB
 
 import sys
 import os
+import json
+import queue
+import threading
+import time
 from datetime import datetime, date, timedelta
 from pathlib import Path
 
@@ -12,8 +16,12 @@ from pathlib import Path
 sys.path.insert(0, str(Path(__file__).parent.parent))
 
 from scraper import RevenueShareScraper
-from crawler.db import get_db_session, RawRevenueData, FetchLog
+from crawler.db import get_db_session, FetchLog, bump_data_version
 from crawler.lock import acquire_lock, release_lock
+from crawler.storage import upsert_raw_rows
+from crawler.pipeline import Pipeline
+from crawler.timing import RunTimings
+from crawler.querystats import track_queries, log_repeated
 import logging
 
 # Import FormulaEngine
@@ -36,19 +44,202 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Số trang / số ngày tối đa chờ giữa các stage (backpressure khi stage sau chậm hơn)
+PIPELINE_QUEUE_PAGES = int(os.getenv("CRAWLER_QUEUE_PAGES", "8"))
+PIPELINE_QUEUE_DATES = int(os.getenv("CRAWLER_QUEUE_DATES", "4"))
 
-def parse_numeric_value(value: str) -> str:
-    """Parse numeric value, keeping original format for storage"""
-    if not value or value == '-':
+
+def build_scraper() -> RevenueShareScraper:
+    """Scraper with credentials and session cache from env"""
+    return RevenueShareScraper(
+        username=os.getenv("SCRAPER_USERNAME", "maxvaluemedia"),
+        password=os.getenv("SCRAPER_PASSWORD", "gliacloud"),
+        session_file=os.getenv("SCRAPER_SESSION_FILE", "/app/logs/scraper_session.json")
+    )
+
+
+def build_url(target_date: date) -> str:
+    date_str = target_date.strftime("%Y-%m-%d")
+    return f"https://gstudio.gliacloud.com/ad-sharing/publisher/revenueshare/?channel=No+Filter&time_unit_date__range__gte={date_str}&time_unit_date__range__lte={date_str}"
+
+
+def _report(progress, stage: str, status: str, count: int = None):
+    """Báo tiến độ từng bước (CRAWL_STAGES) cho người gọi, vd. crawl job của worker"""
+    if progress:
+        progress(stage, status, count)
+
+
+def _serialized(progress):
+    """Các stage của pipeline báo tiến độ từ nhiều thread → gọi progress lần lượt"""
+    if progress is None:
         return None
-    return value.replace(',', '') if ',' in value else value
+    lock = threading.Lock()
+
+    def report(stage, status, count=None):
+        with lock:
+            progress(stage, status, count)
+    return report
 
 
-def fetch_and_store(target_date: date = None, first_page_only: bool = False):
-    """Fetch data and store in database"""
+def _derive_stage(clock, stage: str, dates_queue: queue.Queue, work, timings, progress, failed: set):
+    """
+    Stage formulas / process: xử lý từng ngày ngay khi raw của ngày đó đã commit (session DB riêng).
+    work(db, d, timings[d]) trả False = lỗi đã được xử lý, không dừng pipeline (stage được đánh dấu failed).
+    """
+    db = next(get_db_session())
+    try:
+        while True:
+            d = clock.get(dates_queue)
+            if d is None:
+                return
+            _report(progress, stage, "running", clock.items)
+            with clock.busy():
+                ok = work(db, d, timings[d])
+            clock.items += 1
+            if ok is False:
+                failed.add(stage)
+            _report(progress, stage, "failed" if stage in failed else "running", clock.items)
+    finally:
+        db.close()
+
+
+def _compute_formulas(db, d: date, timings: RunTimings):
+    FormulaEngine(db, timings=timings).compute_all_formulas(compute_for_date=d)
+    logger.info(f"Formulas computed for {d}")
+
+
+def _process_revenue(db, d: date, timings: RunTimings) -> bool:
+    # Tổng hợp desktop + mobile → processed_revenue_data for dashboard; lỗi không làm hỏng lần crawl
+    try:
+        from crawler.process_revenue import process_revenue_data
+        process_revenue_data(db, d, timings=timings)
+        db.commit()
+        logger.info(f"Processed revenue data updated for {d}.")
+        return True
+    except Exception as e:
+        db.rollback()
+        logger.warning("process_revenue_data failed for %s (dashboard may not update): %s", d, e)
+        return False
+
+
+def run_pipeline(db, scraper, dates, first_page_only: bool, workers: int, pipeline: Pipeline,
+                 timings: dict, progress=None):
+    """
+    Crawl dates (đã login, đã giữ lock) theo pipeline:
+        pages (thread) → store (thread gọi, session db) → formulas + process (mỗi stage một thread)
+    Trang N+1 được tải trong lúc trang N đang ghi DB; formulas / process của một ngày chạy
+    ngay khi mọi trang của ngày đó đã commit, song song với việc tải ngày tiếp theo.
+    timings[d] (RunTimings) nhận thời gian fetch / parse / store / formulas / process của ngày d.
+    Trả về thống kê theo ngày {date: {records_created, records_updated, pages_fetched}}.
+    """
+    stats = {d: {"records_created": 0, "records_updated": 0, "pages_fetched": 0} for d in dates}
+    pages_queue = queue.Queue(maxsize=PIPELINE_QUEUE_PAGES)
+    formulas_queue = queue.Queue(maxsize=PIPELINE_QUEUE_DATES)
+    process_queue = queue.Queue(maxsize=PIPELINE_QUEUE_DATES)
+    end_of_date = object()
+    failed = set()
+
+    def fetch_pages(clock):
+        for d in dates:
+            logger.info(f"Fetching {d}")
+            scraper.timings = timings[d]
+            pages = scraper.iter_pages(
+                build_url(d),
+                first_page_only=first_page_only,
+                max_workers=workers,
+                max_requests_per_second=float(os.getenv("SCRAPER_MAX_RPS", "2"))
+            )
+            while True:
+                with clock.busy():
+                    item = next(pages, None)
+                if item is None:
+                    break
+                clock.items += 1
+                _report(progress, "pages", "running", clock.items)
+                clock.put(pages_queue, (d, item[1]))
+            clock.put(pages_queue, (d, end_of_date))
+        clock.put(pages_queue, None)
+
+    _report(progress, "pages", "running", 0)
+    pipeline.start("pages", fetch_pages)
+    pipeline.start("formulas", _derive_stage, "formulas", formulas_queue, _compute_formulas, timings, progress, failed)
+    pipeline.start("process", _derive_stage, "process", process_queue, _process_revenue, timings, progress, failed)
+
+    store = pipeline.clock("store")
+    try:
+        while True:
+            item = store.get(pages_queue)
+            if item is None:
+                break
+            d, rows = item
+            if rows is end_of_date:
+                if stats[d]["records_created"] + stats[d]["records_updated"]:
+                    store.put(formulas_queue, d)
+                    store.put(process_queue, d)
+                continue
+            with store.busy(), timings[d].stage("store"):
+                created, updated = upsert_raw_rows(db, rows, d)
+                db.commit()
+            store.items += 1
+            timings[d].count("rows_stored", created + updated)
+            stats[d]["records_created"] += created
+            stats[d]["records_updated"] += updated
+            stats[d]["pages_fetched"] += 1
+            _report(progress, "store", "running",
+                    sum(s["records_created"] + s["records_updated"] for s in stats.values()))
+        store.put(formulas_queue, None)
+        store.put(process_queue, None)
+    except BaseException as e:
+        db.rollback()
+        pipeline.fail(e)
+    pipeline.join()
+
+    total_rows = sum(s["records_created"] + s["records_updated"] for s in stats.values())
+    _report(progress, "pages", "done", pipeline.clocks["pages"].items)
+    _report(progress, "store", "done", total_rows)
+    for stage in ("formulas", "process"):
+        _report(progress, stage, "failed" if stage in failed else "done", pipeline.clocks[stage].items)
+    return stats
+
+
+def _run_metrics(pipeline: Pipeline, started: float, timings: RunTimings) -> str:
+    """
+    JSON cho fetch_logs.metrics: thời gian tổng, busy/idle/blocked của từng stage pipeline (cả lần chạy),
+    ms theo bước chi tiết (stages_ms) và bộ đếm pages / bytes / rows (counters) của ngày này.
+    """
+    return json.dumps({
+        "wall_ms": round((time.perf_counter() - started) * 1000),
+        "stages": pipeline.metrics(),
+        **timings.as_dict(),
+    })
+
+
+def _log_queries(queries, run: str, result: dict):
+    """Dòng log cuối lần chạy: số query / thời gian DB (SQL_INSTRUMENTATION=1) + cảnh báo N+1"""
+    if queries is None:
+        return
+    logger.info(f"{run} finished ({result.get('status')}): {queries.summary()}")
+    log_repeated(queries, run)
+
+
+def fetch_and_store(target_date: date = None, first_page_only: bool = False, workers: int = 1, progress=None):
+    """
+    Fetch data and store in database. workers > 1 fetches pages 2..N concurrently.
+    progress(stage, status, count) is called as each stage (login, pages, store, formulas, process) advances.
+    """
     if target_date is None:
         target_date = date.today() - timedelta(days=1)  # Yesterday by default
-    
+    with track_queries() as queries:
+        result = _fetch_and_store(target_date, first_page_only, workers, progress)
+    _log_queries(queries, f"Crawl {target_date}", result)
+    return result
+
+
+def _fetch_and_store(target_date: date, first_page_only: bool, workers: int, progress):
+    started = time.perf_counter()
+    progress = _serialized(progress)
+    pipeline = Pipeline()
+    timings = RunTimings()
     db = next(get_db_session())
     
     # Acquire lock to prevent concurrent runs
@@ -70,96 +261,40 @@ def fetch_and_store(target_date: date = None, first_page_only: bool = False):
         logger.info(f"Starting fetch for date: {target_date}")
         
         # Initialize scraper
-        scraper = RevenueShareScraper(
-            username=os.getenv("SCRAPER_USERNAME", "maxvaluemedia"),
-            password=os.getenv("SCRAPER_PASSWORD", "gliacloud")
-        )
+        scraper = build_scraper()
         
-        # Login
-        if not scraper.login():
+        # Login (dùng lại cookie đã lưu nếu có, chỉ login lại khi bị redirect về trang login)
+        _report(progress, "login", "running")
+        with pipeline.clock("login").busy(), timings.stage("login"):
+            logged_in = scraper.ensure_logged_in()
+        if not logged_in:
             fetch_log.status = 'failed'
             fetch_log.error_message = "Login failed"
             fetch_log.completed_at = datetime.utcnow()
+            fetch_log.metrics = _run_metrics(pipeline, started, timings)
             db.commit()
             logger.error("Login failed")
             return {"status": "failed", "error": "Login failed"}
+        _report(progress, "login", "done")
         
-        # Build URL
-        date_str = target_date.strftime("%Y-%m-%d")
-        url = f"https://gstudio.gliacloud.com/ad-sharing/publisher/revenueshare/?channel=No+Filter&time_unit_date__range__gte={date_str}&time_unit_date__range__lte={date_str}"
-        
-        # Fetch data
-        logger.info(f"Fetching data from: {url}")
-        if first_page_only:
-            data = scraper.scrape_table_first_page_only(url)
-        else:
-            data = scraper.scrape_table(url)
+        # Pipeline: tải trang → ghi DB từng trang → formulas + processed data khi ngày đã ghi xong
+        logger.info(f"Fetching data from: {build_url(target_date)}")
+        stats = run_pipeline(db, scraper, [target_date], first_page_only, workers, pipeline,
+                             {target_date: timings}, progress)[target_date]
+        records_created = stats["records_created"]
+        records_updated = stats["records_updated"]
+        pages_fetched = stats["pages_fetched"]
         
-        if not data:
+        if records_created + records_updated == 0:
             fetch_log.status = 'failed'
             fetch_log.error_message = "No data fetched"
             fetch_log.completed_at = datetime.utcnow()
+            fetch_log.metrics = _run_metrics(pipeline, started, timings)
             db.commit()
             logger.error("No data fetched")
             return {"status": "failed", "error": "No data fetched"}
         
-        logger.info(f"Fetched {len(data)} records")
-        
-        # Store data (update existing or create new)
-        records_created = 0
-        records_updated = 0
-        
-        for row_data in data:
-            # Check if record already exists
-            existing = db.query(RawRevenueData).filter(
-                RawRevenueData.channel == row_data.get('channel', ''),
-                RawRevenueData.slot == row_data.get('slot', ''),
-                RawRevenueData.time_unit == row_data.get('time unit', ''),
-                RawRevenueData.fetch_date == target_date
-            ).first()
-            
-            if existing:
-                # Update existing record (ghi đè)
-                existing.total_player_impr = row_data.get('total player impr', '')
-                existing.total_ad_impr = row_data.get('total ad impr', '')
-                existing.rpm = row_data.get('rpm', '')
-                existing.gross_revenue_usd = row_data.get('gross revenue (usd)', '')
-                existing.net_revenue_usd = row_data.get('net revenue (usd)', '')
-                existing.fetched_at = datetime.utcnow()
-                records_updated += 1
-            else:
-                # Create new record
-                db_row = RawRevenueData(
-                    channel=row_data.get('channel', ''),
-                    slot=row_data.get('slot', ''),
-                    time_unit=row_data.get('time unit', ''),
-                    total_player_impr=row_data.get('total player impr', ''),
-                    total_ad_impr=row_data.get('total ad impr', ''),
-                    rpm=row_data.get('rpm', ''),
-                    gross_revenue_usd=row_data.get('gross revenue (usd)', ''),
-                    net_revenue_usd=row_data.get('net revenue (usd)', ''),
-                    fetch_date=target_date
-                )
-                db.add(db_row)
-                records_created += 1
-        
-        db.commit()
-        logger.info(f"Stored: {records_created} created, {records_updated} updated")
-        
-        # Compute formulas
-        logger.info("Computing formulas...")
-        engine = FormulaEngine(db)
-        engine.compute_all_formulas(compute_for_date=target_date)
-        logger.info("Formulas computed successfully")
-        
-        # Process revenue data (tổng hợp desktop + mobile → processed_revenue_data for dashboard)
-        try:
-            from crawler.process_revenue import process_revenue_data
-            process_revenue_data(db, target_date)
-            db.commit()
-            logger.info("Processed revenue data updated for dashboard.")
-        except Exception as e:
-            logger.warning("process_revenue_data failed (dashboard may not update): %s", e)
+        logger.info(f"Stored: {records_created} created, {records_updated} updated ({pages_fetched} pages)")
         
         # Update fetch log
         fetch_log = db.query(FetchLog).filter(FetchLog.id == fetch_log_id).first()
@@ -167,12 +302,14 @@ def fetch_and_store(target_date: date = None, first_page_only: bool = False):
         fetch_log.records_fetched = records_created + records_updated
         fetch_log.records_created = records_created
         fetch_log.records_updated = records_updated
-        fetch_log.pages_fetched = 1 if first_page_only else len(data) // 100
+        fetch_log.pages_fetched = pages_fetched
         fetch_log.completed_at = datetime.utcnow()
         fetch_log.duration_seconds = int((fetch_log.completed_at - fetch_log.started_at).total_seconds())
+        fetch_log.metrics = _run_metrics(pipeline, started, timings)
         db.commit()
+        bump_data_version(db)
         
-        logger.info(f"Fetch completed successfully in {fetch_log.duration_seconds}s")
+        logger.info(f"Fetch completed successfully in {fetch_log.duration_seconds}s ({timings.as_dict()})")
         
         return {
             "status": "success",
@@ -184,11 +321,13 @@ def fetch_and_store(target_date: date = None, first_page_only: bool = False):
         
     except Exception as e:
         logger.error(f"Error during fetch: {str(e)}", exc_info=True)
+        db.rollback()
         fetch_log = db.query(FetchLog).filter(FetchLog.id == fetch_log_id).first()
         if fetch_log:
             fetch_log.status = 'failed'
             fetch_log.error_message = str(e)
             fetch_log.completed_at = datetime.utcnow()
+            fetch_log.metrics = _run_metrics(pipeline, started, timings)
             db.commit()
         return {"status": "failed", "error": str(e)}
     finally:
@@ -197,19 +336,145 @@ def fetch_and_store(target_date: date = None, first_page_only: bool = False):
         db.close()
 
 
+def fetch_and_store_range(from_date: date, to_date: date, first_page_only: bool = False, workers: int = 1):
+    """
+    Backfill every date in [from_date, to_date] in one run: login once, then run the
+    pages → store → formulas/process pipeline over all dates, so formulas and processed
+    data for one date are computed while the next dates are still being scraped.
+    """
+    with track_queries() as queries:
+        result = _fetch_and_store_range(from_date, to_date, first_page_only, workers)
+    _log_queries(queries, f"Backfill {from_date} → {to_date}", result)
+    return result
+
+
+def _fetch_and_store_range(from_date: date, to_date: date, first_page_only: bool, workers: int):
+    started = time.perf_counter()
+    dates = [from_date + timedelta(days=i) for i in range((to_date - from_date).days + 1)]
+    pipeline = Pipeline()
+    # Mỗi ngày một collector; login (một lần cho cả khoảng) được tính vào ngày đầu tiên
+    timings = {d: RunTimings() for d in dates}
+    db = next(get_db_session())
+    
+    locked_dates = []
+    fetch_logs = {}
+    stats = {d: {"records_created": 0, "records_updated": 0, "pages_fetched": 0} for d in dates}
+    
+    try:
+        for d in dates:
+            if acquire_lock(db, d):
+                locked_dates.append(d)
+            else:
+                logger.warning(f"Another crawler is already running for {d}. Skipping this date.")
+        if not locked_dates:
+            return {"status": "skipped", "reason": "lock_acquired"}
+        
+        for d in locked_dates:
+            fetch_logs[d] = FetchLog(fetch_date=d, status='started', started_at=datetime.utcnow())
+            db.add(fetch_logs[d])
+        db.commit()
+        
+        logger.info(f"Starting backfill {from_date} → {to_date} ({len(locked_dates)} dates)")
+        
+        scraper = build_scraper()
+        with pipeline.clock("login").busy(), timings[locked_dates[0]].stage("login"):
+            logged_in = scraper.ensure_logged_in()
+        if not logged_in:
+            for d, fetch_log in fetch_logs.items():
+                fetch_log.status = 'failed'
+                fetch_log.error_message = "Login failed"
+                fetch_log.completed_at = datetime.utcnow()
+                fetch_log.metrics = _run_metrics(pipeline, started, timings[d])
+            db.commit()
+            logger.error("Login failed")
+            return {"status": "failed", "error": "Login failed"}
+        
+        stats.update(run_pipeline(db, scraper, locked_dates, first_page_only, workers, pipeline, timings))
+        
+        fetched_dates = [d for d in locked_dates if stats[d]["pages_fetched"] > 0]
+        total_rows = sum(stats[d]["records_created"] + stats[d]["records_updated"] for d in locked_dates)
+        logger.info(f"Stored {total_rows} rows for {len(fetched_dates)}/{len(locked_dates)} dates")
+        
+        for d in locked_dates:
+            fetch_log = fetch_logs[d]
+            row_count = stats[d]["records_created"] + stats[d]["records_updated"]
+            fetch_log.status = 'success' if row_count else 'failed'
+            if not row_count:
+                fetch_log.error_message = "No data fetched"
+            fetch_log.records_fetched = row_count
+            fetch_log.records_created = stats[d]["records_created"]
+            fetch_log.records_updated = stats[d]["records_updated"]
+            fetch_log.pages_fetched = stats[d]["pages_fetched"]
+            fetch_log.completed_at = datetime.utcnow()
+            fetch_log.duration_seconds = int((fetch_log.completed_at - fetch_log.started_at).total_seconds())
+            fetch_log.metrics = _run_metrics(pipeline, started, timings[d])
+        db.commit()
+        if fetched_dates:
+            bump_data_version(db)
+        
+        wall_seconds = time.perf_counter() - started
+        rows_per_second = total_rows / wall_seconds if wall_seconds > 0 else 0.0
+        logger.info(f"Backfill completed: {total_rows} rows in {wall_seconds:.1f}s ({rows_per_second:.1f} rows/s)")
+        
+        return {
+            "status": "success" if fetched_dates else "failed",
+            "from_date": from_date.isoformat(),
+            "to_date": to_date.isoformat(),
+            "dates_fetched": len(fetched_dates),
+            "dates_skipped": len(dates) - len(locked_dates),
+            "records_created": sum(v["records_created"] for v in stats.values()),
+            "records_updated": sum(v["records_updated"] for v in stats.values()),
+            "total_records": total_rows,
+            "wall_seconds": round(wall_seconds, 2),
+            "rows_per_second": round(rows_per_second, 1),
+            "stages": pipeline.metrics(),
+        }
+    
+    except Exception as e:
+        logger.error(f"Error during backfill: {str(e)}", exc_info=True)
+        db.rollback()
+        for d, fetch_log in fetch_logs.items():
+            if fetch_log.status == 'started':
+                fetch_log.status = 'failed'
+                fetch_log.error_message = str(e)
+                fetch_log.completed_at = datetime.utcnow()
+                fetch_log.metrics = _run_metrics(pipeline, started, timings[d])
+        db.commit()
+        return {"status": "failed", "error": str(e)}
+    finally:
+        for d in locked_dates:
+            release_lock(db, d)
+        db.close()
+
+
 if __name__ == "__main__":
     import argparse
     
     parser = argparse.ArgumentParser(description="Revenue Data Crawler")
     parser.add_argument("--date", type=str, help="Date to fetch (YYYY-MM-DD), defaults to yesterday")
+    parser.add_argument("--from", dest="from_date", type=str, help="Backfill start date (YYYY-MM-DD), use with --to")
+    parser.add_argument("--to", dest="to_date", type=str, help="Backfill end date (YYYY-MM-DD, inclusive), use with --from")
     parser.add_argument("--first-page-only", action="store_true", help="Fetch only first page")
+    parser.add_argument("--workers", type=int, default=int(os.getenv("SCRAPER_WORKERS", "1")),
+                        help="Number of concurrent page fetchers (1 = sequential)")
     
     args = parser.parse_args()
     
+    if args.from_date or args.to_date:
+        if not (args.from_date and args.to_date):
+            parser.error("--from and --to must be used together")
+        from_date = datetime.strptime(args.from_date, "%Y-%m-%d").date()
+        to_date = datetime.strptime(args.to_date, "%Y-%m-%d").date()
+        if from_date > to_date:
+            parser.error("--from must not be after --to")
+        result = fetch_and_store_range(from_date, to_date, args.first_page_only, workers=args.workers)
+        print(result)
+        sys.exit(0 if result.get("status") == "success" else 1)
+    
     target_date = None
     if args.date:
         target_date = datetime.strptime(args.date, "%Y-%m-%d").date()
     
-    result = fetch_and_store(target_date, args.first_page_only)
+    result = fetch_and_store(target_date, args.first_page_only, workers=args.workers)
     print(result)
     sys.exit(0 if result.get("status") == "success" else 1)
@@ -0,0 +1,119 @@
+"""
+Pipeline nhiều stage nối với nhau bằng queue có giới hạn (bounded queue).
+Mỗi stage chạy trong thread riêng (hoặc thread gọi) và đo thời gian:
+- busy: đang xử lý
+- idle: chờ input từ stage trước
+- blocked: chờ chỗ trống ở queue đầu ra (stage sau xử lý chậm hơn)
+Một stage lỗi → các stage còn lại dừng ở lần get/put kế tiếp, lỗi được raise lại ở join().
+"""
+
+import contextvars
+import queue
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, List
+
+QUEUE_POLL_SECONDS = 0.5
+
+
+class PipelineAborted(Exception):
+    """Một stage khác đã lỗi; stage hiện tại dừng lại"""
+
+
+class StageClock:
+    """Thời gian busy / idle / blocked và số item đã xử lý của một stage"""
+
+    def __init__(self, name: str, abort: threading.Event):
+        self.name = name
+        self.abort = abort
+        self.busy_seconds = 0.0
+        self.idle_seconds = 0.0
+        self.blocked_seconds = 0.0
+        self.items = 0
+
+    @contextmanager
+    def busy(self):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.busy_seconds += time.perf_counter() - started
+
+    def get(self, source: queue.Queue):
+        started = time.perf_counter()
+        try:
+            while True:
+                try:
+                    return source.get(timeout=QUEUE_POLL_SECONDS)
+                except queue.Empty:
+                    if self.abort.is_set():
+                        raise PipelineAborted()
+        finally:
+            self.idle_seconds += time.perf_counter() - started
+
+    def put(self, target: queue.Queue, item) -> None:
+        started = time.perf_counter()
+        try:
+            while True:
+                try:
+                    target.put(item, timeout=QUEUE_POLL_SECONDS)
+                    return
+                except queue.Full:
+                    if self.abort.is_set():
+                        raise PipelineAborted()
+        finally:
+            self.blocked_seconds += time.perf_counter() - started
+
+    def as_dict(self) -> Dict:
+        return {
+            "busy_ms": round(self.busy_seconds * 1000),
+            "idle_ms": round(self.idle_seconds * 1000),
+            "blocked_ms": round(self.blocked_seconds * 1000),
+            "items": self.items,
+        }
+
+
+class Pipeline:
+    """Tập các stage của một lần chạy: tạo clock, start thread cho stage, join và gom lỗi"""
+
+    def __init__(self):
+        self.abort = threading.Event()
+        self.clocks: Dict[str, StageClock] = {}
+        self.errors: List[BaseException] = []
+        self._threads: List[threading.Thread] = []
+
+    def clock(self, name: str) -> StageClock:
+        if name not in self.clocks:
+            self.clocks[name] = StageClock(name, self.abort)
+        return self.clocks[name]
+
+    def fail(self, error: BaseException) -> None:
+        if not isinstance(error, PipelineAborted):
+            self.errors.append(error)
+        self.abort.set()
+
+    def start(self, name: str, target: Callable, *args) -> None:
+        """Chạy target(clock, *args) trong thread riêng (mang theo contextvars của thread gọi, vd. track_queries)"""
+        clock = self.clock(name)
+        context = contextvars.copy_context()
+
+        def run():
+            try:
+                target(clock, *args)
+            except BaseException as e:
+                self.fail(e)
+
+        thread = threading.Thread(target=context.run, args=(run,), name=f"pipeline-{name}", daemon=True)
+        self._threads.append(thread)
+        thread.start()
+
+    def join(self) -> None:
+        """Chờ mọi stage; raise lỗi đầu tiên nếu có stage lỗi"""
+        for thread in self._threads:
+            thread.join()
+        if self.errors:
+            raise self.errors[0]
+
+    def metrics(self) -> Dict[str, Dict]:
+        return {name: clock.as_dict() for name, clock in self.clocks.items()}
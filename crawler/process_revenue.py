@@ -2,23 +2,21 @@
 Process raw revenue data into processed_revenue_data (aggregated by slot for dashboard).
 Uses crawler.db models only so it runs inside the crawler container.
 """
+import os
 import re
-from datetime import date
+from datetime import date, timedelta
 from decimal import Decimal, ROUND_HALF_UP
 from sqlalchemy.orm import Session
-from sqlalchemy import and_
+from sqlalchemy import and_, case, func, select, true, update
 
-from crawler.db import RawRevenueData, ProcessedRevenueData, get_share_for_slot
+from crawler.db import RawRevenueData, ProcessedRevenueData, ShareResolver, GLOBAL_SHARE_SLOT, bump_data_version
+from crawler.timing import RunTimings, timed, count
 
 
-def parse_numeric(value) -> Decimal:
-    if not value or value == '-' or (isinstance(value, str) and value.strip() == ''):
-        return Decimal('0')
-    s = str(value).replace(',', '').strip()
-    try:
-        return Decimal(s)
-    except Exception:
-        return Decimal('0')
+def numeric_value(row, field: str) -> Decimal:
+    """Typed raw column (parsed at ingestion) → Decimal; 0 for a missing row or NULL ('-')"""
+    value = getattr(row, field) if row is not None else None
+    return Decimal(value) if value is not None else Decimal('0')
 
 
 def extract_base_slot(slot: str) -> str:
@@ -26,18 +24,38 @@ def extract_base_slot(slot: str) -> str:
     return slot
 
 
-def process_revenue_data(db: Session, target_date: date) -> dict:
-    raw_data = db.query(RawRevenueData).filter(RawRevenueData.fetch_date == target_date).all()
+def process_revenue_data(db: Session, target_date: date, timings: RunTimings = None) -> dict:
+    return process_revenue_range(db, target_date, target_date, timings=timings)
+
+
+def process_revenue_range(db: Session, from_date: date, to_date: date, timings: RunTimings = None) -> dict:
+    """
+    Process every fetch_date in [from_date, to_date] with a single raw-data query.
+    timings: cộng thời gian process_load / process_upsert và số dòng processed (nếu có).
+    """
+    with timed(timings, "process_load"):
+        raw_data = db.query(RawRevenueData).filter(
+            RawRevenueData.fetch_date >= from_date,
+            RawRevenueData.fetch_date <= to_date
+        ).all()
     if not raw_data:
         return {"status": "no_data", "records_processed": 0}
+    with timed(timings, "process_upsert"):
+        result = _process_rows(db, raw_data)
+    count(timings, "processed_rows", result["records_processed"])
+    return result
+
+
+def _process_rows(db: Session, raw_data: list) -> dict:
+    """Group raw rows by (fetch_date, base slot, time_unit) and upsert processed_revenue_data"""
 
     grouped = {}
     for row in raw_data:
         base_slot = extract_base_slot(row.slot)
-        key = (base_slot, row.time_unit)
+        key = (row.fetch_date, base_slot, row.time_unit)
         if key not in grouped:
             grouped[key] = {
-                'slot': base_slot, 'time_unit': row.time_unit,
+                'slot': base_slot, 'time_unit': row.time_unit, 'fetch_date': row.fetch_date,
                 'desktop': None, 'mobile': None, 'news_desktop': None, 'news_mobile': None,
                 'true_desktop': None, 'true_mobile': None
             }
@@ -55,6 +73,7 @@ def process_revenue_data(db: Session, target_date: date) -> dict:
             grouped[key]['true_mobile'] = row
 
     records_processed = records_created = records_updated = 0
+    shares = ShareResolver.load(db)
     pairs = [
         ('desktop', 'mobile', lambda g: g['slot']),
         ('news_desktop', 'news_mobile', lambda g: f"{g['slot']}_news"),
@@ -63,6 +82,7 @@ def process_revenue_data(db: Session, target_date: date) -> dict:
 
     for group_data in grouped.values():
         time_unit = group_data['time_unit']
+        target_date = group_data['fetch_date']
         for desktop_key, mobile_key, slot_fn in pairs:
             desktop_row = group_data.get(desktop_key)
             mobile_row = group_data.get(mobile_key)
@@ -70,9 +90,9 @@ def process_revenue_data(db: Session, target_date: date) -> dict:
                 continue
             slot_name = slot_fn(group_data)
             # Dynamic share lookup per slot + date
-            share = get_share_for_slot(db, slot_name, target_date)
-            total_player_impr = parse_numeric(desktop_row.total_player_impr if desktop_row else '0') + parse_numeric(mobile_row.total_player_impr if mobile_row else '0')
-            total_revenue = parse_numeric(desktop_row.net_revenue_usd if desktop_row else '0') + parse_numeric(mobile_row.net_revenue_usd if mobile_row else '0')
+            share = shares.share_for(slot_name, target_date)
+            total_player_impr = numeric_value(desktop_row, 'total_player_impr') + numeric_value(mobile_row, 'total_player_impr')
+            total_revenue = numeric_value(desktop_row, 'net_revenue_usd') + numeric_value(mobile_row, 'net_revenue_usd')
             rpm = (total_revenue / total_player_impr * Decimal('1000')).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP) if total_player_impr > 0 else Decimal('0')
             total_player_impr_2 = total_player_impr
             revenue_2 = (total_revenue * (share / Decimal('100'))).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
@@ -107,66 +127,118 @@ def process_revenue_data(db: Session, target_date: date) -> dict:
     return {"status": "success", "records_processed": records_processed, "records_created": records_created, "records_updated": records_updated}
 
 
-def recalculate_processed_data_for_slot(db: Session, slot: str, from_date: date = None) -> dict:
+# Số ngày mỗi câu UPDATE khi tính lại share (mỗi chunk commit riêng để transaction ngắn)
+SHARE_RECALC_CHUNK_DAYS = int(os.getenv("SHARE_RECALC_CHUNK_DAYS", "31"))
+
+
+def _share_intervals(shares: ShareResolver, slot: str, start: date, end: date) -> list:
     """
-    Recalculate revenue_2, rpm_2 for a slot when share config changes.
-    If from_date is provided, only recalculate records from that date onwards.
-    Otherwise recalculate all records for the slot.
+    [(from_date, to_date, share)] covering [start, end] (inclusive) where the effective share of
+    `slot` is constant. Boundaries are the slot's own effective dates plus the global "*" chain.
     """
-    query = db.query(ProcessedRevenueData).filter(ProcessedRevenueData.slot == slot)
-    if from_date:
-        query = query.filter(ProcessedRevenueData.fetch_date >= from_date)
-
-    records = query.all()
+    boundaries = {d for d, _ in shares.timeline(slot)} | {d for d, _ in shares.timeline(GLOBAL_SHARE_SLOT)}
+    points = sorted({d for d in boundaries if start < d <= end} | {start})
+    intervals = []
+    for i, point in enumerate(points):
+        last = points[i + 1] - timedelta(days=1) if i + 1 < len(points) else end
+        share = shares.share_for(slot, point)
+        if intervals and intervals[-1][2] == share:
+            intervals[-1] = (intervals[-1][0], last, share)
+        else:
+            intervals.append((point, last, share))
+    return intervals
+
+
+def _date_chunks(start: date, end: date):
+    step = timedelta(days=max(SHARE_RECALC_CHUNK_DAYS, 1))
+    while start <= end:
+        chunk_end = min(start + step - timedelta(days=1), end)
+        yield start, chunk_end
+        start = chunk_end + timedelta(days=1)
+
+
+def _recalculate_intervals(db: Session, jobs: list, progress=None) -> int:
+    """
+    jobs = [(slot_condition, from_date, to_date, share)]. Each interval becomes one set-based
+    UPDATE per date chunk (revenue_2/rpm_2 computed in SQL), committed chunk by chunk.
+    Returns the number of rows updated.
+    """
+    table = ProcessedRevenueData.__table__
+    chunks = [
+        (condition, chunk_start, chunk_end, share)
+        for condition, start, end, share in jobs
+        for chunk_start, chunk_end in _date_chunks(start, end)
+    ]
     records_updated = 0
+    for done, (condition, chunk_start, chunk_end, share) in enumerate(chunks, start=1):
+        # Cùng công thức với process_revenue_range: ROUND(.., 2) = quantize 0.01 ROUND_HALF_UP
+        revenue_2 = func.round(table.c.revenue * (Decimal(share) / Decimal('100')), 2)
+        rpm_2 = case(
+            (table.c.total_player_impr_2 > 0, func.round(revenue_2 / table.c.total_player_impr_2 * 1000, 2)),
+            else_=0
+        )
+        result = db.execute(
+            update(table)
+            .where(condition, table.c.fetch_date >= chunk_start, table.c.fetch_date <= chunk_end)
+            .values(share=share, revenue_2=revenue_2, rpm_2=rpm_2)
+        )
+        records_updated += result.rowcount or 0
+        db.commit()
+        if progress:
+            progress(done, len(chunks))
+    if records_updated:
+        bump_data_version(db)
+    return records_updated
+
+
+def _date_bounds(db: Session, condition, from_date: date = None):
+    """(min, max) fetch_date of processed rows matching condition, from from_date onwards."""
+    table = ProcessedRevenueData.__table__
+    query = select(func.min(table.c.fetch_date), func.max(table.c.fetch_date)).where(condition)
+    if from_date:
+        query = query.where(table.c.fetch_date >= from_date)
+    return db.execute(query).one()
 
-    for record in records:
-        # Lookup current share for this slot + date
-        share = get_share_for_slot(db, slot, record.fetch_date)
-
-        # Recalculate revenue_2 and rpm_2
-        revenue_2 = (record.revenue * (share / Decimal('100'))).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
-        rpm_2 = Decimal('0')
-        if record.total_player_impr_2 and record.total_player_impr_2 > 0:
-            rpm_2 = (revenue_2 / record.total_player_impr_2 * Decimal('1000')).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
-
-        # Update record
-        record.share = share
-        record.revenue_2 = revenue_2
-        record.rpm_2 = rpm_2
-        records_updated += 1
 
-    db.commit()
+def recalculate_processed_data_for_slot(db: Session, slot: str, from_date: date = None, progress=None) -> dict:
+    """
+    Recalculate revenue_2, rpm_2 for a slot when share config changes.
+    If from_date is provided, only recalculate records from that date onwards.
+    Otherwise recalculate all records for the slot.
+    Runs one UPDATE per (effective-share interval, date chunk); progress(done, total) is called per chunk.
+    """
+    table = ProcessedRevenueData.__table__
+    condition = table.c.slot == slot
+    start, end = _date_bounds(db, condition, from_date)
+    if start is None:
+        return {"status": "success", "slot": slot, "records_updated": 0}
+
+    shares = ShareResolver.load(db)
+    jobs = [(condition, a, b, share) for a, b, share in _share_intervals(shares, slot, start, end)]
+    records_updated = _recalculate_intervals(db, jobs, progress)
     return {"status": "success", "slot": slot, "records_updated": records_updated}
 
 
-def recalculate_all_slots(db: Session, from_date: date = None) -> dict:
+def recalculate_all_slots(db: Session, from_date: date = None, progress=None) -> dict:
     """
     Recalculate revenue_2, rpm_2 for ALL slots when global share config changes.
     If from_date is provided, only recalculate records from that date onwards.
+    Slots with their own config follow their own intervals; every other slot follows the
+    global "*" chain, so the number of UPDATEs depends on config intervals, not on rows.
     """
-    query = db.query(ProcessedRevenueData)
-    if from_date:
-        query = query.filter(ProcessedRevenueData.fetch_date >= from_date)
-
-    records = query.all()
-    records_updated = 0
-
-    for record in records:
-        # Lookup current share for this slot + date (will use global "*" if no specific config)
-        share = get_share_for_slot(db, record.slot, record.fetch_date)
-
-        # Recalculate revenue_2 and rpm_2
-        revenue_2 = (record.revenue * (share / Decimal('100'))).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
-        rpm_2 = Decimal('0')
-        if record.total_player_impr_2 and record.total_player_impr_2 > 0:
-            rpm_2 = (revenue_2 / record.total_player_impr_2 * Decimal('1000')).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
-
-        # Update record
-        record.share = share
-        record.revenue_2 = revenue_2
-        record.rpm_2 = rpm_2
-        records_updated += 1
-
-    db.commit()
+    table = ProcessedRevenueData.__table__
+    start, end = _date_bounds(db, true(), from_date)
+    if start is None:
+        return {"status": "success", "records_updated": 0}
+
+    shares = ShareResolver.load(db)
+    configured = shares.slots()
+    jobs = []
+    for slot in configured:
+        condition = table.c.slot == slot
+        jobs.extend((condition, a, b, share) for a, b, share in _share_intervals(shares, slot, start, end))
+    others = table.c.slot.notin_(configured) if configured else true()
+    jobs.extend((others, a, b, share) for a, b, share in _share_intervals(shares, GLOBAL_SHARE_SLOT, start, end))
+
+    records_updated = _recalculate_intervals(db, jobs, progress)
     return {"status": "success", "records_updated": records_updated}
@@ -0,0 +1,109 @@
+"""
+Đo query SQL (bật bằng SQL_INSTRUMENTATION=1): đếm số query, tổng thời gian DB và các câu
+lệnh giống hệt nhau lặp lại (dấu hiệu N+1) trong một request API hoặc một lần crawl / job.
+
+    with track_queries() as queries:   # None khi không bật
+        ...
+    if queries:
+        logger.info(queries.summary())
+
+Listener before/after_cursor_execute chỉ được gắn vào engine khi bật, nên mặc định không tốn gì.
+Phạm vi đo theo contextvars: thread của threadpool (FastAPI) và của Pipeline mang theo context.
+"""
+
+import logging
+import os
+import re
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import List, Optional, Tuple
+
+from sqlalchemy import event
+
+logger = logging.getLogger(__name__)
+
+SQL_INSTRUMENTATION = os.getenv("SQL_INSTRUMENTATION", "0").lower() in ("1", "true", "yes")
+# Một câu lệnh (cùng SQL, khác tham số) chạy từ ngần này lần trở lên thì bị đánh dấu
+REPEATED_QUERY_THRESHOLD = int(os.getenv("SQL_REPEATED_QUERY_THRESHOLD", "5"))
+
+_current: ContextVar[Optional["QueryStats"]] = ContextVar("query_stats", default=None)
+_WHITESPACE = re.compile(r"\s+")
+
+
+class QueryStats:
+    """Số query, tổng thời gian và số lần chạy của từng câu lệnh; thread-safe"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.count = 0
+        self.seconds = 0.0
+        self.statements = Counter()
+
+    def record(self, statement: str, seconds: float) -> None:
+        key = _WHITESPACE.sub(" ", statement).strip()
+        with self._lock:
+            self.count += 1
+            self.seconds += seconds
+            self.statements[key] += 1
+
+    @property
+    def milliseconds(self) -> float:
+        return round(self.seconds * 1000, 1)
+
+    def repeated(self, threshold: int = None) -> List[Tuple[str, int]]:
+        """[(statement, số lần)] chạy ≥ threshold lần, nhiều nhất trước"""
+        threshold = threshold or REPEATED_QUERY_THRESHOLD
+        with self._lock:
+            return [(s, n) for s, n in self.statements.most_common() if n >= threshold]
+
+    def summary(self) -> str:
+        text = f"{self.count} queries, {self.milliseconds} ms DB"
+        repeated = self.repeated()
+        if repeated:
+            statement, times = repeated[0]
+            text += f", {len(repeated)} repeated statement(s) (top {times}x: {statement[:160]})"
+        return text
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    # Một connection chỉ chạy một câu lệnh tại một thời điểm
+    conn.info["query_started"] = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info.pop("query_started", None)
+    stats = _current.get()
+    if stats is not None and started is not None:
+        stats.record(statement, time.perf_counter() - started)
+
+
+def instrument_engine(engine) -> None:
+    """Gắn listener đo query vào engine (gọi một lần, khi SQL_INSTRUMENTATION bật)"""
+    if not event.contains(engine, "before_cursor_execute", _before_cursor_execute):
+        event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+
+
+@contextmanager
+def track_queries():
+    """Đo mọi query chạy trong context hiện tại; yield QueryStats, hoặc None khi không bật"""
+    if not SQL_INSTRUMENTATION:
+        yield None
+        return
+    stats = QueryStats()
+    token = _current.set(stats)
+    try:
+        yield stats
+    finally:
+        _current.reset(token)
+
+
+def log_repeated(stats: Optional[QueryStats], where: str) -> None:
+    """Cảnh báo từng câu lệnh lặp lại (N+1) của một request / job"""
+    if stats is None:
+        return
+    for statement, times in stats.repeated():
+        logger.warning("%s: statement ran %dx (possible N+1): %s", where, times, statement[:300])
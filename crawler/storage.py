@@ -0,0 +1,144 @@
+"""
+Bulk storage layer dùng chung cho crawler/main.py và backend/data_fetcher.py.
+Ghi nhiều dòng bằng một câu INSERT ... ON DUPLICATE KEY UPDATE (MySQL)
+hoặc INSERT ... ON CONFLICT DO UPDATE (PostgreSQL/SQLite), chia theo chunk.
+"""
+
+import os
+from datetime import datetime, date
+from decimal import Decimal, InvalidOperation
+from typing import Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+from sqlalchemy import select, tuple_
+from sqlalchemy.orm import Session
+
+from crawler.db import RawRevenueData
+
+UPSERT_CHUNK_SIZE = int(os.getenv("CRAWLER_UPSERT_CHUNK", "1000"))
+
+# Tên cột scrape được (có thể khác case) → cột trong raw_revenue_data
+RAW_FIELD_KEYS = {
+    'channel': ['channel', 'Channel', 'CHANNEL'],
+    'slot': ['slot', 'Slot', 'SLOT'],
+    'time_unit': ['time unit', 'time_unit', 'Time Unit', 'TIME UNIT'],
+    'total_player_impr': ['total player impr', 'total_player_impr', 'Total Player Impr', 'TOTAL PLAYER IMPR'],
+    'total_ad_impr': ['total ad impr', 'total_ad_impr', 'Total Ad Impr', 'TOTAL AD IMPR'],
+    'rpm': ['rpm', 'RPM'],
+    'gross_revenue_usd': ['gross revenue (usd)', 'gross_revenue_usd', 'Gross Revenue (USD)', 'GROSS REVENUE (USD)'],
+    'net_revenue_usd': ['net revenue (usd)', 'net_revenue_usd', 'Net Revenue (USD)', 'NET REVENUE (USD)'],
+}
+
+RAW_KEY_COLUMNS = ('channel', 'slot', 'time_unit', 'fetch_date')
+RAW_NUMERIC_COLUMNS = ('total_player_impr', 'total_ad_impr', 'rpm', 'gross_revenue_usd', 'net_revenue_usd')
+# Cột DECIMAL + cột *_raw giữ chuỗi gốc đã scrape
+RAW_VALUE_COLUMNS = RAW_NUMERIC_COLUMNS + tuple(f"{c}_raw" for c in RAW_NUMERIC_COLUMNS)
+
+
+def parse_decimal(value) -> Optional[Decimal]:
+    """Chuỗi số đã scrape ("1,234.5") → Decimal; None cho "-", rỗng hoặc không parse được"""
+    if value is None:
+        return None
+    if isinstance(value, Decimal):
+        return value
+    cleaned = str(value).replace(',', '').strip()
+    if not cleaned or cleaned == '-':
+        return None
+    try:
+        number = Decimal(cleaned)
+    except InvalidOperation:
+        return None
+    return number if number.is_finite() else None
+
+
+def normalize_raw_row(row_data: Dict, fetch_date: date) -> Dict:
+    """Scraped row dict → dict theo tên cột raw_revenue_data (số đã parse + chuỗi gốc ở *_raw)"""
+    values = {}
+    for column, key_variants in RAW_FIELD_KEYS.items():
+        values[column] = ''
+        for key in key_variants:
+            if key in row_data:
+                values[column] = row_data[key]
+                break
+    for column in RAW_NUMERIC_COLUMNS:
+        original = values[column]
+        values[f"{column}_raw"] = str(original)[:50] if original not in (None, '') else None
+        values[column] = parse_decimal(original)
+    values['fetch_date'] = fetch_date
+    return values
+
+
+def _chunks(items: List, size: int) -> Iterable[List]:
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def _upsert_statement(db: Session, table, chunk: List[Dict], key_columns: Sequence[str], update_columns: Sequence[str]):
+    dialect = db.get_bind().dialect.name
+    if dialect == 'mysql':
+        from sqlalchemy.dialects.mysql import insert
+        stmt = insert(table).values(chunk)
+        return stmt.on_duplicate_key_update({c: stmt.inserted[c] for c in update_columns})
+    if dialect in ('postgresql', 'sqlite'):
+        if dialect == 'postgresql':
+            from sqlalchemy.dialects.postgresql import insert
+        else:
+            from sqlalchemy.dialects.sqlite import insert
+        stmt = insert(table).values(chunk)
+        return stmt.on_conflict_do_update(
+            index_elements=list(key_columns),
+            set_={c: stmt.excluded[c] for c in update_columns}
+        )
+    raise ValueError(f"Bulk upsert is not supported for database dialect: {dialect}")
+
+
+def bulk_upsert(db: Session, table, rows: List[Dict], key_columns: Sequence[str],
+                update_columns: Sequence[str], chunk_size: int = None,
+                existing_keys: Optional[Set[tuple]] = None) -> Tuple[int, int]:
+    """
+    Upsert rows (dict theo tên cột) vào table dựa trên unique key key_columns.
+    Mỗi chunk = 1 SELECT lấy key đã tồn tại (để đếm created/updated) + 1 INSERT nhiều dòng.
+    Nếu caller đã prefetch key (existing_keys, tuple theo thứ tự key_columns) thì bỏ qua các SELECT đó.
+    Không commit; trả về (created, updated).
+    """
+    chunk_size = chunk_size or UPSERT_CHUNK_SIZE
+    key_cols = [table.c[c] for c in key_columns]
+
+    # Trùng key trong cùng batch: dòng sau ghi đè dòng trước (PostgreSQL không cho update 2 lần)
+    deduped = {}
+    for row in rows:
+        deduped[tuple(row[c] for c in key_columns)] = row
+    unique_rows = list(deduped.values())
+
+    created = updated = 0
+    for chunk in _chunks(unique_rows, chunk_size):
+        keys = [tuple(row[c] for c in key_columns) for row in chunk]
+        if existing_keys is not None:
+            existing = existing_keys
+        else:
+            existing = {
+                tuple(r) for r in db.execute(select(*key_cols).where(tuple_(*key_cols).in_(keys)))
+            }
+        db.execute(_upsert_statement(db, table, chunk, key_columns, update_columns))
+        chunk_updated = sum(1 for key in keys if key in existing)
+        updated += chunk_updated
+        created += len(chunk) - chunk_updated
+    return created, updated
+
+
+def upsert_raw_rows(db: Session, rows: Iterable[Dict], fetch_date: date, model=RawRevenueData,
+                    chunk_size: int = None) -> Tuple[int, int]:
+    """Lưu các dòng scrape được của fetch_date vào raw_revenue_data (ghi đè nếu đã có). Trả về (created, updated)."""
+    fetched_at = datetime.utcnow()
+    values = []
+    for row_data in rows:
+        row = normalize_raw_row(row_data, fetch_date)
+        row['fetched_at'] = fetched_at
+        values.append(row)
+    if not values:
+        return 0, 0
+    return bulk_upsert(
+        db, model.__table__, values,
+        key_columns=RAW_KEY_COLUMNS,
+        update_columns=RAW_VALUE_COLUMNS + ('fetched_at',),
+        chunk_size=chunk_size
+    )
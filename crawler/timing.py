@@ -0,0 +1,56 @@
+"""
+Bộ thu thời gian cho một lần crawl: milliseconds theo stage (login, fetch, parse, delay,
+store, formulas_*, process_*) + bộ đếm (pages, bytes, rows...). Được truyền vào
+RevenueShareScraper, FormulaEngine và process_revenue_data; kết quả ghi vào
+fetch_logs.metrics để so sánh giữa các lần chạy (/api/fetch-logs/trends).
+
+Thời gian của stage chạy trên nhiều thread (vd. fetch với workers > 1) là tổng thời
+gian của các thread, có thể lớn hơn wall time.
+"""
+
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from typing import Dict, Optional
+
+
+class RunTimings:
+    """Thread-safe: các worker tải trang song song cùng ghi vào một collector"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.stages = {}    # stage -> giây
+        self.counters = {}  # tên -> số nguyên
+
+    @contextmanager
+    def stage(self, name: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - started)
+
+    def add_time(self, name: str, seconds: float) -> None:
+        with self._lock:
+            self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def count(self, name: str, value: int = 1) -> None:
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def as_dict(self) -> Dict:
+        with self._lock:
+            return {
+                "stages_ms": {name: round(seconds * 1000) for name, seconds in self.stages.items()},
+                "counters": dict(self.counters),
+            }
+
+
+def timed(timings: Optional[RunTimings], name: str):
+    """timings.stage(name), hoặc không làm gì khi không có collector"""
+    return timings.stage(name) if timings is not None else nullcontext()
+
+
+def count(timings: Optional[RunTimings], name: str, value: int = 1) -> None:
+    if timings is not None:
+        timings.count(name, value)
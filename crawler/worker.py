@@ -0,0 +1,348 @@
+#!/usr/bin/env python3
+"""
+Background worker - chạy các job mà API ghi vào DB:
+- share_recalc_jobs (/shares): job pending cùng slot (hoặc bị job "*" bao trùm) được gộp
+  lại chạy một lần, tiến độ (chunk) được ghi vào từng job để trang admin poll.
+- crawl_jobs (/api/trigger-crawl): chạy crawler.main.fetch_and_store (giữ lock crawl_runs
+  như cron crawler), tiến độ từng bước được ghi vào job cho /api/crawl-status.
+
+    python crawler/worker.py          # chạy liên tục, poll mỗi WORKER_POLL_SECONDS
+    python crawler/worker.py --once   # xử lý các job đang chờ rồi thoát
+
+Hai hàng đợi chạy trên hai thread riêng (mỗi thread một session), nên một crawl dài không
+chặn việc tính lại share.
+
+Job đang chạy ghi claimed_by (host:pid) và heartbeat_at (thread riêng làm mới mỗi
+WORKER_HEARTBEAT_SECONDS). Mỗi vòng poll, job 'running' có heartbeat cũ hơn
+WORKER_STALE_SECONDS (worker chết) được đưa lại về pending; job của worker khác còn sống
+không bị đụng tới.
+"""
+
+import sys
+import os
+import time
+import json
+import socket
+import logging
+import threading
+from datetime import datetime, date, timedelta
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from crawler.db import SessionLocal, ShareRecalcJob, GLOBAL_SHARE_SLOT, CrawlJob, CRAWL_STAGES
+from crawler.process_revenue import recalculate_all_slots, recalculate_processed_data_for_slot
+from crawler.querystats import track_queries, log_repeated
+
+logger = logging.getLogger(__name__)
+
+WORKER_POLL_SECONDS = float(os.getenv("WORKER_POLL_SECONDS", "5"))
+CRAWL_JOB_ACTIVE = ("pending", "running")
+WORKER_ID = os.getenv("WORKER_ID") or f"{socket.gethostname()}:{os.getpid()}"
+WORKER_HEARTBEAT_SECONDS = float(os.getenv("WORKER_HEARTBEAT_SECONDS", "30"))
+# Phải lớn hơn nhiều so với WORKER_HEARTBEAT_SECONDS
+WORKER_STALE_SECONDS = float(os.getenv("WORKER_STALE_SECONDS", "300"))
+
+
+def enqueue_share_recalc(db: Session, slot: str, from_date: Optional[date], created_by: str = None) -> ShareRecalcJob:
+    """Queue a recalculation of slot (or "*" for all slots) from from_date onwards. Commits."""
+    job = ShareRecalcJob(slot=slot, from_date=from_date, status="pending", created_by=created_by)
+    db.add(job)
+    db.commit()
+    return job
+
+
+def _earliest(dates):
+    """Earliest from_date; None (= all dates) wins."""
+    return None if any(d is None for d in dates) else min(dates)
+
+
+def _covers(from_date: Optional[date], other: Optional[date]) -> bool:
+    """A run from from_date also recalculates everything from other onwards."""
+    return from_date is None or (other is not None and other >= from_date)
+
+
+def merge_jobs(jobs: List[ShareRecalcJob]) -> List[tuple]:
+    """
+    Group pending jobs into runs [(slot, from_date, [jobs])]:
+    - jobs of the same slot merge into one run from the earliest from_date
+    - a "*" run (all slots) absorbs slot jobs it already covers
+    """
+    by_slot = {}
+    for job in jobs:
+        by_slot.setdefault(job.slot, []).append(job)
+
+    runs = []
+    global_from = None
+    global_jobs = by_slot.pop(GLOBAL_SHARE_SLOT, [])
+    if global_jobs:
+        global_from = _earliest([j.from_date for j in global_jobs])
+    for slot, slot_jobs in by_slot.items():
+        if global_jobs:
+            covered = [j for j in slot_jobs if _covers(global_from, j.from_date)]
+            global_jobs.extend(covered)
+            slot_jobs = [j for j in slot_jobs if j not in covered]
+        if slot_jobs:
+            runs.append((slot, _earliest([j.from_date for j in slot_jobs]), slot_jobs))
+    if global_jobs:
+        # Thứ tự không ảnh hưởng kết quả: mỗi lần chạy đều tính theo share config hiện tại
+        runs.insert(0, (GLOBAL_SHARE_SLOT, global_from, global_jobs))
+    return runs
+
+
+def _update_jobs(db: Session, jobs: List[ShareRecalcJob], **values):
+    for job in jobs:
+        for key, value in values.items():
+            setattr(job, key, value)
+    db.commit()
+
+
+class Heartbeat:
+    """
+    Refresh heartbeat_at of the jobs this worker claimed every WORKER_HEARTBEAT_SECONDS, on its
+    own thread and session, so a long chunk or crawl stage never makes a live job look stale.
+    """
+
+    def __init__(self, model, jobs):
+        self.model = model
+        self.ids = [j.id for j in jobs]
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=f"heartbeat-{model.__tablename__}", daemon=True)
+
+    def __enter__(self):
+        if self.ids:
+            self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        if self._thread.is_alive():
+            self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(WORKER_HEARTBEAT_SECONDS):
+            db = SessionLocal()
+            try:
+                db.query(self.model).filter(
+                    self.model.id.in_(self.ids), self.model.claimed_by == WORKER_ID,
+                    self.model.status == "running"
+                ).update({self.model.heartbeat_at: datetime.utcnow()}, synchronize_session=False)
+                db.commit()
+            except Exception as e:
+                db.rollback()
+                logger.warning(f"Heartbeat for {self.model.__tablename__} {self.ids} failed: {e}")
+            finally:
+                db.close()
+
+
+def _claim(db: Session, jobs: list, **values):
+    now = datetime.utcnow()
+    _update_jobs(db, jobs, status="running", started_at=now, claimed_by=WORKER_ID, heartbeat_at=now, **values)
+
+
+def _stale_jobs(db: Session, model) -> list:
+    """Running jobs whose worker stopped sending heartbeats (locked, SKIP LOCKED)."""
+    cutoff = datetime.utcnow() - timedelta(seconds=WORKER_STALE_SECONDS)
+    return db.query(model).filter(
+        model.status == "running", func.coalesce(model.heartbeat_at, model.started_at) < cutoff
+    ).order_by(model.id).with_for_update(skip_locked=True).all()
+
+
+def claim_pending_jobs(db: Session) -> List[ShareRecalcJob]:
+    """Lock and mark all pending jobs as running (SKIP LOCKED so two workers never share a job)."""
+    jobs = db.query(ShareRecalcJob).filter(
+        ShareRecalcJob.status == "pending"
+    ).order_by(ShareRecalcJob.id).with_for_update(skip_locked=True).all()
+    if jobs:
+        _claim(db, jobs, chunks_done=0, chunks_total=0)
+    return jobs
+
+
+def run_share_jobs(db: Session) -> int:
+    """Process every pending share job once. Returns the number of jobs handled."""
+    jobs = claim_pending_jobs(db)
+    with Heartbeat(ShareRecalcJob, jobs):
+        _run_merged_share_jobs(db, jobs)
+    return len(jobs)
+
+
+def _run_merged_share_jobs(db: Session, jobs: List[ShareRecalcJob]):
+    for slot, from_date, run_jobs in merge_jobs(jobs):
+        ids = [j.id for j in run_jobs]
+        logger.info(f"Recalculating shares for slot {slot} from {from_date or 'the beginning'} (jobs {ids})")
+
+        def progress(done, total, run_jobs=run_jobs):
+            _update_jobs(db, run_jobs, chunks_done=done, chunks_total=total)
+
+        try:
+            with track_queries() as queries:
+                if slot == GLOBAL_SHARE_SLOT:
+                    result = recalculate_all_slots(db, from_date=from_date, progress=progress)
+                else:
+                    result = recalculate_processed_data_for_slot(db, slot, from_date=from_date, progress=progress)
+            _update_jobs(db, run_jobs, status="completed", completed_at=datetime.utcnow(),
+                         records_updated=result["records_updated"])
+            logger.info(f"✅ Share recalculation for slot {slot} done: {result['records_updated']} records (jobs {ids})"
+                        + (f"; {queries.summary()}" if queries else ""))
+            log_repeated(queries, f"Share jobs {ids}")
+        except Exception as e:
+            db.rollback()
+            _update_jobs(db, run_jobs, status="failed", completed_at=datetime.utcnow(), error_message=str(e))
+            logger.error(f"❌ Share recalculation for slot {slot} failed (jobs {ids}): {e}", exc_info=True)
+
+
+def initial_crawl_progress() -> dict:
+    return {stage: {"status": "pending", "count": None} for stage in CRAWL_STAGES}
+
+
+def enqueue_crawl(db: Session, fetch_date: date, first_page_only: bool = False,
+                  created_by: str = None) -> Tuple[CrawlJob, bool]:
+    """Queue a crawl of fetch_date unless one is already pending/running. Returns (job, created). Commits."""
+    existing = db.query(CrawlJob).filter(
+        CrawlJob.fetch_date == fetch_date, CrawlJob.status.in_(CRAWL_JOB_ACTIVE)
+    ).order_by(CrawlJob.id).first()
+    if existing:
+        return existing, False
+    job = CrawlJob(fetch_date=fetch_date, first_page_only=first_page_only, status="pending",
+                   progress=json.dumps(initial_crawl_progress()), created_by=created_by)
+    db.add(job)
+    db.commit()
+    return job, True
+
+
+def claim_crawl_job(db: Session) -> Optional[CrawlJob]:
+    """Lock and mark the oldest pending crawl job as running (SKIP LOCKED, one job per worker)."""
+    job = db.query(CrawlJob).filter(
+        CrawlJob.status == "pending"
+    ).order_by(CrawlJob.id).with_for_update(skip_locked=True).first()
+    if job:
+        _claim(db, [job])
+    return job
+
+
+def run_crawl_job(db: Session, job: CrawlJob) -> str:
+    """Run one claimed crawl job through fetch_and_store, recording per-stage progress. Returns the final status."""
+    # Import muộn: crawler.main cấu hình logging ghi file và cần scraper (chỉ có trong image crawler)
+    from crawler.main import fetch_and_store
+
+    state = json.loads(job.progress) if job.progress else initial_crawl_progress()
+
+    def progress(stage, status, count=None):
+        state[stage]["status"] = status
+        if count is not None:
+            state[stage]["count"] = count
+        _update_jobs(db, [job], stage=stage, progress=json.dumps(state))
+
+    logger.info(f"Crawl job {job.id}: fetching {job.fetch_date}")
+    try:
+        result = fetch_and_store(job.fetch_date, bool(job.first_page_only),
+                                 workers=int(os.getenv("SCRAPER_WORKERS", "1")), progress=progress)
+    except Exception as e:
+        db.rollback()
+        logger.error(f"❌ Crawl job {job.id} crashed: {e}", exc_info=True)
+        result = {"status": "failed", "error": str(e)}
+
+    status = {"success": "completed", "skipped": "skipped"}.get(result.get("status"), "failed")
+    if status == "failed" and job.stage and state[job.stage]["status"] == "running":
+        state[job.stage]["status"] = "failed"
+    _update_jobs(db, [job], status=status, completed_at=datetime.utcnow(), progress=json.dumps(state),
+                 result=json.dumps(result, default=str), error_message=result.get("error") or result.get("reason"))
+    logger.info(f"Crawl job {job.id} {status}: {result}")
+    return status
+
+
+def run_crawl_jobs(db: Session) -> int:
+    """Run pending crawl jobs one by one until none are left. Returns the number of jobs handled."""
+    handled = 0
+    while True:
+        job = claim_crawl_job(db)
+        if job is None:
+            return handled
+        with Heartbeat(CrawlJob, [job]):
+            run_crawl_job(db, job)
+        handled += 1
+
+
+def requeue_stale_share_jobs(db: Session) -> int:
+    """
+    Share jobs left 'running' by a worker that died (no heartbeat for WORKER_STALE_SECONDS) go
+    back to pending; recalculation is idempotent. Jobs of another live worker keep running.
+    """
+    stale = _stale_jobs(db, ShareRecalcJob)
+    for job in stale:
+        logger.warning(f"Share job {job.id} claimed by {job.claimed_by} has no heartbeat since "
+                       f"{job.heartbeat_at or job.started_at}; re-queueing")
+    _update_jobs(db, stale, status="pending", claimed_by=None, heartbeat_at=None)
+    return len(stale)
+
+
+def requeue_stale_crawl_jobs(db: Session) -> int:
+    """
+    Same for crawl jobs (raw data upserts are idempotent). The crawl_runs lock of a dead crawl
+    stops getting heartbeats too and is taken over by the next acquire_lock (crawler/lock.py).
+    """
+    stale = _stale_jobs(db, CrawlJob)
+    for job in stale:
+        logger.warning(f"Crawl job {job.id} ({job.fetch_date}) claimed by {job.claimed_by} has no heartbeat since "
+                       f"{job.heartbeat_at or job.started_at}; re-queueing")
+    _update_jobs(db, stale, status="pending", stage=None, claimed_by=None, heartbeat_at=None)
+    return len(stale)
+
+
+QUEUES = (
+    ("share", requeue_stale_share_jobs, run_share_jobs),
+    ("crawl", requeue_stale_crawl_jobs, run_crawl_jobs),
+)
+
+
+def serve_queue(name: str, requeue_stale, run, once: bool = False):
+    """Poll one job queue on its own session until stopped (or once with --once)."""
+    db = SessionLocal()
+    try:
+        while True:
+            try:
+                requeued = requeue_stale(db)
+                if requeued:
+                    logger.info(f"Re-queued {requeued} stale {name} job(s)")
+                handled = run(db)
+            except Exception as e:
+                db.rollback()
+                logger.error(f"{name.capitalize()} queue error: {e}", exc_info=True)
+                handled = 0
+            if once:
+                break
+            if not handled:
+                time.sleep(WORKER_POLL_SECONDS)
+    finally:
+        db.close()
+
+
+def main():
+    import argparse
+
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        handlers=[logging.StreamHandler()]
+    )
+    parser = argparse.ArgumentParser(description="Background worker for share recalculation and crawl jobs")
+    parser.add_argument("--once", action="store_true", help="Process pending jobs once and exit")
+    args = parser.parse_args()
+
+    threads = [
+        threading.Thread(target=serve_queue, args=(name, requeue_stale, run, args.once),
+                         name=f"{name}-queue", daemon=True)
+        for name, requeue_stale, run in QUEUES
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+if __name__ == "__main__":
+    main()
@@ -13,16 +13,22 @@ CREATE TABLE IF NOT EXISTS raw_revenue_data (
     channel VARCHAR(255) NOT NULL,
     slot VARCHAR(255) NOT NULL,
     time_unit VARCHAR(50) NOT NULL,
-    total_player_impr VARCHAR(50),  -- Stored as string to handle commas
-    total_ad_impr VARCHAR(50),      -- Stored as string to handle commas and "-"
-    rpm VARCHAR(50),
-    gross_revenue_usd VARCHAR(50),
-    net_revenue_usd VARCHAR(50),
+    total_player_impr DECIMAL(20,2),  -- Parsed once at ingestion; NULL for "-"
+    total_ad_impr DECIMAL(20,2),
+    rpm DECIMAL(20,6),
+    gross_revenue_usd DECIMAL(20,6),
+    net_revenue_usd DECIMAL(20,6),
+    total_player_impr_raw VARCHAR(50),  -- Original scraped strings (with commas / "-"), for auditing
+    total_ad_impr_raw VARCHAR(50),
+    rpm_raw VARCHAR(50),
+    gross_revenue_usd_raw VARCHAR(50),
+    net_revenue_usd_raw VARCHAR(50),
     fetched_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     fetch_date DATE NOT NULL,  -- Date when data was fetched (lịch sử mỗi ngày)
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     UNIQUE KEY unique_record (channel, slot, time_unit, fetch_date),
     INDEX idx_fetch_date (fetch_date),
+    INDEX idx_page_order (fetch_date DESC, slot, id),  -- keyset pagination /api/raw-data
     INDEX idx_channel (channel),
     INDEX idx_time_unit (time_unit)
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
@@ -98,6 +104,7 @@ CREATE TABLE IF NOT EXISTS fetch_logs (
     started_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     completed_at TIMESTAMP NULL,
     duration_seconds INT,
+    metrics TEXT NULL,  -- JSON: wall_ms + busy/idle/blocked ms per pipeline stage
     INDEX idx_fetch_date (fetch_date),
     INDEX idx_status (status)
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
@@ -132,6 +139,8 @@ CREATE TABLE IF NOT EXISTS crawl_runs (
     started_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     completed_at TIMESTAMP NULL,
     pid INT,  -- Process ID
+    owner VARCHAR(255),  -- process holding the lock (host:pid)
+    heartbeat_at TIMESTAMP NULL,  -- refreshed while running; stale = holder died
     INDEX idx_fetch_date (fetch_date),
     INDEX idx_status (status)
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
@@ -188,6 +197,7 @@ CREATE TABLE IF NOT EXISTS processed_revenue_data (
     processed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     UNIQUE KEY unique_processed (slot, time_unit, fetch_date),
     INDEX idx_fetch_date (fetch_date),
+    INDEX idx_page_order (fetch_date DESC, slot, id),  -- keyset pagination /api/data
     INDEX idx_slot (slot),
     INDEX idx_time_unit (time_unit)
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
@@ -226,6 +236,67 @@ CREATE TABLE IF NOT EXISTS user_slots (
     FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
 
+-- ============================================
+-- 10. SHARE RECALC JOBS TABLE
+-- Tính lại processed_revenue_data sau khi đổi share config
+-- /shares chỉ ghi job, crawler/worker.py chạy job (gộp job trùng slot)
+-- ============================================
+CREATE TABLE IF NOT EXISTS share_recalc_jobs (
+    id INT AUTO_INCREMENT PRIMARY KEY,
+    slot VARCHAR(255) NOT NULL,                -- '*' = all slots
+    from_date DATE NULL,                       -- NULL = all dates
+    status VARCHAR(50) NOT NULL DEFAULT 'pending',  -- 'pending', 'running', 'completed', 'failed'
+    chunks_done INT DEFAULT 0,
+    chunks_total INT DEFAULT 0,
+    records_updated INT DEFAULT 0,
+    error_message TEXT,
+    created_by VARCHAR(255),
+    claimed_by VARCHAR(255),                   -- worker running the job (host:pid)
+    heartbeat_at TIMESTAMP NULL,               -- refreshed while running; stale = worker died
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    started_at TIMESTAMP NULL,
+    completed_at TIMESTAMP NULL,
+    INDEX idx_status (status),
+    INDEX idx_slot (slot)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
+-- ============================================
+-- 11. DATA VERSION
+-- Bộ đếm tăng mỗi khi crawler / tính lại share ghi dữ liệu;
+-- API dùng làm khóa cache response (ETag)
+-- ============================================
+CREATE TABLE IF NOT EXISTS data_version (
+    id INT PRIMARY KEY,
+    version BIGINT NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
+INSERT IGNORE INTO data_version (id, version) VALUES (1, 0);
+
+-- ============================================
+-- 12. CRAWL JOBS TABLE
+-- Crawl thủ công từ /api/trigger-crawl; crawler/worker.py chạy job
+-- (giữ lock crawl_runs), /api/crawl-status đọc tiến độ từng bước
+-- ============================================
+CREATE TABLE IF NOT EXISTS crawl_jobs (
+    id INT AUTO_INCREMENT PRIMARY KEY,
+    fetch_date DATE NOT NULL,
+    first_page_only BOOLEAN DEFAULT FALSE,
+    status VARCHAR(50) NOT NULL DEFAULT 'pending',  -- 'pending', 'running', 'completed', 'failed', 'skipped'
+    stage VARCHAR(50),                         -- 'login', 'pages', 'store', 'formulas', 'process'
+    progress TEXT,                             -- JSON: {stage: {"status": ..., "count": ...}}
+    result TEXT,                               -- JSON result of fetch_and_store
+    error_message TEXT,
+    created_by VARCHAR(255),
+    claimed_by VARCHAR(255),                   -- worker running the job (host:pid)
+    heartbeat_at TIMESTAMP NULL,               -- refreshed while running; stale = worker died
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    started_at TIMESTAMP NULL,
+    completed_at TIMESTAMP NULL,
+    INDEX idx_status (status),
+    INDEX idx_fetch_date (fetch_date)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
 -- ============================================
 -- END OF SCHEMA
 -- ============================================
@@ -0,0 +1,21 @@
+-- ============================================
+-- Migration: Add crawl_jobs table
+-- Run this on existing DB: /api/trigger-crawl now queues a job that
+-- crawler/worker.py runs; /api/crawl-status reads it
+-- ============================================
+CREATE TABLE IF NOT EXISTS crawl_jobs (
+    id INT AUTO_INCREMENT PRIMARY KEY,
+    fetch_date DATE NOT NULL,
+    first_page_only BOOLEAN DEFAULT FALSE,
+    status VARCHAR(50) NOT NULL DEFAULT 'pending',  -- 'pending', 'running', 'completed', 'failed', 'skipped'
+    stage VARCHAR(50),                         -- 'login', 'pages', 'store', 'formulas', 'process'
+    progress TEXT,                             -- JSON: {stage: {"status": ..., "count": ...}}
+    result TEXT,                               -- JSON result of fetch_and_store
+    error_message TEXT,
+    created_by VARCHAR(255),
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    started_at TIMESTAMP NULL,
+    completed_at TIMESTAMP NULL,
+    INDEX idx_status (status),
+    INDEX idx_fetch_date (fetch_date)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
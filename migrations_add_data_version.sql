@@ -0,0 +1,12 @@
+-- ============================================
+-- Migration: Add data_version table
+-- Counter bumped by the crawler and share recalculation; the API response
+-- cache and ETags are keyed on it
+-- ============================================
+CREATE TABLE IF NOT EXISTS data_version (
+    id INT PRIMARY KEY,
+    version BIGINT NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
+INSERT IGNORE INTO data_version (id, version) VALUES (1, 0);
@@ -0,0 +1,6 @@
+-- ============================================
+-- Migration: Add fetch_logs.metrics
+-- JSON with the crawl wall time and busy/idle/blocked time of each
+-- pipeline stage (login, pages, store, formulas, process)
+-- ============================================
+ALTER TABLE fetch_logs ADD COLUMN metrics TEXT NULL AFTER duration_seconds;
@@ -0,0 +1,7 @@
+-- ============================================
+-- Migration: Add keyset pagination indexes
+-- /api/data and /api/raw-data page by (fetch_date DESC, slot, id) with a cursor;
+-- these indexes serve that order and the "seek past the last row" condition
+-- ============================================
+ALTER TABLE processed_revenue_data ADD INDEX idx_page_order (fetch_date DESC, slot, id);
+ALTER TABLE raw_revenue_data ADD INDEX idx_page_order (fetch_date DESC, slot, id);
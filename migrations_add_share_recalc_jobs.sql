@@ -0,0 +1,21 @@
+-- ============================================
+-- Migration: Add share_recalc_jobs table
+-- Run this on existing DB: /shares create/delete now queue a recalculation job
+-- that crawler/worker.py processes in the background
+-- ============================================
+CREATE TABLE IF NOT EXISTS share_recalc_jobs (
+    id INT AUTO_INCREMENT PRIMARY KEY,
+    slot VARCHAR(255) NOT NULL,                -- '*' = all slots
+    from_date DATE NULL,                       -- NULL = all dates
+    status VARCHAR(50) NOT NULL DEFAULT 'pending',  -- 'pending', 'running', 'completed', 'failed'
+    chunks_done INT DEFAULT 0,
+    chunks_total INT DEFAULT 0,
+    records_updated INT DEFAULT 0,
+    error_message TEXT,
+    created_by VARCHAR(255),
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    started_at TIMESTAMP NULL,
+    completed_at TIMESTAMP NULL,
+    INDEX idx_status (status),
+    INDEX idx_slot (slot)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
@@ -0,0 +1,19 @@
+-- ============================================
+-- Migration: Add worker owner / heartbeat to job tables and crawl_runs
+-- crawler/worker.py records which worker claimed a job and refreshes
+-- heartbeat_at while it runs; only jobs whose heartbeat is older than
+-- WORKER_STALE_SECONDS are put back to pending. The crawl_runs lock does
+-- the same (CRAWL_LOCK_STALE_SECONDS) instead of checking the pid, which
+-- means nothing across the crawler and worker containers
+-- ============================================
+ALTER TABLE share_recalc_jobs
+    ADD COLUMN claimed_by VARCHAR(255) NULL AFTER created_by,
+    ADD COLUMN heartbeat_at TIMESTAMP NULL AFTER claimed_by;
+
+ALTER TABLE crawl_jobs
+    ADD COLUMN claimed_by VARCHAR(255) NULL AFTER created_by,
+    ADD COLUMN heartbeat_at TIMESTAMP NULL AFTER claimed_by;
+
+ALTER TABLE crawl_runs
+    ADD COLUMN owner VARCHAR(255) NULL AFTER pid,
+    ADD COLUMN heartbeat_at TIMESTAMP NULL AFTER owner;
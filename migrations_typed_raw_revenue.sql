@@ -0,0 +1,42 @@
+-- ============================================
+-- Migration: Typed numeric columns for raw_revenue_data
+-- Run this on existing DB once, before deploying the matching crawler/API.
+-- Numbers are parsed once at ingestion into DECIMAL columns (NULL for "-");
+-- the original scraped strings move to *_raw side columns for auditing.
+-- ============================================
+
+-- 1. Side columns keep the original strings
+ALTER TABLE raw_revenue_data
+    ADD COLUMN total_player_impr_raw VARCHAR(50) NULL AFTER net_revenue_usd,
+    ADD COLUMN total_ad_impr_raw VARCHAR(50) NULL AFTER total_player_impr_raw,
+    ADD COLUMN rpm_raw VARCHAR(50) NULL AFTER total_ad_impr_raw,
+    ADD COLUMN gross_revenue_usd_raw VARCHAR(50) NULL AFTER rpm_raw,
+    ADD COLUMN net_revenue_usd_raw VARCHAR(50) NULL AFTER gross_revenue_usd_raw;
+
+UPDATE raw_revenue_data SET
+    total_player_impr_raw = total_player_impr,
+    total_ad_impr_raw = total_ad_impr,
+    rpm_raw = rpm,
+    gross_revenue_usd_raw = gross_revenue_usd,
+    net_revenue_usd_raw = net_revenue_usd;
+
+-- 2. Normalize the strings in place: strip commas, "-" / empty / non-numeric → NULL
+UPDATE raw_revenue_data SET
+    total_player_impr = CASE WHEN REPLACE(TRIM(total_player_impr), ',', '') REGEXP '^-?[0-9]+(\\.[0-9]+)?$'
+        THEN REPLACE(TRIM(total_player_impr), ',', '') ELSE NULL END,
+    total_ad_impr = CASE WHEN REPLACE(TRIM(total_ad_impr), ',', '') REGEXP '^-?[0-9]+(\\.[0-9]+)?$'
+        THEN REPLACE(TRIM(total_ad_impr), ',', '') ELSE NULL END,
+    rpm = CASE WHEN REPLACE(TRIM(rpm), ',', '') REGEXP '^-?[0-9]+(\\.[0-9]+)?$'
+        THEN REPLACE(TRIM(rpm), ',', '') ELSE NULL END,
+    gross_revenue_usd = CASE WHEN REPLACE(TRIM(gross_revenue_usd), ',', '') REGEXP '^-?[0-9]+(\\.[0-9]+)?$'
+        THEN REPLACE(TRIM(gross_revenue_usd), ',', '') ELSE NULL END,
+    net_revenue_usd = CASE WHEN REPLACE(TRIM(net_revenue_usd), ',', '') REGEXP '^-?[0-9]+(\\.[0-9]+)?$'
+        THEN REPLACE(TRIM(net_revenue_usd), ',', '') ELSE NULL END;
+
+-- 3. Convert to DECIMAL (every remaining value is a plain number)
+ALTER TABLE raw_revenue_data
+    MODIFY COLUMN total_player_impr DECIMAL(20,2) NULL,
+    MODIFY COLUMN total_ad_impr DECIMAL(20,2) NULL,
+    MODIFY COLUMN rpm DECIMAL(20,6) NULL,
+    MODIFY COLUMN gross_revenue_usd DECIMAL(20,6) NULL,
+    MODIFY COLUMN net_revenue_usd DECIMAL(20,6) NULL;
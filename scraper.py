@@ -9,17 +9,280 @@ from bs4 import BeautifulSoup
 import time
 import csv
 import json
-from typing import List, Dict
+from typing import List, Dict, Iterator, Tuple
 import sys
 from urllib.parse import urljoin, urlparse, parse_qs
+import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import NamedTuple, Optional
+from requests.adapters import HTTPAdapter
+from contextlib import nullcontext
+
+try:
+    from lxml import etree, html as lxml_html
+except ImportError:
+    etree = None
+    lxml_html = None
+
+# Số lần thử lại một trang lỗi (request / không thấy bảng) trước khi bỏ cuộc
+PAGE_RETRIES = int(os.getenv("SCRAPER_PAGE_RETRIES", "2"))
+PAGE_RETRY_DELAY = float(os.getenv("SCRAPER_PAGE_RETRY_DELAY", "2"))
+
+
+class PageFetchError(Exception):
+    """Một trang sau trang 1 vẫn lỗi sau khi thử lại: dừng cả lần scrape thay vì trả về dữ liệu thiếu trang"""
+
+
+class _HostRateLimiter:
+    """Ngân sách request theo host: tối đa max_requests_per_second request/giây cho mỗi host"""
+    
+    def __init__(self, max_requests_per_second: float = 2.0):
+        self.min_interval = 1.0 / max_requests_per_second if max_requests_per_second > 0 else 0.0
+        self._next_slot = {}
+        self._lock = threading.Lock()
+    
+    def acquire(self, url: str):
+        """Chờ tới lượt của host; an toàn khi gọi từ nhiều thread"""
+        host = urlparse(url).netloc
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot.get(host, now))
+            self._next_slot[host] = slot + self.min_interval
+        wait = slot - time.monotonic()
+        if wait > 0:
+            time.sleep(wait)
+
+
+class ParsedPage(NamedTuple):
+    """Kết quả parse một trang changelist"""
+    headers: List[str]
+    rows: List[Dict]
+    current_page: Optional[int]   # số trong span.this-page (None nếu không có)
+    max_page: Optional[int]       # số trang lớn nhất trong paginator (None nếu không có paginator)
+
+
+def _slice_result_table(html: str) -> Tuple[Optional[str], str]:
+    """
+    Cắt HTML thành (đoạn <table id="result_list">...</table>, phần đuôi từ changelist-footer).
+    Bỏ qua header/menu/script của trang để parser chỉ phải xử lý phần cần thiết.
+    """
+    match = re.search(r'<table[^>]*\bid=["\']?result_list\b', html)
+    if not match:
+        return None, ''
+    start = match.start()
+    end = html.find('</table>', start)
+    end = len(html) if end == -1 else end + len('</table>')
+    footer = re.search(r'<div[^>]*\bclass=["\'][^"\']*\bchangelist-footer\b', html[end:])
+    return html[start:end], (html[end + footer.start():] if footer else '')
+
+
+def _page_number_from_href(href: str) -> Optional[int]:
+    """Lấy tham số p từ link của paginator"""
+    if 'p=' not in href:
+        return None
+    try:
+        link_params = parse_qs(urlparse(href).query)
+        if 'p' in link_params:
+            return int(link_params['p'][0])
+    except (ValueError, TypeError):
+        pass
+    return None
+
+
+class BeautifulSoupTableParser:
+    """Parser gốc: BeautifulSoup + html.parser trên toàn bộ trang (chậm nhất, không cần lxml)"""
+    name = 'bs4'
+    
+    def _soup(self, html: str):
+        return BeautifulSoup(html, 'html.parser')
+    
+    def _fragments(self, html: str):
+        soup = self._soup(html)
+        return soup.find('table', {'id': 'result_list'}), soup.find('div', class_='changelist-footer')
+    
+    def parse(self, html: str, headers: Optional[List[str]] = None) -> Optional[ParsedPage]:
+        """Parse bảng result_list; headers=None thì đọc từ thead. Trả về None nếu không có bảng."""
+        table, paginator = self._fragments(html)
+        if not table:
+            return None
+        if headers is None:
+            headers = self._extract_headers(table)
+        current_page, max_page = self._page_range(paginator)
+        return ParsedPage(headers, self._extract_rows(table, headers), current_page, max_page)
+    
+    def _extract_headers(self, table) -> List[str]:
+        headers = []
+        thead = table.find('thead')
+        if thead:
+            header_row = thead.find('tr')
+            if header_row:
+                for th in header_row.find_all('th'):
+                    # Lấy text từ th, có thể có nested div
+                    div = th.find('div', class_='text')
+                    if div:
+                        header_text = div.get_text(strip=True)
+                    else:
+                        header_text = th.get_text(strip=True)
+                    # Giữ nguyên case của header (không lowercase)
+                    headers.append(header_text)
+        return headers
+    
+    def _extract_rows(self, table, headers: List[str]) -> List[Dict]:
+        rows_data = []
+        tbody = table.find('tbody')
+        if tbody:
+            for row in tbody.find_all('tr'):
+                cells = row.find_all('td')
+                if len(cells) == len(headers):
+                    rows_data.append({headers[i]: cell.get_text(strip=True) for i, cell in enumerate(cells)})
+        return rows_data
+    
+    def _page_range(self, paginator) -> Tuple[Optional[int], Optional[int]]:
+        if not paginator:
+            return None, None
+        current_page = None
+        this_page_span = paginator.find('span', class_='this-page')
+        if this_page_span:
+            try:
+                current_page = int(this_page_span.get_text(strip=True))
+            except ValueError:
+                pass
+        page_numbers = [_page_number_from_href(link.get('href', '')) for link in paginator.find_all('a', href=True)]
+        page_numbers = [n for n in page_numbers if n is not None]
+        if current_page is not None:
+            page_numbers.append(current_page)
+        return current_page, (max(page_numbers) if page_numbers else None)
+
+
+class SelectorTableParser(BeautifulSoupTableParser):
+    """Chỉ parse đoạn #result_list và paginator (lxml nếu có), rồi dùng CSS selector"""
+    name = 'selector'
+    
+    def _soup(self, html: str):
+        return BeautifulSoup(html, 'lxml' if etree is not None else 'html.parser')
+    
+    def _fragments(self, html: str):
+        table_html, footer_html = _slice_result_table(html)
+        if table_html is None:
+            return None, None
+        table = self._soup(table_html).select_one('#result_list')
+        paginator = self._soup(footer_html).select_one('div.changelist-footer') if footer_html else None
+        return table, paginator
+    
+    def _extract_headers(self, table) -> List[str]:
+        headers = []
+        for th in table.select('thead > tr:first-of-type > th'):
+            div = th.select_one('div.text')
+            headers.append((div or th).get_text(strip=True))
+        return headers
+    
+    def _extract_rows(self, table, headers: List[str]) -> List[Dict]:
+        rows_data = []
+        tbody = table.select_one('tbody')
+        if tbody:
+            for row in tbody.select('tr'):
+                cells = row.select('td')
+                if len(cells) == len(headers):
+                    rows_data.append({headers[i]: cell.get_text(strip=True) for i, cell in enumerate(cells)})
+        return rows_data
+
+
+class LxmlTableParser:
+    """lxml + XPath trên đoạn #result_list và paginator (nhanh nhất)"""
+    name = 'lxml'
+    
+    _CLASS = "contains(concat(' ', normalize-space(@class), ' '), ' %s ')"
+    
+    @staticmethod
+    def _text(element) -> str:
+        # Tương đương get_text(strip=True) của BeautifulSoup
+        return ''.join(t.strip() for t in element.itertext())
+    
+    def parse(self, html: str, headers: Optional[List[str]] = None) -> Optional[ParsedPage]:
+        table_html, footer_html = _slice_result_table(html)
+        if table_html is None:
+            return None
+        tables = lxml_html.fromstring(table_html).xpath('descendant-or-self::table[@id="result_list"]')
+        if not tables:
+            return None
+        table = tables[0]
+        
+        if headers is None:
+            headers = []
+            for th in table.xpath('(.//thead)[1]/tr[1]/th'):
+                div = th.xpath('.//div[%s]' % (self._CLASS % 'text'))
+                headers.append(self._text(div[0] if div else th))
+        
+        rows_data = []
+        for row in table.xpath('(.//tbody)[1]//tr'):
+            cells = row.xpath('.//td')
+            if len(cells) == len(headers):
+                rows_data.append({headers[i]: self._text(cell) for i, cell in enumerate(cells)})
+        
+        current_page, max_page = None, None
+        if footer_html:
+            paginators = lxml_html.fromstring(footer_html).xpath(
+                'descendant-or-self::div[%s]' % (self._CLASS % 'changelist-footer'))
+            if paginators:
+                paginator = paginators[0]
+                this_page = paginator.xpath('(.//span[%s])[1]' % (self._CLASS % 'this-page'))
+                if this_page:
+                    try:
+                        current_page = int(self._text(this_page[0]))
+                    except ValueError:
+                        pass
+                page_numbers = [_page_number_from_href(href) for href in paginator.xpath('.//a/@href')]
+                page_numbers = [n for n in page_numbers if n is not None]
+                if current_page is not None:
+                    page_numbers.append(current_page)
+                max_page = max(page_numbers) if page_numbers else None
+        
+        return ParsedPage(headers, rows_data, current_page, max_page)
+
+
+TABLE_PARSERS = {
+    BeautifulSoupTableParser.name: BeautifulSoupTableParser,
+    SelectorTableParser.name: SelectorTableParser,
+    LxmlTableParser.name: LxmlTableParser,
+}
+
+
+def get_table_parser(name: str = None):
+    """Tạo parser theo tên (lxml | selector | bs4); không có lxml thì dùng bs4"""
+    name = (name or os.getenv("SCRAPER_PARSER", "lxml")).lower()
+    if name not in TABLE_PARSERS:
+        raise ValueError(f"Unknown parser backend: {name} (choose from {', '.join(TABLE_PARSERS)})")
+    if name == LxmlTableParser.name and etree is None:
+        print("⚠️  lxml chưa được cài, dùng BeautifulSoup html.parser")
+        name = BeautifulSoupTableParser.name
+    return TABLE_PARSERS[name]()
 
 
 class RevenueShareScraper:
-    def __init__(self, username: str, password: str, base_url: str = "https://gstudio.gliacloud.com"):
+    # Giới hạn số trang để tránh vòng lặp vô hạn
+    MAX_PAGES = 1000
+    
+    LOGIN_PATH = "/ad-sharing/login/"
+    
+    def __init__(self, username: str, password: str, base_url: str = "https://gstudio.gliacloud.com",
+                 parser: str = None, session_file: str = None, timings=None):
         self.username = username
         self.password = password
         self.base_url = base_url
+        # File lưu cookie (sessionid/csrftoken) để dùng lại giữa các lần chạy; None = không lưu
+        self.session_file = session_file or os.getenv("SCRAPER_SESSION_FILE")
+        self._login_lock = threading.Lock()
+        self._login_generation = 0
+        # Backend parse bảng: lxml (mặc định) | selector | bs4, xem get_table_parser
+        self.parser = get_table_parser(parser)
         self.session = requests.Session()
+        # Thống kê từng trang của lần scrape gần nhất: page, rows, latency (giây)
+        self.page_stats = []
+        # Collector thời gian fetch / parse / delay / login lại + pages, bytes, rows do người gọi truyền vào
+        # (bất kỳ object có stage(name) và count(name, n), vd. crawler.timing.RunTimings); None = không đo
+        self.timings = timings
         
         # Giả lập trình duyệt thật
         self.session.headers.update({
@@ -31,18 +294,115 @@ class RevenueShareScraper:
             'Upgrade-Insecure-Requests': '1',
         })
     
+    def _timed(self, stage: str):
+        return self.timings.stage(stage) if self.timings is not None else nullcontext()
+    
+    def _count(self, name: str, value: int = 1):
+        if self.timings is not None:
+            self.timings.count(name, value)
+    
     def _human_delay(self, min_seconds: float = 1.0, max_seconds: float = 3.0):
         """Thêm delay ngẫu nhiên để giả lập hành vi người dùng"""
         import random
         delay = random.uniform(min_seconds, max_seconds)
         time.sleep(delay)
     
+    def load_session(self) -> bool:
+        """Nạp cookie đã lưu từ self.session_file. Trả về True nếu có sessionid dùng được."""
+        if not self.session_file or not os.path.exists(self.session_file):
+            return False
+        try:
+            with open(self.session_file, 'r', encoding='utf-8') as f:
+                saved = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"⚠️  Không đọc được session đã lưu: {e}")
+            return False
+        
+        # Chỉ dùng lại session của đúng tài khoản + site
+        if saved.get('username') != self.username or saved.get('base_url') != self.base_url:
+            return False
+        
+        now = time.time()
+        cookies = [c for c in saved.get('cookies', []) if not c.get('expires') or c['expires'] > now]
+        if not any(c['name'] == 'sessionid' for c in cookies):
+            return False
+        
+        for c in cookies:
+            self.session.cookies.set(
+                c['name'], c['value'],
+                domain=c.get('domain', ''), path=c.get('path', '/'),
+                expires=c.get('expires'), secure=c.get('secure', False)
+            )
+        return True
+    
+    def save_session(self):
+        """Lưu cookie hiện tại vào self.session_file (ghi file tạm rồi rename, quyền 600)"""
+        if not self.session_file:
+            return
+        saved = {
+            'username': self.username,
+            'base_url': self.base_url,
+            'saved_at': time.time(),
+            'cookies': [
+                {'name': c.name, 'value': c.value, 'domain': c.domain, 'path': c.path,
+                 'expires': c.expires, 'secure': c.secure}
+                for c in self.session.cookies
+            ],
+        }
+        tmp_file = f"{self.session_file}.tmp"
+        try:
+            directory = os.path.dirname(self.session_file)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with open(tmp_file, 'w', encoding='utf-8') as f:
+                json.dump(saved, f)
+            os.chmod(tmp_file, 0o600)
+            os.replace(tmp_file, self.session_file)
+        except OSError as e:
+            print(f"⚠️  Không lưu được session: {e}")
+    
+    def clear_session(self):
+        """Xóa cookie trong bộ nhớ và file session đã lưu"""
+        self.session.cookies.clear()
+        if self.session_file and os.path.exists(self.session_file):
+            try:
+                os.remove(self.session_file)
+            except OSError:
+                pass
+    
+    def ensure_logged_in(self) -> bool:
+        """
+        Dùng lại session đã lưu nếu có, chỉ login khi chưa có session.
+        Session hết hạn sẽ được phát hiện khi request dữ liệu bị redirect về trang login
+        (xem _fetch_page), lúc đó mới login lại.
+        """
+        if self.load_session():
+            print("✅ Dùng lại session đã lưu (bỏ qua đăng nhập)")
+            return True
+        return self.login()
+    
+    def _is_login_redirect(self, response) -> bool:
+        """Request dữ liệu bị chuyển về trang login => session đã hết hạn"""
+        return urlparse(response.url).path.startswith(self.LOGIN_PATH)
+    
+    def _relogin(self, generation: int) -> bool:
+        """Login lại một lần cho tất cả worker đang gặp session hết hạn"""
+        with self._login_lock:
+            if generation != self._login_generation:
+                # Worker khác đã login lại rồi
+                return True
+            print("⚠️  Session hết hạn (bị redirect về trang login), đăng nhập lại...")
+            self.session.cookies.clear()
+            self._count("relogins")
+            with self._timed("login"):
+                return self.login()
+    
     def login(self, redirect_url: str = None) -> bool:
         """Đăng nhập vào hệ thống"""
         print("Đang truy cập trang đăng nhập...")
         
         # URL đăng nhập chính xác dựa trên cấu trúc form
-        login_path = "/ad-sharing/login/"
+        login_path = self.LOGIN_PATH
         login_url = urljoin(self.base_url, login_path)
         
         # Nếu có redirect_url, thêm vào query string
@@ -162,6 +522,8 @@ class RevenueShareScraper:
                 # Kiểm tra xem có redirect về login không
                 if 'login' not in test_response.url.lower():
                     print("✅ Đăng nhập thành công!")
+                    self._login_generation += 1
+                    self.save_session()
                     return True
                 else:
                     print("⚠️  Cảnh báo: Có thể đăng nhập không thành công (redirect về login)")
@@ -195,186 +557,187 @@ class RevenueShareScraper:
         new_query = '&'.join(query_parts)
         return f"{parsed_url.scheme}://{parsed_url.netloc}{parsed_url.path}?{new_query}"
     
-    def scrape_table_first_page_only(self, url: str) -> List[Dict]:
-        """Scrape dữ liệu từ bảng - chỉ trang đầu tiên"""
-        print(f"Đang truy cập URL: {url}")
-        
-        all_data = []
-        headers = None
-        
-        current_url = url
-        print(f"Đang lấy dữ liệu trang 1...")
-        
-        try:
-            response = self.session.get(current_url)
-            response.raise_for_status()
-        except requests.RequestException as e:
-            print(f"Lỗi khi truy cập trang: {e}")
-            return []
-        
-        self._human_delay(1, 2)
-        
-        # Parse HTML
-        soup = BeautifulSoup(response.text, 'html.parser')
-        
-        # Tìm bảng
-        table = soup.find('table', {'id': 'result_list'})
-        if not table:
-            print(f"Không tìm thấy bảng")
-            return []
-        
-        # Lấy headers
-        if headers is None:
-            headers = []
-            thead = table.find('thead')
-            if thead:
-                header_row = thead.find('tr')
-                if header_row:
-                    for th in header_row.find_all('th'):
-                        # Lấy text từ th, có thể có nested div
-                        div = th.find('div', class_='text')
-                        if div:
-                            header_text = div.get_text(strip=True)
-                        else:
-                            header_text = th.get_text(strip=True)
-                        # Giữ nguyên case của header (không lowercase)
-                        headers.append(header_text)
-        
-        # Lấy dữ liệu từ tbody
-        tbody = table.find('tbody')
-        if tbody:
-            rows = tbody.find_all('tr')
-            for row in rows:
-                cells = row.find_all('td')
-                if len(cells) == len(headers):
-                    row_data = {}
-                    for i, cell in enumerate(cells):
-                        cell_text = cell.get_text(strip=True)
-                        row_data[headers[i]] = cell_text
-                    all_data.append(row_data)
-        
-        print(f"Đã lấy được {len(all_data)} dòng dữ liệu từ trang 1")
-        return all_data
+    def _fetch_page(self, url: str, page: int, limiter: '_HostRateLimiter' = None) -> Tuple[str, float]:
+        """Tải một trang của bảng, trả về (HTML, latency tính bằng giây)"""
+        current_url = self._build_page_url(url, page)
+        if limiter is not None:
+            limiter.acquire(current_url)
+        generation = self._login_generation
+        started = time.perf_counter()
+        response = self._get_page(current_url)
+        if self._is_login_redirect(response):
+            if not self._relogin(generation):
+                raise requests.RequestException(f"Session hết hạn và đăng nhập lại thất bại (trang {page})")
+            response = self._get_page(current_url)
+            if self._is_login_redirect(response):
+                raise requests.RequestException(f"Vẫn bị redirect về trang login (trang {page})")
+        response.raise_for_status()
+        self._count("pages")
+        return response.text, time.perf_counter() - started
     
-    def scrape_table(self, url: str) -> List[Dict]:
-        """Scrape dữ liệu từ bảng"""
+    def _get_page(self, url: str):
+        """GET một trang dữ liệu (đo thời gian fetch + số byte đã tải)"""
+        with self._timed("fetch"):
+            response = self.session.get(url)
+        self._count("bytes", len(response.content))
+        return response
+    
+    def _parse(self, html: str, headers: Optional[List[str]]) -> Optional[ParsedPage]:
+        with self._timed("parse"):
+            parsed = self.parser.parse(html, headers)
+        if parsed is not None:
+            self._count("rows_parsed", len(parsed.rows))
+        return parsed
+    
+    def _record_page(self, page: int, rows: List[Dict], latency: float):
+        """Lưu thống kê trang vào self.page_stats và in ra log"""
+        self.page_stats.append({'page': page, 'rows': len(rows), 'latency': latency})
+        print(f"  → Lấy được {len(rows)} dòng từ trang {page} ({latency:.2f}s)")
+    
+    def _load_page(self, url: str, page: int, headers: Optional[List[str]],
+                   limiter: '_HostRateLimiter' = None) -> Tuple[ParsedPage, float]:
+        """
+        Tải và parse một trang, thử lại PAGE_RETRIES lần khi request lỗi hoặc không thấy bảng.
+        Vẫn lỗi → PageFetchError. Trả về (ParsedPage, latency giây của lần thành công).
+        """
+        for attempt in range(PAGE_RETRIES + 1):
+            try:
+                html, latency = self._fetch_page(url, page, limiter)
+                parsed = self._parse(html, headers)
+                if parsed is None:
+                    raise ValueError(f"Không tìm thấy bảng trên trang {page}")
+                return parsed, latency
+            except (requests.RequestException, ValueError) as e:
+                print(f"Lỗi khi truy cập trang {page} (lần {attempt + 1}/{PAGE_RETRIES + 1}): {e}")
+                if attempt == PAGE_RETRIES:
+                    raise PageFetchError(f"Trang {page} lỗi sau {PAGE_RETRIES + 1} lần thử: {e}") from e
+                self._count("page_retries")
+                time.sleep(PAGE_RETRY_DELAY * (attempt + 1))
+    
+    def _parse_page(self, url: str, page: int, headers: List[str], limiter: '_HostRateLimiter') -> Dict:
+        """Worker: tải và parse một trang (dùng chung session với các worker khác)"""
+        parsed, latency = self._load_page(url, page, headers, limiter)
+        return {'rows': parsed.rows, 'latency': latency}
+    
+    def iter_pages(self, url: str, first_page_only: bool = False, max_workers: int = 1,
+                   max_requests_per_second: float = 2.0) -> Iterator[Tuple[int, List[Dict]]]:
+        """
+        Generator trả về (số trang, các dòng của trang) theo đúng thứ tự trang,
+        ngay khi mỗi trang được parse xong.
+        
+        - first_page_only: chỉ lấy trang 1
+        - max_workers > 1: sau khi trang 1 cho biết số trang lớn nhất trong paginator,
+          các trang 2..N được tải song song bằng thread pool dùng chung session,
+          giới hạn max_requests_per_second request/giây cho mỗi host
+        
+        Trang lỗi được thử lại PAGE_RETRIES lần; một trang sau trang 1 vẫn lỗi thì raise
+        PageFetchError (cả hai chế độ), để lần crawl bị đánh dấu failed thay vì thiếu dòng.
+        
+        Latency từng trang được lưu trong self.page_stats; nếu có self.timings thì
+        thời gian fetch / parse / delay, số trang, số byte và số dòng được cộng vào đó.
+        """
         print(f"Đang truy cập URL: {url}")
+        self.page_stats = []
+        limiter = _HostRateLimiter(max_requests_per_second) if max_workers > 1 else None
+        
+        if limiter is not None:
+            # Connection pool đủ lớn cho số worker, tránh "Connection pool is full"
+            adapter = HTTPAdapter(pool_connections=max_workers, pool_maxsize=max_workers)
+            self.session.mount('https://', adapter)
+            self.session.mount('http://', adapter)
         
-        all_data = []
         page = 1
         headers = None
-        
         while True:
-            current_url = self._build_page_url(url, page)
             print(f"Đang lấy dữ liệu trang {page}...")
-            
+            # Parse HTML (chỉ phần bảng result_list + paginator)
             try:
-                response = self.session.get(current_url)
-                response.raise_for_status()
-            except requests.RequestException as e:
-                print(f"Lỗi khi truy cập trang {page}: {e}")
-                break
-            
-            self._human_delay(1, 2)
-            
-            # Parse HTML
-            soup = BeautifulSoup(response.text, 'html.parser')
-            
-            # Tìm bảng
-            table = soup.find('table', {'id': 'result_list'})
-            if not table:
-                print(f"Không tìm thấy bảng trên trang {page}")
-                break
+                parsed, latency = self._load_page(url, page, headers, limiter)
+            except PageFetchError:
+                if page > 1:
+                    raise
+                # Trang 1 lỗi: không có dữ liệu nào (người gọi báo "No data fetched")
+                return
             
             # Lấy headers (chỉ lần đầu)
             if headers is None:
-                headers = []
-                thead = table.find('thead')
-                if thead:
-                    header_row = thead.find('tr')
-                    if header_row:
-                        for th in header_row.find_all('th'):
-                            # Lấy text từ th, có thể có nested div
-                            div = th.find('div', class_='text')
-                            if div:
-                                header_text = div.get_text(strip=True)
-                            else:
-                                header_text = th.get_text(strip=True)
-                            # Giữ nguyên case của header (không lowercase)
-                            headers.append(header_text)
+                headers = parsed.headers
             
-            # Lấy dữ liệu từ tbody
-            tbody = table.find('tbody')
-            page_data_count = 0
-            if tbody:
-                rows = tbody.find_all('tr')
-                for row in rows:
-                    cells = row.find_all('td')
-                    if len(cells) == len(headers):
-                        row_data = {}
-                        for i, cell in enumerate(cells):
-                            cell_text = cell.get_text(strip=True)
-                            row_data[headers[i]] = cell_text
-                        all_data.append(row_data)
-                        page_data_count += 1
+            rows = parsed.rows
+            self._record_page(page, rows, latency)
+            yield page, rows
             
-            print(f"  → Lấy được {page_data_count} dòng từ trang {page}")
-            
-            # Kiểm tra phân trang
-            paginator = soup.find('div', class_='changelist-footer')
-            has_next_page = False
-            
-            if paginator:
-                # Tìm trang hiện tại
-                this_page_span = paginator.find('span', class_='this-page')
-                current_page_num = page
-                if this_page_span:
-                    try:
-                        current_page_num = int(this_page_span.get_text(strip=True))
-                    except:
-                        pass
-                
-                # Tìm tất cả các link trang để xác định trang cuối
-                page_links = paginator.find_all('a', href=True)
-                max_page_num = current_page_num
-                
-                for link in page_links:
-                    href = link.get('href', '')
-                    if 'p=' in href:
-                        try:
-                            # Parse URL để lấy số trang
-                            link_url = urljoin(self.base_url, href)
-                            parsed_link = urlparse(link_url)
-                            link_params = parse_qs(parsed_link.query)
-                            if 'p' in link_params:
-                                link_page = int(link_params['p'][0])
-                                max_page_num = max(max_page_num, link_page)
-                        except:
-                            pass
-                
-                # Kiểm tra xem có trang tiếp theo không
-                if current_page_num < max_page_num:
-                    has_next_page = True
-                elif page_data_count == 0:
-                    # Không có dữ liệu trên trang này, dừng lại
-                    has_next_page = False
-                else:
-                    # Có thể đã đến trang cuối, nhưng kiểm tra thêm
-                    # Nếu không có link nào có số trang lớn hơn trang hiện tại
-                    has_next_page = False
+            if first_page_only:
+                return
             
-            if not has_next_page:
+            # Kiểm tra phân trang: chỉ còn trang tiếp theo nếu có link tới trang lớn hơn
+            current_page_num = parsed.current_page or page
+            max_page_num = max(parsed.max_page or page, current_page_num)
+            if max_page_num > self.MAX_PAGES:
+                print(f"Đã đạt giới hạn {self.MAX_PAGES} trang")
+                max_page_num = self.MAX_PAGES
+            if current_page_num >= max_page_num:
                 print(f"Đã đến trang cuối (trang {page})")
+                return
+            
+            if limiter is not None:
                 break
             
             page += 1
-            
-            # Giới hạn số trang để tránh vòng lặp vô hạn
-            if page > 1000:
-                print("Đã đạt giới hạn 1000 trang")
-                break
+            with self._timed("delay"):
+                self._human_delay(1, 2)
         
-        print(f"\nĐã lấy được {len(all_data)} dòng dữ liệu từ {page - 1} trang")
+        # Chế độ song song: tải trang 2..N, trả về theo thứ tự trang
+        print(f"Đang tải song song trang 2..{max_page_num} ({max_workers} worker)...")
+        executor = ThreadPoolExecutor(max_workers=max_workers)
+        try:
+            futures = [
+                (p, executor.submit(self._parse_page, url, p, headers, limiter))
+                for p in range(2, max_page_num + 1)
+            ]
+            for p, future in futures:
+                # Trang lỗi sau khi thử lại → PageFetchError, không bỏ qua trang (dữ liệu sẽ thiếu)
+                result = future.result()
+                self._record_page(p, result['rows'], result['latency'])
+                yield p, result['rows']
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+    
+    def iter_rows(self, url: str, **kwargs) -> Iterator[Dict]:
+        """Generator trả về từng dòng ngay khi trang chứa nó được parse (tham số như iter_pages)"""
+        for _, rows in self.iter_pages(url, **kwargs):
+            yield from rows
+    
+    def _log_scrape_summary(self, row_count: int):
+        latencies = [s['latency'] for s in self.page_stats]
+        if latencies:
+            print(f"\nĐã lấy được {row_count} dòng dữ liệu từ {len(latencies)} trang "
+                  f"(latency trung bình {sum(latencies) / len(latencies):.2f}s, chậm nhất {max(latencies):.2f}s)")
+    
+    def scrape_table_first_page_only(self, url: str) -> List[Dict]:
+        """Scrape dữ liệu từ bảng - chỉ trang đầu tiên"""
+        all_data = list(self.iter_rows(url, first_page_only=True))
+        print(f"Đã lấy được {len(all_data)} dòng dữ liệu từ trang 1")
+        return all_data
+    
+    def scrape_table(self, url: str) -> List[Dict]:
+        """Scrape dữ liệu từ bảng"""
+        all_data = list(self.iter_rows(url))
+        self._log_scrape_summary(len(all_data))
+        return all_data
+    
+    def scrape_table_concurrent(self, url: str, max_workers: int = 4,
+                                max_requests_per_second: float = 2.0) -> List[Dict]:
+        """
+        Scrape dữ liệu từ bảng, tải song song các trang còn lại.
+        Trang 1 được tải trước để đọc số trang lớn nhất từ paginator, sau đó các trang
+        2..N được tải bằng thread pool giới hạn max_workers, dùng chung một session.
+        max_requests_per_second là ngân sách request cho mỗi host (chia đều giữa các worker).
+        Kết quả trả về theo đúng thứ tự trang; latency từng trang lưu trong self.page_stats.
+        """
+        all_data = list(self.iter_rows(url, max_workers=max_workers,
+                                       max_requests_per_second=max_requests_per_second))
+        self._log_scrape_summary(len(all_data))
         return all_data
     
     def save_to_csv(self, data: List[Dict], filename: str = "revenue_share_data.csv"):
@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+"""
+Test formula engine - biểu thức công thức chỉ được dùng whitelist (chạy: python test_formula_engine.py hoặc pytest)
+"""
+
+from decimal import Decimal
+
+from backend.formula_engine import CompiledFormula, FormulaError, SAFE_MATH
+
+
+def _rejected(expression: str) -> bool:
+    try:
+        CompiledFormula(expression)
+    except FormulaError:
+        return True
+    return False
+
+
+def test_math_functions_allowed():
+    """math.<hàm> / hằng số trong whitelist vẫn chạy được"""
+    formula = CompiledFormula("math.sqrt(net_revenue_usd) + math.pi * 0")
+    assert formula.evaluate({"net_revenue_usd": Decimal("16")}) == Decimal("4.0")
+
+
+def test_dunder_attributes_rejected():
+    """Thuộc tính dunder của math bị chặn ngay lúc compile, SAFE_MATH không bị sửa"""
+    sqrt = SAFE_MATH.sqrt
+    for expression in (
+        'math.__setattr__("sqrt", abs)',
+        "math.__class__",
+        "math.__dict__",
+        "math.__init__",
+        "math._decimal_result",
+    ):
+        assert _rejected(expression), expression
+    assert SAFE_MATH.sqrt is sqrt
+
+
+def test_unknown_names_rejected():
+    assert _rejected("__import__('os')")
+    assert _rejected("net_revenue_usd.__class__")
+
+
+if __name__ == "__main__":
+    test_math_functions_allowed()
+    test_dunder_attributes_rejected()
+    test_unknown_names_rejected()
+    print("✅ formula engine tests passed")
@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""
+Test /api/raw-data (backend/app.py) - số dạng "1,000" / "-" được parse lúc ghi, chuỗi gốc giữ ở *_raw
+(chạy: python test_raw_data_api.py hoặc pytest; dùng SQLite tạm)
+"""
+
+import os
+import tempfile
+from decimal import Decimal
+
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from backend.app import app, Base, get_db
+
+engine = create_engine("sqlite:///" + os.path.join(tempfile.mkdtemp(), "raw_data_api.db"),
+                       connect_args={"check_same_thread": False})
+Base.metadata.create_all(engine)
+TestSession = sessionmaker(bind=engine)
+
+
+def _test_db():
+    db = TestSession()
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+app.dependency_overrides[get_db] = _test_db
+client = TestClient(app)
+
+ROW = {
+    "channel": "ch1", "slot": "s1", "time_unit": "2026-01-01", "fetch_date": "2026-01-01",
+    "total_player_impr": "1,000", "total_ad_impr": "-", "rpm": "2.5",
+    "gross_revenue_usd": "1,234.567890", "net_revenue_usd": "",
+}
+
+
+def test_create_and_read_back():
+    response = client.post("/api/raw-data", json=ROW)
+    assert response.status_code == 201, response.text
+    data_id = response.json()["id"]
+
+    for data in (client.get(f"/api/raw-data/{data_id}").json(), client.get("/api/raw-data").json()[0]):
+        assert Decimal(data["total_player_impr"]) == Decimal("1000")
+        assert data["total_ad_impr"] is None
+        assert Decimal(data["rpm"]) == Decimal("2.5")
+        assert Decimal(data["gross_revenue_usd"]) == Decimal("1234.56789")
+        assert data["net_revenue_usd"] is None
+        assert data["total_player_impr_raw"] == "1,000"
+        assert data["total_ad_impr_raw"] == "-"
+        assert data["net_revenue_usd_raw"] is None
+
+
+def test_bulk_upserts():
+    rows = [dict(ROW, slot="s2", total_ad_impr="2,000"), dict(ROW, fetch_date="2026-01-02", rpm="-")]
+    assert client.post("/api/raw-data/bulk", json=rows).json()["created"] == 2
+    # Gửi lại: ghi đè, không tạo dòng trùng
+    response = client.post("/api/raw-data/bulk", json=rows).json()
+    assert (response["created"], response["updated"]) == (0, 2)
+
+    s2 = [r for r in client.get("/api/raw-data", params={"channel": "ch1"}).json() if r["slot"] == "s2"]
+    assert Decimal(s2[0]["total_ad_impr"]) == Decimal("2000") and s2[0]["total_ad_impr_raw"] == "2,000"
+
+
+if __name__ == "__main__":
+    test_create_and_read_back()
+    test_bulk_upserts()
+    print("✅ raw data API tests passed")